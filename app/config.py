@@ -1,5 +1,6 @@
 from pydantic_settings import BaseSettings
 from functools import lru_cache
+from typing import Optional
 
 class Settings(BaseSettings):
     DATABASE_URL: str
@@ -9,6 +10,109 @@ class Settings(BaseSettings):
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
     APP_NAME: str = "Sistema Clínico Interoperable"
     DEBUG: bool = True
+    
+    # Pool de conexiones a PostgreSQL (AsyncSession sobre asyncpg en las peticiones HTTP)
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    DB_STATEMENT_TIMEOUT_MS: int = 30000
+    # Con DEBUG, las respuestas llevan X-Query-Count y se avisa por encima de este número de sentencias
+    DB_QUERY_WARN_THRESHOLD: int = 20
+    # Réplica de lectura (streaming replication) para historial, reportes, PDF y vistas de administración.
+    # Si se retrasa más de DB_REPLICA_MAX_LAG_SECONDS o no responde, esas lecturas vuelven al primario.
+    DATABASE_REPLICA_URL: Optional[str] = None
+    DB_REPLICA_MAX_LAG_SECONDS: float = 5.0
+    DB_REPLICA_LAG_CHECK_INTERVAL: float = 2.0
+    
+    # Cliente HTTP hacia HAPI FHIR
+    FHIR_HTTP2: bool = False
+    FHIR_MAX_CONNECTIONS: int = 20
+    FHIR_MAX_KEEPALIVE_CONNECTIONS: int = 10
+    FHIR_KEEPALIVE_EXPIRY: float = 30.0
+    FHIR_TIMEOUT_CONNECT: float = 3.0
+    FHIR_TIMEOUT_READ: float = 5.0
+    FHIR_TIMEOUT_WRITE: float = 10.0
+    FHIR_TIMEOUT_SEARCH: float = 15.0
+    FHIR_DEADLINE_READ: float = 8.0
+    FHIR_DEADLINE_WRITE: float = 15.0
+    FHIR_DEADLINE_SEARCH: float = 30.0
+    FHIR_PAGE_SIZE: int = 200
+    FHIR_STREAM_BUFFER_PAGES: int = 10
+    FHIR_CACHE_MAX_ENTRIES: int = 5000
+    FHIR_CACHE_TTL: float = 300.0
+    FHIR_HISTORY_CACHE_TTL: float = 60.0
+    
+    # Circuit breaker hacia HAPI FHIR
+    FHIR_BREAKER_FAILURE_THRESHOLD: int = 5
+    FHIR_BREAKER_SLOW_CALL_SECONDS: float = 10.0
+    FHIR_BREAKER_OPEN_SECONDS: float = 30.0
+    FHIR_BREAKER_HALF_OPEN_CALLS: int = 1
+    
+    # Sincronización asíncrona (outbox)
+    FHIR_SYNC_IN_PROCESS: bool = True
+    FHIR_SYNC_BATCH_SIZE: int = 50
+    FHIR_SYNC_CONCURRENCY: int = 8
+    FHIR_SYNC_POLL_INTERVAL: float = 2.0
+    FHIR_SYNC_LEASE_SECONDS: int = 300
+    FHIR_SYNC_MAX_ATTEMPTS: int = 10
+    FHIR_SYNC_BACKOFF_BASE: float = 2.0
+    FHIR_SYNC_BACKOFF_MAX: float = 900.0
+    FHIR_SYNC_PENDIENTE_DELAY: float = 30.0
+    
+    # Sincronización entrante desde HAPI (cambios hechos por otros sistemas)
+    FHIR_INBOUND_ENABLED: bool = False
+    FHIR_INBOUND_INTERVAL: float = 60.0
+    FHIR_INBOUND_PAGE_SIZE: int = 200
+    FHIR_INBOUND_LAG_SECONDS: int = 5
+    
+    # Re-sincronización masiva (python -m app.fhir_backfill)
+    FHIR_BACKFILL_BATCH_SIZE: int = 100
+    FHIR_BACKFILL_CONCURRENCY: int = 4
+    FHIR_BACKFILL_CHECKPOINT: str = "/opt/clinica-fhir/fhir_backfill.json"
+    
+    # Fachada FHIR R4 local (/fhir/R4)
+    FHIR_LOCAL_PAGE_SIZE: int = 50
+    FHIR_LOCAL_MAX_PAGE_SIZE: int = 500
+    
+    # Bulk Data $export
+    FHIR_EXPORT_DIR: str = "/opt/clinica-fhir/exports"
+    FHIR_EXPORT_CHUNK_SIZE: int = 1000
+    FHIR_EXPORT_RETENTION_HOURS: int = 24
+    
+    # Reconciliación de los contadores de /reportes/estadisticas (segundos; 0 la desactiva)
+    ESTADISTICAS_RECONCILIAR_INTERVAL: int = 21600
+    
+    # Particiones mensuales de encuentros y observaciones (python -m app.particiones)
+    PARTICIONES_MESES_ADELANTE: int = 3
+    PARTICIONES_INTERVAL: int = 86400
+    ARCHIVO_TABLESPACE: Optional[str] = None
+    
+    # Listados paginados de la API (GET /encuentros/, /usuarios/, /sedes/, /roles/)
+    API_PAGE_SIZE: int = 50
+    API_MAX_PAGE_SIZE: int = 500
+    
+    # Búsqueda aproximada de pacientes (pg_trgm): resultados por defecto y máximos, umbrales de similitud
+    BUSQUEDA_LIMITE: int = 10
+    BUSQUEDA_MAX_LIMITE: int = 50
+    BUSQUEDA_UMBRAL_NOMBRE: float = 0.4
+    BUSQUEDA_UMBRAL_DOCUMENTO: float = 0.5
+    # Selector de paciente del nuevo encuentro: días hacia atrás de los pacientes recientes del médico
+    BUSQUEDA_RECIENTES_DIAS: int = 180
+    
+    # Importación masiva de pacientes (POST /usuarios/importar, python -m app.importar_pacientes):
+    # filas por COPY, procesos de bcrypt (0 = uno por CPU) y Patient por Bundle batch hacia HAPI
+    IMPORTACION_BATCH_SIZE: int = 5000
+    IMPORTACION_HASH_WORKERS: int = 0
+    IMPORTACION_BUNDLE_SIZE: int = 100
+    
+    # Ingesta de encuentros por lotes (POST /encuentros/lote): encuentros por petición y por transacción FHIR
+    ENCUENTROS_LOTE_MAX: int = 1000
+    ENCUENTROS_LOTE_BUNDLE_SIZE: int = 50
+    
+    # Backfill de valores tipados en observaciones_clinicas
+    OBSERVACIONES_NORMALIZAR_BATCH_SIZE: int = 2000
 
     class Config:
         env_file = "/opt/clinica-fhir/.env"
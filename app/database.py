@@ -1,15 +1,157 @@
-from sqlalchemy import create_engine
+import asyncio
+import time
+from typing import Optional
+from fastapi import Request
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from app.config import settings
 
-engine = create_engine(settings.DATABASE_URL)
+# Motor síncrono: lo usan los procesos en segundo plano (outbox, sincronización entrante, $export)
+# desde hilos con asyncio.to_thread, y los comandos de línea (backfill, normalización).
+engine = create_engine(settings.DATABASE_URL, pool_pre_ping=settings.DB_POOL_PRE_PING)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
+# Motor asíncrono (asyncpg) para las peticiones HTTP: las consultas no bloquean el event loop y la
+# concurrencia por worker queda acotada por el pool (DB_POOL_SIZE + DB_MAX_OVERFLOW).
+def _motor_async(url: str):
+    return create_async_engine(
+        make_url(url).set(drivername="postgresql+asyncpg"),
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        connect_args={"server_settings": {"statement_timeout": str(settings.DB_STATEMENT_TIMEOUT_MS)}}
+    )
+
+async_engine = _motor_async(settings.DATABASE_URL)
+# expire_on_commit=False: tras el commit los objetos se siguen leyendo sin volver a la base,
+# que en una sesión asíncrona no puede hacerse de forma implícita.
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
+
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+# ==================== RÉPLICA DE LECTURA ====================
+# Las rutas de sólo lectura pesadas (historial, reportes, PDF, vistas de administración) usan
+# get_db_lectura: van a la réplica salvo que
+#   - no haya réplica configurada, no responda o su retraso supere DB_REPLICA_MAX_LAG_SECONDS
+#   - el cliente o el usuario autenticado hayan escrito hace menos de ese retraso, así quien acaba de
+#     guardar algo lo ve en la lectura siguiente aunque la réplica no haya llegado. main.py marca cada
+#     escritura en la cookie COOKIE_ESCRITURA (el navegador, sin consultar nada) y en la tabla
+#     escrituras_recientes del primario, por usuario (clientes de la API que no guardan cookies).
+# Las escrituras siguen siempre en get_db.
+COOKIE_ESCRITURA = "escritura_reciente"
+
+# UNLOGGED: no pasa por el WAL ni llega a la réplica; tras una caída basta con que quede vacía
+REGISTRAR_ESCRITURA = text("""
+    INSERT INTO escrituras_recientes (numero_documento, momento) VALUES (:documento, now())
+    ON CONFLICT (numero_documento) DO UPDATE SET momento = EXCLUDED.momento
+""")
+ESCRITURA_RECIENTE = text("""
+    SELECT EXISTS (
+        SELECT 1 FROM escrituras_recientes
+        WHERE numero_documento = :documento AND momento > now() - make_interval(secs => :segundos)
+    )
+""")
+
+replica_engine = _motor_async(settings.DATABASE_REPLICA_URL) if settings.DATABASE_REPLICA_URL else None
+AsyncReplicaSessionLocal = async_sessionmaker(replica_engine, expire_on_commit=False, autoflush=False) if replica_engine else None
+
+# Sin WAL pendiente de aplicar el retraso es 0 aunque la última transacción sea vieja (primario ocioso).
+# Eso sólo vale con el receptor de WAL conectado: desconectada del primario (caído, slot borrado) la
+# réplica tampoco tiene WAL pendiente pero no avanza, y se da por no disponible (NULL). status sólo es
+# visible con pg_read_all_stats (p. ej. GRANT pg_monitor); sin ese rol basta con que el receptor exista.
+RETRASO_REPLICA = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE COALESCE(status, 'streaming') = 'streaming') THEN NULL
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+class EstadoReplica:
+    # Mide el retraso como mucho cada DB_REPLICA_LAG_CHECK_INTERVAL segundos, no en cada petición
+    def __init__(self):
+        self.retraso: Optional[float] = None
+        self._medido = 0.0
+        self._lock = asyncio.Lock()
+
+    def _al_dia(self) -> bool:
+        return self.retraso is not None and self.retraso <= settings.DB_REPLICA_MAX_LAG_SECONDS
+
+    async def disponible(self) -> bool:
+        if replica_engine is None:
+            return False
+        if time.monotonic() - self._medido >= settings.DB_REPLICA_LAG_CHECK_INTERVAL:
+            async with self._lock:
+                if time.monotonic() - self._medido >= settings.DB_REPLICA_LAG_CHECK_INTERVAL:
+                    await self._medir()
+        return self._al_dia()
+
+    async def _medir(self):
+        antes = self._al_dia()
+        error = None
+        try:
+            async with replica_engine.connect() as conexion:
+                retraso = (await conexion.execute(RETRASO_REPLICA)).scalar()
+            self.retraso = None if retraso is None else float(retraso)
+        except Exception as e:
+            self.retraso, error = None, e
+        self._medido = time.monotonic()
+
+        # Sólo se registran los cambios de estado
+        if self._al_dia() and not antes:
+            print(f"[DB-REPLICA] Lecturas a la réplica (retraso {self.retraso:.1f}s)")
+        elif antes and not self._al_dia():
+            if error:
+                motivo = f"{type(error).__name__}: {error}"
+            elif self.retraso is None:
+                motivo = "sin conexión de replicación con el primario"
+            else:
+                motivo = f"retraso de {self.retraso:.1f}s"
+            print(f"[DB-REPLICA] Lecturas al primario: {motivo}")
+
+estado_replica = EstadoReplica()
+
+def escritura_reciente(request: Request) -> bool:
+    try:
+        return time.time() - float(request.cookies.get(COOKIE_ESCRITURA, 0)) < settings.DB_REPLICA_MAX_LAG_SECONDS
+    except ValueError:
+        return False
+
+async def registrar_escritura(documento: str):
+    try:
+        async with async_engine.begin() as conexion:
+            await conexion.execute(REGISTRAR_ESCRITURA, {"documento": documento})
+    except Exception as e:
+        print(f"[DB-REPLICA] No se pudo registrar la escritura de {documento}: {type(e).__name__}: {e}")
+
+async def escritura_reciente_usuario(documento: Optional[str]) -> bool:
+    # Consulta por llave primaria en el primario; ante un error se asume que sí, y se lee del primario
+    if not documento:
+        return False
+    try:
+        async with async_engine.connect() as conexion:
+            return bool(await conexion.scalar(ESCRITURA_RECIENTE, {
+                "documento": documento, "segundos": settings.DB_REPLICA_MAX_LAG_SECONDS
+            }))
+    except Exception as e:
+        print(f"[DB-REPLICA] No se pudo consultar la última escritura de {documento}: {type(e).__name__}: {e}")
+        return True
+
+async def get_db_lectura(request: Request):
+    # request.state.documento: usuario del token, lo deja main.py antes de llegar a la ruta
+    if (not escritura_reciente(request) and await estado_replica.disponible()
+            and not await escritura_reciente_usuario(getattr(request.state, "documento", None))):
+        async with AsyncReplicaSessionLocal() as db:
+            yield db
+    else:
+        async with AsyncSessionLocal() as db:
+            yield db
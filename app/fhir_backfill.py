@@ -0,0 +1,42 @@
+import argparse
+import asyncio
+import json
+from app.services.fhir_service import fhir_service
+from app.services.fhir_backfill import FHIRBackfill, BACKFILL_TIPOS
+
+# Re-sincronización masiva con HAPI: python -m app.fhir_backfill [--tipos patient,encounter]
+# Se puede interrumpir y volver a lanzar: continúa desde el último lote confirmado.
+# Con --reiniciar vuelve a recorrer desde el principio, reintentando los fallidos y omitidos.
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Sincroniza con HAPI FHIR las filas sin id FHIR")
+    parser.add_argument("--tipos", default=",".join(BACKFILL_TIPOS),
+                        help=f"Tipos a sincronizar, separados por coma ({', '.join(BACKFILL_TIPOS)})")
+    parser.add_argument("--batch-size", type=int, help="Filas por Bundle")
+    parser.add_argument("--concurrency", type=int, help="Bundles simultáneos hacia HAPI")
+    parser.add_argument("--checkpoint", help="Archivo donde se guarda el avance")
+    parser.add_argument("--reiniciar", action="store_true", help="Ignorar el checkpoint de los tipos indicados")
+    args = parser.parse_args()
+
+    args.tipos = [t.strip() for t in args.tipos.split(",") if t.strip()]
+    invalidos = [t for t in args.tipos if t not in BACKFILL_TIPOS]
+    if invalidos:
+        parser.error(f"Tipos no soportados: {', '.join(invalidos)}")
+    return args
+
+async def main():
+    args = parse_args()
+    backfill = FHIRBackfill(args.batch_size, args.concurrency, args.checkpoint)
+    if args.reiniciar:
+        backfill.reiniciar(args.tipos)
+
+    await fhir_service.start()
+    try:
+        reporte = await backfill.ejecutar(args.tipos)
+    finally:
+        await fhir_service.close()
+
+    print(json.dumps(reporte, indent=2))
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,35 @@
+import asyncio
+import signal
+from app.config import settings
+from app.services.estadisticas import reconciliador_estadisticas
+from app.services.fhir_service import fhir_service
+from app.services.fhir_sync import fhir_sync_worker
+from app.services.fhir_inbound import fhir_inbound_sync
+from app.services.particiones import mantenimiento_particiones
+
+# Worker de sincronización independiente: python -m app.fhir_worker
+# Usar con FHIR_SYNC_IN_PROCESS=False en la aplicación web. También corre la reconciliación
+# periódica de los contadores de /reportes/estadisticas y la creación de particiones mensuales.
+
+async def main():
+    await fhir_service.start()
+    await fhir_sync_worker.start()
+    await reconciliador_estadisticas.start()
+    await mantenimiento_particiones.start()
+    if settings.FHIR_INBOUND_ENABLED:
+        await fhir_inbound_sync.start()
+
+    detener = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, detener.set)
+
+    await detener.wait()
+    await mantenimiento_particiones.stop()
+    await reconciliador_estadisticas.stop()
+    await fhir_inbound_sync.stop()
+    await fhir_sync_worker.stop()
+    await fhir_service.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,37 @@
+import argparse
+import json
+from app.services.importacion import FORMATOS, cerrar_pool, formato_de, importar
+
+# Importación masiva de pacientes: python -m app.importar_pacientes pacientes.csv [--sede-id 2] [--errores errores.json]
+# Acepta CSV con encabezado o NDJSON, con los campos de UsuarioCreate (rol_id se ignora: todos quedan
+# como pacientes). Los Patient se crean en HAPI desde el outbox, así que el worker debe estar corriendo.
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Importa pacientes desde CSV o NDJSON")
+    parser.add_argument("archivo", help="Archivo CSV o NDJSON")
+    parser.add_argument("--formato", choices=FORMATOS, help="Por defecto según la extensión del archivo")
+    parser.add_argument("--sede-id", type=int, help="Sede de registro de las filas que no traen sede_registro_id")
+    parser.add_argument("--errores", help="Archivo JSON donde se guarda el detalle de las filas rechazadas")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    with open(args.archivo, encoding="utf-8-sig") as f:
+        contenido = f.read()
+
+    try:
+        reporte = importar(contenido, args.formato or formato_de(args.archivo), args.sede_id)
+    finally:
+        cerrar_pool()
+
+    errores = reporte.pop("errores")
+    if args.errores:
+        with open(args.errores, "w") as f:
+            json.dump(errores, f, ensure_ascii=False, indent=2)
+    else:
+        for error in errores:
+            print(f"[IMPORTACION] Línea {error['linea']} ({error['numero_documento']}): {'; '.join(error['errores'])}")
+    print(json.dumps(reporte, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,77 @@
+import math
+import time
 from fastapi import FastAPI, Request
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.responses import RedirectResponse
-from app.routers import auth, usuarios, roles, encuentros, historial, views, sedes, reportes, pdf
+from app.routers import auth, usuarios, roles, encuentros, historial, views, sedes, reportes, pdf, exportacion, fhir
 from app.config import settings
+from app.database import COOKIE_ESCRITURA, async_engine, registrar_escritura, replica_engine
+from app.services.auth import decode_token
+from app.services.consultas import contar_sentencias
+from app.services.estadisticas import reconciliador_estadisticas
+from app.services.importacion import cerrar_pool
+from app.services.particiones import mantenimiento_particiones
+from app.services.fhir_service import fhir_service
+from app.services.fhir_sync import fhir_sync_worker
+from app.services.fhir_inbound import fhir_inbound_sync
 
 app = FastAPI(title=settings.APP_NAME)
 
 app.mount("/static", StaticFiles(directory="/opt/clinica-fhir/app/static"), name="static")
 
+@app.on_event("startup")
+async def startup():
+    await fhir_service.start()
+    if settings.FHIR_SYNC_IN_PROCESS:
+        await fhir_sync_worker.start()
+        await reconciliador_estadisticas.start()
+        await mantenimiento_particiones.start()
+        if settings.FHIR_INBOUND_ENABLED:
+            await fhir_inbound_sync.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await mantenimiento_particiones.stop()
+    await reconciliador_estadisticas.stop()
+    await fhir_inbound_sync.stop()
+    await fhir_sync_worker.stop()
+    await fhir_service.close()
+    cerrar_pool()
+    await async_engine.dispose()
+    if replica_engine is not None:
+        await replica_engine.dispose()
+
+@app.middleware("http")
+async def contar_consultas(request: Request, call_next):
+    # Un número de sentencias que crece con los datos de la respuesta delata una carga perezosa (N+1)
+    if not settings.DEBUG:
+        return await call_next(request)
+    with contar_sentencias() as contador:
+        response = await call_next(request)
+    response.headers["X-Query-Count"] = str(contador[0])
+    if contador[0] > settings.DB_QUERY_WARN_THRESHOLD:
+        print(f"[DB] {request.method} {request.url.path} ejecutó {contador[0]} sentencias SQL")
+    return response
+
+@app.middleware("http")
+async def marcar_escrituras(request: Request, call_next):
+    # Read-your-writes con réplica: tras una escritura, las lecturas de este cliente y de este usuario van
+    # al primario mientras la réplica pueda no tenerla (get_db_lectura en app/database.py)
+    if replica_engine is None:
+        return await call_next(request)
+    token = request.cookies.get("access_token")
+    payload = decode_token(token) if token else None
+    request.state.documento = payload.get("sub") if payload else None
+
+    response = await call_next(request)
+    if request.method in ("POST", "PUT", "PATCH", "DELETE") and response.status_code < 400:
+        response.set_cookie(COOKIE_ESCRITURA, str(time.time()), max_age=math.ceil(settings.DB_REPLICA_MAX_LAG_SECONDS) + 1,
+                            httponly=True, samesite="lax")
+        if request.state.documento:
+            await registrar_escritura(request.state.documento)
+    return response
+
 app.include_router(auth.router)
 app.include_router(usuarios.router)
 app.include_router(roles.router)
@@ -17,6 +80,8 @@ app.include_router(historial.router)
 app.include_router(sedes.router)
 app.include_router(reportes.router)
 app.include_router(pdf.router)
+app.include_router(exportacion.router)
+app.include_router(fhir.router)
 app.include_router(views.router)
 
 @app.exception_handler(401)
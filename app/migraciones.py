@@ -0,0 +1,51 @@
+import argparse
+from app.services.migraciones import aplicar, diferencias, estado, marcar
+
+# Migraciones versionadas del esquema (postgres/migraciones/NNN_*.sql):
+#   python -m app.migraciones estado
+#   python -m app.migraciones aplicar [--hasta 020]
+#   python -m app.migraciones marcar 020     # base anterior a las migraciones: registrar sin ejecutar
+#   python -m app.migraciones verificar      # tablas y columnas de los modelos contra la base
+# Las bases nuevas salen de init.sql, que ya registra las versiones que incluye.
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Migraciones versionadas del esquema")
+    comandos = parser.add_subparsers(dest="comando", required=True)
+
+    comandos.add_parser("estado", help="Listar migraciones aplicadas y pendientes")
+
+    aplicar_parser = comandos.add_parser("aplicar", help="Aplicar las migraciones pendientes")
+    aplicar_parser.add_argument("--hasta", help="Última versión a aplicar (NNN)")
+
+    marcar_parser = comandos.add_parser("marcar", help="Registrar como aplicadas, sin ejecutarlas, hasta una versión")
+    marcar_parser.add_argument("version", help="Última versión ya presente en la base (NNN)")
+
+    comandos.add_parser("verificar", help="Comparar app/models/models.py con la base")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+
+    if args.comando == "estado":
+        for m in estado():
+            aplicada = f"{m['aplicada_at']:%Y-%m-%d %H:%M}" if m["aplicada_at"] else ""
+            print(f"{m['version']}  {m['estado']:<10} {aplicada:<16}  {m['nombre']}")
+
+    elif args.comando == "aplicar":
+        aplicadas = aplicar(args.hasta)
+        print(f"[MIGRACIONES] {len(aplicadas)} migraciones aplicadas" if aplicadas else "[MIGRACIONES] Sin migraciones pendientes")
+
+    elif args.comando == "marcar":
+        for nombre in marcar(args.version):
+            print(f"[MIGRACIONES] {nombre} registrada como aplicada")
+
+    elif args.comando == "verificar":
+        problemas = diferencias()
+        for problema in problemas:
+            print(f"[MIGRACIONES] {problema}")
+        if problemas:
+            raise SystemExit(1)
+        print("[MIGRACIONES] El esquema coincide con los modelos")
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, Date, DateTime, Text, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, Date, DateTime, Text, ForeignKey, JSON, Float
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.database import Base
@@ -61,6 +61,7 @@ class TipoEncuentroMedico(Base):
     activo = Column(Boolean, default=True)
 
 class EncuentroMedico(Base):
+    # Particionada por mes de fecha en la base (postgres/init.sql); id sigue siendo único
     __tablename__ = "encuentros_medicos"
     id = Column(Integer, primary_key=True, index=True)
     fecha = Column(DateTime, default=func.now(), nullable=False)
@@ -85,15 +86,59 @@ class ObservacionClinica(Base):
     __tablename__ = "observaciones_clinicas"
     id = Column(Integer, primary_key=True, index=True)
     fecha = Column(DateTime, default=func.now(), nullable=False)
-    encuentro_id = Column(Integer, ForeignKey("encuentros_medicos.id"))
+    encuentro_id = Column(Integer, ForeignKey("encuentros_medicos.id"))  # sin FK en la base: ambas están particionadas
     descripcion = Column(Text, nullable=False)
     valor = Column(String(100))
     unidad = Column(String(50))
     codigo_loinc = Column(String(20))
     interpretacion = Column(String(100))
+    # Valor tipado a partir de valor/unidad (ver app/services/mediciones.py)
+    valor_numerico = Column(Float)
+    valor_normalizado = Column(Float)
+    unidad_normalizada = Column(String(20))
+    presion_sistolica = Column(Float)
+    presion_diastolica = Column(Float)
     sede_id = Column(Integer, ForeignKey("sedes.id"))
     fhir_observation_id = Column(String(100))
     created_at = Column(DateTime, default=func.now())
     
     encuentro = relationship("EncuentroMedico", back_populates="observaciones")
     sede = relationship("Sede")
+
+class OutboxFHIR(Base):
+    __tablename__ = "outbox_fhir"
+    id = Column(Integer, primary_key=True, index=True)
+    operacion = Column(String(50), nullable=False)
+    entidad_id = Column(Integer)
+    payload = Column(JSON, default=dict)
+    estado = Column(String(20), default="pendiente", nullable=False)
+    intentos = Column(Integer, default=0, nullable=False)
+    proximo_intento = Column(DateTime, default=func.now(), nullable=False)
+    ultimo_error = Column(Text)
+    created_at = Column(DateTime, default=func.now())
+    procesado_at = Column(DateTime)
+
+class MarcaAguaFHIR(Base):
+    __tablename__ = "marcas_agua_fhir"
+    tipo_recurso = Column(String(50), primary_key=True)
+    ultima_actualizacion = Column(String(40))
+    recursos_procesados = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+class Estadistica(Base):
+    # Contadores mantenidos por triggers (postgres/init.sql); una clave puede ocupar varios fragmentos
+    __tablename__ = "estadisticas"
+    dimension = Column(String(30), primary_key=True)
+    clave = Column(Integer, primary_key=True, default=0)
+    fragmento = Column(Integer, primary_key=True, default=0)
+    total = Column(BigInteger, default=0, nullable=False)
+
+class SerieDiaria(Base):
+    # Encuentros y observaciones por día, sede, tipo y médico, mantenidos por triggers; 0 = sin dato
+    __tablename__ = "series_diarias"
+    dia = Column(Date, primary_key=True)
+    sede_id = Column(Integer, primary_key=True, default=0)
+    tipo_id = Column(Integer, primary_key=True, default=0)
+    medico_id = Column(Integer, primary_key=True, default=0)
+    encuentros = Column(BigInteger, default=0, nullable=False)
+    observaciones = Column(BigInteger, default=0, nullable=False)
@@ -0,0 +1,54 @@
+import argparse
+import time
+from app.config import settings
+from app.database import SessionLocal
+from app.models.models import ObservacionClinica
+from app.services.mediciones import parsear_lote
+
+# Llena las columnas tipadas de las observaciones anteriores a ellas:
+# python -m app.normalizar_observaciones [--desde-id N] [--batch-size N]
+# Recorre la tabla por id en lotes con transacciones cortas; volver a lanzarlo es seguro,
+# sólo toca las filas con valor que aún no tienen ninguna columna tipada.
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Tipa valor/unidad de las observaciones clínicas existentes")
+    parser.add_argument("--desde-id", type=int, default=0, help="Continuar a partir de este id")
+    parser.add_argument("--batch-size", type=int, default=settings.OBSERVACIONES_NORMALIZAR_BATCH_SIZE,
+                        help="Filas por lote")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    desde_id, revisadas, tipadas = args.desde_id, 0, 0
+    inicio = time.monotonic()
+
+    while True:
+        with SessionLocal() as db:
+            filas = db.query(
+                ObservacionClinica.id, ObservacionClinica.valor, ObservacionClinica.unidad,
+                ObservacionClinica.codigo_loinc, ObservacionClinica.descripcion
+            ).filter(
+                ObservacionClinica.id > desde_id,
+                ObservacionClinica.valor != None,
+                ObservacionClinica.valor_numerico == None,
+                ObservacionClinica.presion_sistolica == None
+            ).order_by(ObservacionClinica.id).limit(args.batch_size).all()
+            if not filas:
+                break
+
+            # Un UPDATE por clave primaria ejecutado en bloque (executemany) para todo el lote
+            cambios = parsear_lote(filas)
+            if cambios:
+                db.bulk_update_mappings(ObservacionClinica, cambios)
+                db.commit()
+
+        desde_id = filas[-1].id
+        revisadas += len(filas)
+        tipadas += len(cambios)
+        print(f"[OBSERVACIONES] {revisadas} revisadas, {tipadas} tipadas "
+              f"({revisadas / (time.monotonic() - inicio):.0f} filas/s) - último id {desde_id}")
+
+    print(f"[OBSERVACIONES] Terminado: {revisadas} revisadas, {tipadas} tipadas en {time.monotonic() - inicio:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import argparse
+from datetime import date
+from app.config import settings
+from app.services.particiones import TABLAS_PARTICIONADAS, archivar, crear, listar, meses_calientes
+
+# Particiones mensuales de encuentros y observaciones:
+#   python -m app.particiones listar
+#   python -m app.particiones crear [--meses 3]
+#   python -m app.particiones archivar --antes 2020-01 [--tablespace archivo_comprimido]
+# archivar pasa al esquema archivo todos los meses anteriores a --antes, uno por transacción.
+# El historial los sigue mostrando con incluir_archivo=true; estadísticas y series los siguen contando.
+
+def mes(valor: str) -> date:
+    try:
+        anio, numero = valor.split("-")
+        return date(int(anio), int(numero), 1)
+    except ValueError:
+        raise argparse.ArgumentTypeError("se espera AAAA-MM")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Particiones mensuales de encuentros y observaciones")
+    comandos = parser.add_subparsers(dest="comando", required=True)
+
+    comandos.add_parser("listar", help="Listar particiones calientes y archivadas")
+
+    crear_parser = comandos.add_parser("crear", help="Crear las particiones de los próximos meses")
+    crear_parser.add_argument("--meses", type=int, default=settings.PARTICIONES_MESES_ADELANTE,
+                              help="Meses por adelantado")
+
+    archivar_parser = comandos.add_parser("archivar", help="Pasar al archivo los meses anteriores a --antes")
+    archivar_parser.add_argument("--antes", type=mes, required=True, help="Primer mes que se queda (AAAA-MM)")
+    archivar_parser.add_argument("--tablespace", default=settings.ARCHIVO_TABLESPACE,
+                                 help="Tablespace destino de las particiones archivadas")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+
+    if args.comando == "listar":
+        for p in listar():
+            print(f"{p['esquema']}.{p['particion']:<36} {p['rango']:<70} {p['bytes'] / 1024 / 1024:>10.1f} MB")
+
+    elif args.comando == "crear":
+        creadas = crear(args.meses)
+        if creadas is None:
+            print("[PARTICIONES] Otro proceso está creando particiones")
+        else:
+            print(f"[PARTICIONES] {creadas} particiones creadas")
+
+    elif args.comando == "archivar":
+        hoy = date.today().replace(day=1)
+        if args.antes > hoy:
+            raise SystemExit("--antes no puede ser posterior al mes actual")
+        for tabla in TABLAS_PARTICIONADAS:
+            for m in meses_calientes(tabla):
+                if m >= args.antes:
+                    break
+                print(f"[PARTICIONES] Archivando {tabla} {m:%Y-%m}...")
+                print(f"[PARTICIONES] -> {archivar(tabla, m, args.tablespace or None)}")
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Response, Request
 from fastapi.responses import RedirectResponse
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.database import get_db
 from app.models.models import Usuario
 from app.schemas.schemas import LoginForm
@@ -9,8 +10,8 @@ from app.services.auth import verify_password, create_access_token, get_current_
 router = APIRouter(tags=["auth"])
 
 @router.post("/login")
-async def login(response: Response, form_data: LoginForm, db: Session = Depends(get_db)):
-    usuario = db.query(Usuario).filter(Usuario.numero_documento == form_data.numero_documento).first()
+async def login(response: Response, form_data: LoginForm, db: AsyncSession = Depends(get_db)):
+    usuario = await db.scalar(select(Usuario).where(Usuario.numero_documento == form_data.numero_documento))
     
     if not usuario or not verify_password(form_data.password, usuario.password_hash):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Credenciales incorrectas")
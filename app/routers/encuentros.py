@@ -1,34 +1,69 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List
-from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
+from datetime import date, datetime, timedelta
+from app.config import settings
 from app.database import get_db
-from app.models.models import EncuentroMedico, ObservacionClinica, Usuario, TipoEncuentroMedico
-from app.schemas.schemas import EncuentroCreate, EncuentroOut, EncuentroConRelaciones
+from app.models.models import EncuentroMedico, ObservacionClinica, Usuario
+from app.schemas.schemas import EncuentroCreate, EncuentroOut, EncuentroConRelaciones, LoteEncuentros, PaginaEncuentros
 from app.services.auth import require_roles, get_current_user
-from app.services.fhir_service import fhir_service
+from app.services.consultas import ENCUENTRO_CON_RELACIONES
+from app.services.fhir_sync import encolar, fhir_sync_worker
+from app.services.ingesta import ingerir
+from app.services.mediciones import parsear
+from app.services.paginacion import decodificar_cursor, pagina
 
 router = APIRouter(prefix="/encuentros", tags=["encuentros"])
 
-@router.get("/", response_model=List[EncuentroConRelaciones])
+@router.get("/", response_model=PaginaEncuentros)
 async def listar_encuentros(
-    db: Session = Depends(get_db),
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+    sede_id: Optional[int] = None,
+    medico_id: Optional[int] = None,
+    paciente_id: Optional[int] = None,
+    icd10: Optional[str] = Query(None, max_length=20, description="Prefijo del código CIE-10, p. ej. E11"),
+    cursor: Optional[str] = None,
+    limite: int = Query(settings.API_PAGE_SIZE, ge=1, le=settings.API_MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_db),
     current_user: Usuario = Depends(get_current_user)
 ):
+    # Médicos y pacientes sólo ven sus propios encuentros, aunque pidan otro id en el filtro
     if current_user.rol.nombre == "Medico":
-        return db.query(EncuentroMedico).filter(EncuentroMedico.medico_id == current_user.id).order_by(EncuentroMedico.fecha.desc()).all()
+        medico_id = current_user.id
     elif current_user.rol.nombre == "Paciente":
-        return db.query(EncuentroMedico).filter(EncuentroMedico.paciente_id == current_user.id).order_by(EncuentroMedico.fecha.desc()).all()
-    else:
-        return db.query(EncuentroMedico).order_by(EncuentroMedico.fecha.desc()).all()
+        paciente_id = current_user.id
+
+    filtros = []
+    if desde:
+        filtros.append(EncuentroMedico.fecha >= desde)
+    if hasta:
+        filtros.append(EncuentroMedico.fecha < hasta + timedelta(days=1))
+    if sede_id is not None:
+        filtros.append(EncuentroMedico.sede_id == sede_id)
+    if medico_id is not None:
+        filtros.append(EncuentroMedico.medico_id == medico_id)
+    if paciente_id is not None:
+        filtros.append(EncuentroMedico.paciente_id == paciente_id)
+    if icd10:
+        filtros.append(EncuentroMedico.diagnostico_codigo_icd10.startswith(icd10.strip().upper(), autoescape=True))
+    if cursor:
+        # (fecha, id) desempata encuentros con la misma fecha; la comparación de filas usa los índices (…, fecha, id)
+        filtros.append(tuple_(EncuentroMedico.fecha, EncuentroMedico.id) < decodificar_cursor(cursor, datetime, int))
+
+    query = select(EncuentroMedico).options(*ENCUENTRO_CON_RELACIONES).where(*filtros).order_by(
+        EncuentroMedico.fecha.desc(), EncuentroMedico.id.desc()
+    ).limit(limite + 1)
+    return pagina((await db.scalars(query)).all(), limite, lambda e: (e.fecha, e.id))
 
 @router.get("/{encuentro_id}", response_model=EncuentroConRelaciones)
 async def obtener_encuentro(
     encuentro_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: Usuario = Depends(get_current_user)
 ):
-    encuentro = db.query(EncuentroMedico).filter(EncuentroMedico.id == encuentro_id).first()
+    encuentro = await db.scalar(select(EncuentroMedico).options(*ENCUENTRO_CON_RELACIONES).where(EncuentroMedico.id == encuentro_id))
     if not encuentro:
         raise HTTPException(status_code=404, detail="Encuentro no encontrado")
     
@@ -42,15 +77,13 @@ async def obtener_encuentro(
 @router.post("/", response_model=EncuentroOut)
 async def crear_encuentro(
     encuentro: EncuentroCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: Usuario = Depends(require_roles(["Medico"]))
 ):
-    paciente = db.query(Usuario).filter(Usuario.id == encuentro.paciente_id).first()
+    paciente = await db.get(Usuario, encuentro.paciente_id)
     if not paciente:
         raise HTTPException(status_code=404, detail="Paciente no encontrado")
     
-    tipo = db.query(TipoEncuentroMedico).filter(TipoEncuentroMedico.id == encuentro.tipo_id).first()
-    
     nuevo_encuentro = EncuentroMedico(
         fecha=datetime.now(),
         tipo_id=encuentro.tipo_id,
@@ -63,49 +96,37 @@ async def crear_encuentro(
     )
     
     db.add(nuevo_encuentro)
-    db.commit()
-    db.refresh(nuevo_encuentro)
+    await db.flush()
+    
+    for obs in encuentro.observaciones:
+        db.add(ObservacionClinica(
+            fecha=datetime.now(),
+            encuentro_id=nuevo_encuentro.id,
+            descripcion=obs.descripcion,
+            valor=obs.valor,
+            unidad=obs.unidad,
+            codigo_loinc=obs.codigo_loinc,
+            interpretacion=obs.interpretacion,
+            sede_id=encuentro.sede_id,
+            **parsear(obs.valor, obs.unidad, obs.codigo_loinc, obs.descripcion).columnas()
+        ))
     
-    if paciente.fhir_patient_id:
-        fhir_encounter_id = await fhir_service.create_encounter({
-            "fecha": nuevo_encuentro.fecha.isoformat(),
-            "codigo_fhir": tipo.codigo_fhir if tipo else "AMB",
-            "tipo_nombre": tipo.nombre if tipo else "Consulta",
-            "diagnostico": encuentro.diagnostico,
-            "diagnostico_codigo_icd10": encuentro.diagnostico_codigo_icd10
-        }, paciente.fhir_patient_id, current_user.id)
-        
-        if fhir_encounter_id:
-            nuevo_encuentro.fhir_encounter_id = fhir_encounter_id
-            db.commit()
-        
-        for obs in encuentro.observaciones:
-            nueva_obs = ObservacionClinica(
-                fecha=datetime.now(),
-                encuentro_id=nuevo_encuentro.id,
-                descripcion=obs.descripcion,
-                valor=obs.valor,
-                unidad=obs.unidad,
-                codigo_loinc=obs.codigo_loinc,
-                interpretacion=obs.interpretacion,
-                sede_id=encuentro.sede_id
-            )
-            db.add(nueva_obs)
-            db.commit()
-            db.refresh(nueva_obs)
-            
-            if fhir_encounter_id:
-                fhir_obs_id = await fhir_service.create_observation({
-                    "fecha": nueva_obs.fecha.isoformat(),
-                    "descripcion": obs.descripcion,
-                    "valor": obs.valor,
-                    "unidad": obs.unidad,
-                    "codigo_loinc": obs.codigo_loinc,
-                    "interpretacion": obs.interpretacion
-                }, paciente.fhir_patient_id, fhir_encounter_id)
-                
-                if fhir_obs_id:
-                    nueva_obs.fhir_observation_id = fhir_obs_id
-                    db.commit()
+    # El Encounter y sus Observations se envían a HAPI desde el outbox
+    encolar(db, "sync_encounter", nuevo_encuentro.id)
+    
+    await db.commit()
+    await db.refresh(nuevo_encuentro)
+    fhir_sync_worker.notify()
     
     return nuevo_encuentro
+
+@router.post("/lote")
+async def crear_encuentros_lote(
+    lote: LoteEncuentros,
+    db: AsyncSession = Depends(get_db),
+    current_user: Usuario = Depends(require_roles(["Medico", "Administrador"]))
+):
+    # Los médicos cargan encuentros propios; el administrador indica medico_id en cada uno
+    resultado = await ingerir(db, lote.encuentros, current_user)
+    fhir_sync_worker.notify()
+    return resultado
@@ -0,0 +1,87 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import FileResponse, JSONResponse, Response
+from typing import Optional
+from datetime import datetime
+from app.models.models import Usuario
+from app.services.auth import require_roles
+from app.services.fhir_export import fhir_exporter, EXPORT_TYPES
+
+router = APIRouter(prefix="/fhir", tags=["exportacion"])
+
+NDJSON_FORMATS = {"application/fhir+ndjson", "application/ndjson", "ndjson"}
+
+@router.get("/$export", status_code=202)
+async def iniciar_exportacion(
+    request: Request,
+    tipo: Optional[str] = Query(None, alias="_type"),
+    since: Optional[datetime] = Query(None, alias="_since"),
+    formato: Optional[str] = Query(None, alias="_outputFormat"),
+    current_user: Usuario = Depends(require_roles(["Administrador"]))
+):
+    if formato and formato not in NDJSON_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Formato no soportado: {formato}")
+
+    tipos = [t.strip() for t in tipo.split(",") if t.strip()] if tipo else list(EXPORT_TYPES)
+    no_soportados = [t for t in tipos if t not in EXPORT_TYPES]
+    if no_soportados:
+        raise HTTPException(status_code=400, detail=f"Tipos no soportados: {', '.join(no_soportados)}")
+
+    if since and since.tzinfo:
+        # Las columnas de fecha son TIMESTAMP sin zona, en hora local del servidor
+        since = since.astimezone().replace(tzinfo=None)
+
+    job_id = fhir_exporter.iniciar(list(dict.fromkeys(tipos)), since, str(request.url))
+    status_url = str(request.url_for("estado_exportacion", job_id=job_id))
+    return Response(status_code=202, headers={"Content-Location": status_url})
+
+@router.get("/$export-status/{job_id}", name="estado_exportacion")
+async def estado_exportacion(
+    job_id: str,
+    request: Request,
+    current_user: Usuario = Depends(require_roles(["Administrador"]))
+):
+    estado = fhir_exporter.estado(job_id)
+    if not estado:
+        raise HTTPException(status_code=404, detail="Exportación no encontrada")
+
+    if estado["estado"] == "en_progreso":
+        progreso = ", ".join(f"{tipo}: {total}" for tipo, total in estado["progreso"].items())
+        return Response(status_code=202, headers={"X-Progress": progreso, "Retry-After": "5"})
+
+    if estado["estado"] == "error":
+        return JSONResponse(status_code=500, content={
+            "resourceType": "OperationOutcome",
+            "issue": [{"severity": "error", "code": "exception", "diagnostics": estado["error"]}]
+        })
+
+    return {
+        "transactionTime": estado["transactionTime"],
+        "request": estado["request"],
+        "requiresAccessToken": True,
+        "output": [{
+            "type": salida["type"],
+            "url": str(request.url_for("descargar_exportacion", job_id=job_id, archivo=f"{salida['type']}.ndjson")),
+            "count": salida["count"]
+        } for salida in estado["output"]],
+        "error": []
+    }
+
+@router.delete("/$export-status/{job_id}", status_code=202)
+async def cancelar_exportacion(
+    job_id: str,
+    current_user: Usuario = Depends(require_roles(["Administrador"]))
+):
+    if not fhir_exporter.eliminar(job_id):
+        raise HTTPException(status_code=404, detail="Exportación no encontrada")
+    return Response(status_code=202)
+
+@router.get("/$export-files/{job_id}/{archivo}", name="descargar_exportacion")
+async def descargar_exportacion(
+    job_id: str,
+    archivo: str,
+    current_user: Usuario = Depends(require_roles(["Administrador"]))
+):
+    ruta = fhir_exporter.archivo(job_id, archivo)
+    if not ruta:
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    return FileResponse(ruta, media_type="application/fhir+ndjson", filename=archivo)
@@ -0,0 +1,241 @@
+from fastapi import APIRouter, Depends, Request
+from fastapi.responses import JSONResponse
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timedelta
+from typing import Optional
+from urllib.parse import urlencode
+from app.config import settings
+from app.database import get_db
+from app.models.models import Usuario
+from app.services.auth import get_current_user
+from app.services.fhir_local import fhir_local, LOCAL_TYPES
+from app.services.fhir_service import PACIENTES_SYSTEM, MEDICOS_SYSTEM
+
+router = APIRouter(prefix="/fhir/R4", tags=["fhir"])
+
+FHIR_JSON = "application/fhir+json"
+PREFIJOS_FECHA = ("eq", "ne", "gt", "lt", "ge", "le")
+SYSTEMS = {"Patient": PACIENTES_SYSTEM, "Practitioner": MEDICOS_SYSTEM, "Observation": "http://loinc.org"}
+
+# Parámetros de búsqueda soportados por tipo (también se publican en /metadata)
+SEARCH_PARAMS = {
+    "Patient": ["_id", "identifier", "_lastUpdated"],
+    "Practitioner": ["_id", "identifier", "_lastUpdated"],
+    "Encounter": ["_id", "subject", "patient", "practitioner", "date", "reason-code", "_lastUpdated"],
+    "Observation": ["_id", "subject", "patient", "encounter", "date", "code", "_lastUpdated"],
+}
+
+class ParametroInvalido(Exception):
+    pass
+
+def fhir_response(content: dict, status_code: int = 200) -> JSONResponse:
+    return JSONResponse(content=content, status_code=status_code, media_type=FHIR_JSON)
+
+def operation_outcome(status_code: int, code: str, diagnostics: str) -> JSONResponse:
+    return fhir_response({
+        "resourceType": "OperationOutcome",
+        "issue": [{"severity": "error", "code": code, "diagnostics": diagnostics}]
+    }, status_code)
+
+# ==================== PARÁMETROS ====================
+def _rango_fecha(texto: str) -> tuple:
+    # La precisión del valor define el intervalo: 2024 -> todo el año, 2024-03 -> el mes, etc.
+    try:
+        if len(texto) == 4:
+            inicio = datetime(int(texto), 1, 1)
+            return inicio, datetime(inicio.year + 1, 1, 1)
+        if len(texto) == 7:
+            inicio = datetime.strptime(texto, "%Y-%m")
+            return inicio, datetime(inicio.year + inicio.month // 12, inicio.month % 12 + 1, 1)
+        if len(texto) == 10:
+            inicio = datetime.strptime(texto, "%Y-%m-%d")
+            return inicio, inicio + timedelta(days=1)
+        inicio = datetime.fromisoformat(texto.replace("Z", "+00:00"))
+    except ValueError:
+        raise ParametroInvalido(f"Fecha inválida: {texto}")
+    if inicio.tzinfo:
+        # Las columnas son TIMESTAMP sin zona, en hora local del servidor
+        inicio = inicio.astimezone().replace(tzinfo=None)
+    return inicio, inicio + timedelta(seconds=1)
+
+def _filtro_fecha(columna, valor: str):
+    prefijo = valor[:2] if valor[:2] in PREFIJOS_FECHA else "eq"
+    inicio, fin = _rango_fecha(valor[2:] if valor[:2] in PREFIJOS_FECHA else valor)
+    return {
+        "eq": and_(columna >= inicio, columna < fin),
+        "ne": or_(columna < inicio, columna >= fin),
+        "gt": columna >= fin,
+        "ge": columna >= inicio,
+        "lt": columna < inicio,
+        "le": columna < fin,
+    }[prefijo]
+
+def _referencia(valor: str, resource_type: str) -> int:
+    # Acepta "Patient/15", una URL absoluta que termine así, o sólo "15"
+    partes = valor.rstrip("/").split("/")
+    if len(partes) > 1 and partes[-2] != resource_type:
+        raise ParametroInvalido(f"Se esperaba una referencia a {resource_type}: {valor}")
+    try:
+        return int(partes[-1])
+    except ValueError:
+        raise ParametroInvalido(f"Referencia inválida: {valor}")
+
+def _token(valor: str, resource_type: str) -> Optional[str]:
+    # "system|code" o "code"; un system distinto del nuestro no puede coincidir con nada
+    if "|" not in valor:
+        return valor
+    system, code = valor.split("|", 1)
+    if system and system != SYSTEMS.get(resource_type):
+        return None
+    return code
+
+def _filtros(resource_type: str, params: dict, paciente_id: Optional[int]) -> list:
+    columnas = fhir_local.columnas[resource_type]
+    filtros = []
+
+    for valor in params.get("_id", []):
+        try:
+            filtros.append(columnas["id"].in_([int(v) for v in valor.split(",")]))
+        except ValueError:
+            raise ParametroInvalido(f"_id inválido: {valor}")
+
+    for valor in params.get("_lastUpdated", []):
+        filtros.append(_filtro_fecha(columnas["lastUpdated"], valor))
+
+    for valor in params.get("date", []):
+        if "date" in columnas:
+            filtros.append(_filtro_fecha(columnas["date"], valor))
+
+    for nombre in ("subject", "patient"):
+        for valor in params.get(nombre, []):
+            if "subject" in columnas:
+                filtros.append(columnas["subject"] == _referencia(valor, "Patient"))
+
+    for nombre, referenciado in (("practitioner", "Practitioner"), ("encounter", "Encounter")):
+        for valor in params.get(nombre, []):
+            if nombre in columnas:
+                filtros.append(columnas[nombre] == _referencia(valor, referenciado))
+
+    for nombre in ("identifier", "code", "reason-code"):
+        for valor in params.get(nombre, []):
+            if nombre in columnas:
+                codigos = [_token(v, resource_type) for v in valor.split(",")]
+                filtros.append(columnas[nombre].in_([c for c in codigos if c is not None]))
+
+    # Un paciente sólo ve sus propios recursos clínicos
+    if paciente_id is not None:
+        if resource_type == "Patient":
+            filtros.append(columnas["id"] == paciente_id)
+        elif "subject" in columnas:
+            filtros.append(columnas["subject"] == paciente_id)
+
+    return filtros
+
+def _paciente_restringido(current_user: Usuario) -> Optional[int]:
+    if current_user.rol.nombre != "Paciente":
+        return None
+    return current_user.id
+
+# ==================== METADATA ====================
+@router.get("/metadata")
+async def capability_statement(request: Request):
+    return fhir_response({
+        "resourceType": "CapabilityStatement",
+        "status": "active",
+        "kind": "instance",
+        "fhirVersion": "4.0.1",
+        "format": ["json"],
+        "implementation": {
+            "description": "Fachada FHIR R4 de sólo lectura sobre PostgreSQL",
+            "url": f"{str(request.base_url).rstrip('/')}{router.prefix}"
+        },
+        "rest": [{
+            "mode": "server",
+            "resource": [{
+                "type": resource_type,
+                "interaction": [{"code": "read"}, {"code": "search-type"}],
+                "searchParam": [{"name": nombre} for nombre in SEARCH_PARAMS[resource_type]]
+            } for resource_type in LOCAL_TYPES]
+        }]
+    })
+
+# ==================== SEARCH ====================
+@router.get("/{resource_type}")
+async def buscar(
+    resource_type: str,
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    current_user: Usuario = Depends(get_current_user)
+):
+    if resource_type not in LOCAL_TYPES:
+        return operation_outcome(404, "not-supported", f"Tipo de recurso no soportado: {resource_type}")
+
+    params = {}
+    for nombre, valor in request.query_params.multi_items():
+        params.setdefault(nombre, []).append(valor)
+
+    try:
+        count = min(int(params.get("_count", [settings.FHIR_LOCAL_PAGE_SIZE])[0]), settings.FHIR_LOCAL_MAX_PAGE_SIZE)
+        cursor = int(params["_cursor"][0]) if "_cursor" in params else None
+        filtros = _filtros(resource_type, params, _paciente_restringido(current_user))
+    except ValueError:
+        return operation_outcome(400, "invalid", "_count y _cursor deben ser enteros")
+    except ParametroInvalido as e:
+        return operation_outcome(400, "invalid", str(e))
+
+    columna_id = fhir_local.columnas[resource_type]["id"]
+    query = fhir_local.consulta(resource_type).where(*filtros)
+
+    total = None
+    if params.get("_total", [""])[0] == "accurate":
+        total = await db.scalar(select(func.count()).select_from(query.subquery()))
+
+    # Paginación por keyset sobre el id: cada página cuesta lo mismo sin importar su posición
+    if cursor is not None:
+        query = query.where(columna_id > cursor)
+    filas = (await db.execute(query.order_by(columna_id).limit(count + 1))).all() if count > 0 else []
+
+    base = str(request.url_for("buscar", resource_type=resource_type))
+    links = [{"relation": "self", "url": str(request.url)}]
+    if len(filas) > count:
+        filas = filas[:count]
+        siguiente = [(k, v) for k, v in request.query_params.multi_items() if k not in ("_cursor", "_count")]
+        siguiente += [("_count", str(count)), ("_cursor", str(filas[-1].id))]
+        links.append({"relation": "next", "url": str(request.url.replace(query=urlencode(siguiente)))})
+
+    bundle = {
+        "resourceType": "Bundle",
+        "type": "searchset",
+        "link": links,
+        "entry": [{
+            "fullUrl": f"{base}/{fila.id}",
+            "resource": fhir_local.resource(resource_type, fila),
+            "search": {"mode": "match"}
+        } for fila in filas]
+    }
+    if total is not None:
+        bundle["total"] = total
+    return fhir_response(bundle)
+
+# ==================== READ ====================
+@router.get("/{resource_type}/{resource_id}")
+async def leer(
+    resource_type: str,
+    resource_id: str,
+    db: AsyncSession = Depends(get_db),
+    current_user: Usuario = Depends(get_current_user)
+):
+    if resource_type not in LOCAL_TYPES:
+        return operation_outcome(404, "not-supported", f"Tipo de recurso no soportado: {resource_type}")
+    if not resource_id.isdigit():
+        return operation_outcome(404, "not-found", f"{resource_type}/{resource_id} no existe")
+
+    filtros = _filtros(resource_type, {}, _paciente_restringido(current_user))
+    fila = (await db.execute(fhir_local.consulta(resource_type).where(
+        fhir_local.columnas[resource_type]["id"] == int(resource_id), *filtros
+    ))).first()
+    if not fila:
+        return operation_outcome(404, "not-found", f"{resource_type}/{resource_id} no existe")
+
+    return fhir_response(fhir_local.resource(resource_type, fila))
@@ -1,20 +1,22 @@
+import math
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from app.database import get_db
-from app.models.models import Usuario, EncuentroMedico
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_db_lectura
+from app.models.models import Usuario
 from app.services.auth import get_current_user, require_roles
+from app.services.consultas import cargar_historial
 from app.services.fhir_service import fhir_service
 
 router = APIRouter(prefix="/historial", tags=["historial"])
 
 @router.get("/")
 async def obtener_mi_historial(
-    db: Session = Depends(get_db),
+    incluir_archivo: bool = False,
+    db: AsyncSession = Depends(get_db_lectura),
     current_user: Usuario = Depends(require_roles(["Paciente"]))
 ):
-    encuentros = db.query(EncuentroMedico).filter(
-        EncuentroMedico.paciente_id == current_user.id
-    ).order_by(EncuentroMedico.fecha.desc()).all()
+    encuentros = await cargar_historial(db, current_user.id, incluir_archivo)
     
     historial = []
     for enc in encuentros:
@@ -44,22 +46,31 @@ async def obtener_historial_fhir(
     if not current_user.fhir_patient_id:
         raise HTTPException(status_code=404, detail="No tiene registro FHIR")
     
-    history = await fhir_service.get_patient_history(current_user.fhir_patient_id)
-    return history
+    # Con el breaker abierto sólo se puede responder desde la caché
+    if not fhir_service.disponible and fhir_service.cache.get("PatientHistory", current_user.fhir_patient_id) is None:
+        raise HTTPException(
+            status_code=503,
+            detail="HAPI FHIR no disponible, intente más tarde",
+            headers={"Retry-After": str(math.ceil(fhir_service.breaker.reintentar_en) or 1)}
+        )
+    
+    return StreamingResponse(
+        fhir_service.stream_patient_history(current_user.fhir_patient_id),
+        media_type="application/json"
+    )
 
 @router.get("/paciente/{paciente_id}")
 async def obtener_historial_paciente(
     paciente_id: int,
-    db: Session = Depends(get_db),
+    incluir_archivo: bool = False,
+    db: AsyncSession = Depends(get_db_lectura),
     current_user: Usuario = Depends(require_roles(["Medico", "Administrador"]))
 ):
-    paciente = db.query(Usuario).filter(Usuario.id == paciente_id).first()
+    paciente = await db.get(Usuario, paciente_id)
     if not paciente:
         raise HTTPException(status_code=404, detail="Paciente no encontrado")
     
-    encuentros = db.query(EncuentroMedico).filter(
-        EncuentroMedico.paciente_id == paciente_id
-    ).order_by(EncuentroMedico.fecha.desc()).all()
+    encuentros = await cargar_historial(db, paciente_id, incluir_archivo)
     
     historial = []
     for enc in encuentros:
@@ -1,25 +1,29 @@
+import asyncio
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
-from app.database import get_db
-from app.models.models import Usuario, EncuentroMedico
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_db_lectura
+from app.models.models import Usuario
 from app.services.auth import get_current_user, require_roles
+from app.services.consultas import cargar_historial, paciente_con_documento
 from app.services.pdf_service import generar_historia_clinica_pdf, generar_carne_paciente_pdf
 
 router = APIRouter(prefix="/pdf", tags=["pdf"])
 
 @router.get("/mi-historia")
 async def descargar_mi_historia(
-    db: Session = Depends(get_db),
+    incluir_archivo: bool = False,
+    db: AsyncSession = Depends(get_db_lectura),
     current_user: Usuario = Depends(require_roles(["Paciente"]))
 ):
-    encuentros = db.query(EncuentroMedico).filter(
-        EncuentroMedico.paciente_id == current_user.id
-    ).order_by(EncuentroMedico.fecha.desc()).all()
+    paciente = await db.scalar(paciente_con_documento(current_user.id))
+    encuentros = await cargar_historial(db, current_user.id, incluir_archivo)
     
-    pdf_buffer = generar_historia_clinica_pdf(current_user, encuentros)
+    # WeasyPrint es CPU puro: se renderiza en un hilo para no detener el resto de peticiones.
+    # Todo lo que lee el PDF ya viene cargado; en el hilo la sesión asíncrona no puede cargar nada.
+    pdf_buffer = await asyncio.to_thread(generar_historia_clinica_pdf, paciente, encuentros)
     
-    filename = f"historia_clinica_{current_user.numero_documento}.pdf"
+    filename = f"historia_clinica_{paciente.numero_documento}.pdf"
     
     return StreamingResponse(
         pdf_buffer,
@@ -30,18 +34,17 @@ async def descargar_mi_historia(
 @router.get("/historia/{paciente_id}")
 async def descargar_historia_paciente(
     paciente_id: int,
-    db: Session = Depends(get_db),
+    incluir_archivo: bool = False,
+    db: AsyncSession = Depends(get_db_lectura),
     current_user: Usuario = Depends(require_roles(["Medico", "Administrador", "Admisionista"]))
 ):
-    paciente = db.query(Usuario).filter(Usuario.id == paciente_id).first()
+    paciente = await db.scalar(paciente_con_documento(paciente_id))
     if not paciente:
         raise HTTPException(status_code=404, detail="Paciente no encontrado")
     
-    encuentros = db.query(EncuentroMedico).filter(
-        EncuentroMedico.paciente_id == paciente_id
-    ).order_by(EncuentroMedico.fecha.desc()).all()
+    encuentros = await cargar_historial(db, paciente_id, incluir_archivo)
     
-    pdf_buffer = generar_historia_clinica_pdf(paciente, encuentros)
+    pdf_buffer = await asyncio.to_thread(generar_historia_clinica_pdf, paciente, encuentros)
     
     filename = f"historia_clinica_{paciente.numero_documento}.pdf"
     
@@ -54,14 +57,14 @@ async def descargar_historia_paciente(
 @router.get("/carne/{paciente_id}")
 async def descargar_carne_paciente(
     paciente_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db_lectura),
     current_user: Usuario = Depends(require_roles(["Administrador", "Admisionista"]))
 ):
-    paciente = db.query(Usuario).filter(Usuario.id == paciente_id).first()
+    paciente = await db.scalar(paciente_con_documento(paciente_id))
     if not paciente:
         raise HTTPException(status_code=404, detail="Paciente no encontrado")
     
-    pdf_buffer = generar_carne_paciente_pdf(paciente)
+    pdf_buffer = await asyncio.to_thread(generar_carne_paciente_pdf, paciente)
     
     filename = f"carne_{paciente.numero_documento}.pdf"
     
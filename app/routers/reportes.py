@@ -1,72 +1,111 @@
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
-from sqlalchemy import func
-from app.database import get_db
-from app.models.models import Usuario, Rol, Sede, EncuentroMedico, ObservacionClinica, TipoEncuentroMedico
+import asyncio
+from datetime import date
+from typing import Literal, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_db, get_db_lectura
+from app.models.models import Usuario, OutboxFHIR
 from app.services.auth import require_roles
+from app.services.estadisticas import DIMENSIONES, resumen, series, reconciliador_estadisticas
+from app.services.fhir_service import fhir_service
+from app.services.fhir_sync import fhir_sync_worker
+from app.services.fhir_inbound import fhir_inbound_sync
 
 router = APIRouter(prefix="/reportes", tags=["reportes"])
 
 @router.get("/estadisticas")
 async def obtener_estadisticas(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db_lectura),
     current_user: Usuario = Depends(require_roles(["Administrador"]))
 ):
-    # Contar usuarios por rol
-    usuarios_por_rol = db.query(
-        Rol.nombre,
-        func.count(Usuario.id).label('total')
-    ).join(Usuario, Usuario.rol_id == Rol.id).group_by(Rol.nombre).all()
-    
-    # Total usuarios activos/inactivos
-    usuarios_activos = db.query(Usuario).filter(Usuario.activo == True).count()
-    usuarios_inactivos = db.query(Usuario).filter(Usuario.activo == False).count()
-    
-    # Total encuentros
-    total_encuentros = db.query(EncuentroMedico).count()
-    
-    # Encuentros por tipo
-    encuentros_por_tipo = db.query(
-        TipoEncuentroMedico.nombre,
-        func.count(EncuentroMedico.id).label('total')
-    ).join(EncuentroMedico, EncuentroMedico.tipo_id == TipoEncuentroMedico.id).group_by(TipoEncuentroMedico.nombre).all()
-    
-    # Encuentros por sede
-    encuentros_por_sede = db.query(
-        Sede.nombre,
-        func.count(EncuentroMedico.id).label('total')
-    ).join(EncuentroMedico, EncuentroMedico.sede_id == Sede.id).group_by(Sede.nombre).all()
-    
-    # Total observaciones
-    total_observaciones = db.query(ObservacionClinica).count()
+    # Contadores mantenidos por triggers: no recorre usuarios, encuentros ni observaciones
+    return await resumen(db)
+
+@router.post("/estadisticas/reconciliar")
+async def reconciliar_estadisticas(
+    current_user: Usuario = Depends(require_roles(["Administrador"]))
+):
+    desviados = await reconciliador_estadisticas.ejecutar()
+    if desviados is None:
+        return {"message": "Ya hay una reconciliación en curso"}
+    return {"message": f"{desviados} contadores corregidos", "desviados": desviados}
+
+@router.get("/series")
+async def obtener_series(
+    desde: date,
+    hasta: date,
+    intervalo: Literal["dia", "semana", "mes"] = "dia",
+    por: Optional[str] = Query(None, description="Desglose separado por coma: sede, tipo, medico"),
+    sede_id: Optional[int] = None,
+    tipo_id: Optional[int] = None,
+    medico_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_db_lectura),
+    current_user: Usuario = Depends(require_roles(["Administrador"]))
+):
+    dimensiones = list(dict.fromkeys(d.strip() for d in por.split(",") if d.strip())) if por else []
+    invalidas = [d for d in dimensiones if d not in DIMENSIONES]
+    if invalidas:
+        raise HTTPException(status_code=400, detail=f"Desglose no soportado: {', '.join(invalidas)}")
+    if hasta < desde:
+        raise HTTPException(status_code=400, detail="hasta debe ser posterior a desde")
+
+    return {
+        "desde": desde.isoformat(),
+        "hasta": hasta.isoformat(),
+        "intervalo": intervalo,
+        "por": dimensiones,
+        "series": await series(db, desde, hasta, intervalo, dimensiones, sede_id, tipo_id, medico_id)
+    }
+
+@router.get("/sincronizacion")
+async def obtener_sincronizacion(
+    db: AsyncSession = Depends(get_db),
+    current_user: Usuario = Depends(require_roles(["Administrador"]))
+):
+    por_estado = (await db.execute(select(
+        OutboxFHIR.estado,
+        func.count(OutboxFHIR.id).label('total')
+    ).group_by(OutboxFHIR.estado))).all()
     
-    # Total sedes activas
-    sedes_activas = db.query(Sede).filter(Sede.activo == True).count()
+    fallidos = (await db.scalars(select(OutboxFHIR).where(
+        OutboxFHIR.estado == "fallido"
+    ).order_by(OutboxFHIR.id.desc()).limit(50))).all()
     
-    # Usuarios con FHIR sincronizado
-    pacientes_fhir = db.query(Usuario).filter(Usuario.fhir_patient_id != None).count()
-    medicos_fhir = db.query(Usuario).filter(Usuario.fhir_practitioner_id != None).count()
+    return {
+        "por_estado": {e[0]: e[1] for e in por_estado},
+        "fallidos": [{
+            "id": f.id,
+            "operacion": f.operacion,
+            "entidad_id": f.entidad_id,
+            "intentos": f.intentos,
+            "ultimo_error": f.ultimo_error,
+            "created_at": f.created_at.isoformat() if f.created_at else None
+        } for f in fallidos]
+    }
+
+@router.post("/sincronizacion/reintentar")
+async def reintentar_sincronizacion(
+    db: AsyncSession = Depends(get_db),
+    current_user: Usuario = Depends(require_roles(["Administrador"]))
+):
+    resultado = await db.execute(update(OutboxFHIR).where(OutboxFHIR.estado == "fallido").values(
+        estado="pendiente",
+        intentos=0,
+        proximo_intento=func.now()
+    ).execution_options(synchronize_session=False))
+    total = resultado.rowcount
+    await db.commit()
+    fhir_sync_worker.notify()
     
+    return {"message": f"{total} operaciones reencoladas"}
+
+@router.get("/fhir")
+async def obtener_estado_fhir(
+    current_user: Usuario = Depends(require_roles(["Administrador"]))
+):
     return {
-        "usuarios": {
-            "total": usuarios_activos + usuarios_inactivos,
-            "activos": usuarios_activos,
-            "inactivos": usuarios_inactivos,
-            "por_rol": [{"rol": r[0], "total": r[1]} for r in usuarios_por_rol]
-        },
-        "encuentros": {
-            "total": total_encuentros,
-            "por_tipo": [{"tipo": t[0], "total": t[1]} for t in encuentros_por_tipo],
-            "por_sede": [{"sede": s[0], "total": s[1]} for s in encuentros_por_sede]
-        },
-        "observaciones": {
-            "total": total_observaciones
-        },
-        "sedes": {
-            "activas": sedes_activas
-        },
-        "fhir": {
-            "pacientes_sincronizados": pacientes_fhir,
-            "medicos_sincronizados": medicos_fhir
-        }
+        "breaker": fhir_service.breaker.stats(),
+        "cache": fhir_service.cache.stats(),
+        "entrante": await asyncio.to_thread(fhir_inbound_sync.stats)
     }
@@ -1,27 +1,40 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
+from app.config import settings
 from app.database import get_db
 from app.models.models import Rol, Usuario
-from app.schemas.schemas import RolCreate, RolOut
+from app.schemas.schemas import RolCreate, RolOut, PaginaRoles
 from app.services.auth import require_roles
+from app.services.paginacion import decodificar_cursor, pagina
 
 router = APIRouter(prefix="/roles", tags=["roles"])
 
-@router.get("/", response_model=List[RolOut])
+@router.get("/", response_model=PaginaRoles)
 async def listar_roles(
-    db: Session = Depends(get_db),
+    activo: Optional[bool] = None,
+    cursor: Optional[str] = None,
+    limite: int = Query(settings.API_PAGE_SIZE, ge=1, le=settings.API_MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_db),
     current_user: Usuario = Depends(require_roles(["Administrador"]))
 ):
-    return db.query(Rol).all()
+    filtros = []
+    if activo is not None:
+        filtros.append(Rol.activo == activo)
+    if cursor:
+        filtros.append(Rol.id > decodificar_cursor(cursor, int)[0])
+
+    query = select(Rol).where(*filtros).order_by(Rol.id).limit(limite + 1)
+    return pagina((await db.scalars(query)).all(), limite, lambda r: (r.id,))
 
 @router.get("/{rol_id}", response_model=RolOut)
 async def obtener_rol(
     rol_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: Usuario = Depends(require_roles(["Administrador"]))
 ):
-    rol = db.query(Rol).filter(Rol.id == rol_id).first()
+    rol = await db.get(Rol, rol_id)
     if not rol:
         raise HTTPException(status_code=404, detail="Rol no encontrado")
     return rol
@@ -29,46 +42,46 @@ async def obtener_rol(
 @router.post("/", response_model=RolOut)
 async def crear_rol(
     rol: RolCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: Usuario = Depends(require_roles(["Administrador"]))
 ):
-    existe = db.query(Rol).filter(Rol.nombre == rol.nombre).first()
+    existe = await db.scalar(select(Rol.id).where(Rol.nombre == rol.nombre))
     if existe:
         raise HTTPException(status_code=400, detail="El rol ya existe")
     
     nuevo_rol = Rol(nombre=rol.nombre, descripcion=rol.descripcion)
     db.add(nuevo_rol)
-    db.commit()
-    db.refresh(nuevo_rol)
+    await db.commit()
+    await db.refresh(nuevo_rol)
     return nuevo_rol
 
 @router.put("/{rol_id}", response_model=RolOut)
 async def actualizar_rol(
     rol_id: int,
     rol_data: RolCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: Usuario = Depends(require_roles(["Administrador"]))
 ):
-    rol = db.query(Rol).filter(Rol.id == rol_id).first()
+    rol = await db.get(Rol, rol_id)
     if not rol:
         raise HTTPException(status_code=404, detail="Rol no encontrado")
     
     rol.nombre = rol_data.nombre
     rol.descripcion = rol_data.descripcion
-    db.commit()
-    db.refresh(rol)
+    await db.commit()
+    await db.refresh(rol)
     return rol
 
 @router.delete("/{rol_id}")
 async def eliminar_rol(
     rol_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: Usuario = Depends(require_roles(["Administrador"]))
 ):
-    rol = db.query(Rol).filter(Rol.id == rol_id).first()
+    rol = await db.get(Rol, rol_id)
     if not rol:
         raise HTTPException(status_code=404, detail="Rol no encontrado")
     
     rol.activo = False
-    db.commit()
+    await db.commit()
     return {"message": "Rol desactivado"}
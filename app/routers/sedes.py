@@ -1,10 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
 from pydantic import BaseModel
+from app.config import settings
 from app.database import get_db
 from app.models.models import Sede, Usuario
+from app.schemas.schemas import PaginaSedes
 from app.services.auth import require_roles
+from app.services.paginacion import decodificar_cursor, pagina
 
 router = APIRouter(prefix="/sedes", tags=["sedes"])
 
@@ -21,20 +25,33 @@ class SedeUpdate(BaseModel):
     telefono: Optional[str] = None
     activo: Optional[bool] = None
 
-@router.get("/")
+@router.get("/", response_model=PaginaSedes)
 async def listar_sedes(
-    db: Session = Depends(get_db),
+    ciudad: Optional[str] = None,
+    activo: Optional[bool] = None,
+    cursor: Optional[str] = None,
+    limite: int = Query(settings.API_PAGE_SIZE, ge=1, le=settings.API_MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_db),
     current_user: Usuario = Depends(require_roles(["Administrador"]))
 ):
-    return db.query(Sede).all()
+    filtros = []
+    if ciudad:
+        filtros.append(Sede.ciudad == ciudad)
+    if activo is not None:
+        filtros.append(Sede.activo == activo)
+    if cursor:
+        filtros.append(Sede.id > decodificar_cursor(cursor, int)[0])
+
+    query = select(Sede).where(*filtros).order_by(Sede.id).limit(limite + 1)
+    return pagina((await db.scalars(query)).all(), limite, lambda s: (s.id,))
 
 @router.get("/{sede_id}")
 async def obtener_sede(
     sede_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: Usuario = Depends(require_roles(["Administrador"]))
 ):
-    sede = db.query(Sede).filter(Sede.id == sede_id).first()
+    sede = await db.get(Sede, sede_id)
     if not sede:
         raise HTTPException(status_code=404, detail="Sede no encontrada")
     return sede
@@ -42,7 +59,7 @@ async def obtener_sede(
 @router.post("/")
 async def crear_sede(
     sede: SedeCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: Usuario = Depends(require_roles(["Administrador"]))
 ):
     nueva_sede = Sede(
@@ -52,18 +69,18 @@ async def crear_sede(
         telefono=sede.telefono if sede.telefono else None
     )
     db.add(nueva_sede)
-    db.commit()
-    db.refresh(nueva_sede)
+    await db.commit()
+    await db.refresh(nueva_sede)
     return nueva_sede
 
 @router.put("/{sede_id}")
 async def actualizar_sede(
     sede_id: int,
     sede_data: SedeUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: Usuario = Depends(require_roles(["Administrador"]))
 ):
-    sede = db.query(Sede).filter(Sede.id == sede_id).first()
+    sede = await db.get(Sede, sede_id)
     if not sede:
         raise HTTPException(status_code=404, detail="Sede no encontrada")
     
@@ -73,34 +90,34 @@ async def actualizar_sede(
             value = None
         setattr(sede, key, value)
     
-    db.commit()
-    db.refresh(sede)
+    await db.commit()
+    await db.refresh(sede)
     return sede
 
 @router.patch("/{sede_id}/toggle-estado")
 async def toggle_estado_sede(
     sede_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: Usuario = Depends(require_roles(["Administrador"]))
 ):
-    sede = db.query(Sede).filter(Sede.id == sede_id).first()
+    sede = await db.get(Sede, sede_id)
     if not sede:
         raise HTTPException(status_code=404, detail="Sede no encontrada")
     
     sede.activo = not sede.activo
-    db.commit()
+    await db.commit()
     return {"message": f"Sede {'activada' if sede.activo else 'desactivada'}", "activo": sede.activo}
 
 @router.delete("/{sede_id}")
 async def eliminar_sede(
     sede_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: Usuario = Depends(require_roles(["Administrador"]))
 ):
-    sede = db.query(Sede).filter(Sede.id == sede_id).first()
+    sede = await db.get(Sede, sede_id)
     if not sede:
         raise HTTPException(status_code=404, detail="Sede no encontrada")
     
-    db.delete(sede)
-    db.commit()
+    await db.delete(sede)
+    await db.commit()
     return {"message": "Sede eliminada"}
@@ -1,43 +1,55 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
+import asyncio
+from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from typing import Optional
 from pydantic import BaseModel
+from app.config import settings
 from app.database import get_db
 from app.models.models import Usuario, Rol, TipoDocumento, Sede
-from app.schemas.schemas import UsuarioCreate, UsuarioUpdate, UsuarioOut, UsuarioConRelaciones
+from app.schemas.schemas import UsuarioCreate, UsuarioUpdate, UsuarioOut, UsuarioConRelaciones, PaginaUsuarios
 from app.services.auth import get_password_hash, get_current_user, require_roles
-from app.services.fhir_service import fhir_service
+from app.services.consultas import USUARIO_CON_RELACIONES
+from app.services.fhir_sync import encolar, fhir_sync_worker
+from app.services.importacion import FORMATOS, formato_de, importar
+from app.services.paginacion import decodificar_cursor, pagina
 
 router = APIRouter(prefix="/usuarios", tags=["usuarios"])
 
 class ToggleEstado(BaseModel):
     activo: bool
 
-def get_user_data(usuario):
-    return {
-        "numero_documento": usuario.numero_documento,
-        "nombres": usuario.nombres,
-        "apellidos": usuario.apellidos,
-        "genero": usuario.genero,
-        "fecha_nacimiento": usuario.fecha_nacimiento,
-        "telefono": usuario.telefono,
-        "email": usuario.email
-    }
-
-@router.get("/", response_model=List[UsuarioConRelaciones])
+@router.get("/", response_model=PaginaUsuarios)
 async def listar_usuarios(
-    db: Session = Depends(get_db),
+    rol: Optional[str] = Query(None, description="Nombre del rol, p. ej. Paciente"),
+    sede_id: Optional[int] = None,
+    activo: Optional[bool] = None,
+    cursor: Optional[str] = None,
+    limite: int = Query(settings.API_PAGE_SIZE, ge=1, le=settings.API_MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_db),
     current_user: Usuario = Depends(require_roles(["Administrador", "Admisionista"]))
 ):
-    return db.query(Usuario).all()
+    filtros = []
+    if rol:
+        filtros.append(Usuario.rol_id == select(Rol.id).where(Rol.nombre == rol).scalar_subquery())
+    if sede_id is not None:
+        filtros.append(Usuario.sede_registro_id == sede_id)
+    if activo is not None:
+        filtros.append(Usuario.activo == activo)
+    if cursor:
+        filtros.append(Usuario.id > decodificar_cursor(cursor, int)[0])
+
+    query = select(Usuario).options(*USUARIO_CON_RELACIONES).where(*filtros).order_by(Usuario.id).limit(limite + 1)
+    return pagina((await db.scalars(query)).all(), limite, lambda u: (u.id,))
 
 @router.get("/{usuario_id}", response_model=UsuarioConRelaciones)
 async def obtener_usuario(
     usuario_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: Usuario = Depends(require_roles(["Administrador", "Admisionista"]))
 ):
-    usuario = db.query(Usuario).filter(Usuario.id == usuario_id).first()
+    usuario = await db.scalar(select(Usuario).options(*USUARIO_CON_RELACIONES).where(Usuario.id == usuario_id))
     if not usuario:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
     return usuario
@@ -45,10 +57,10 @@ async def obtener_usuario(
 @router.post("/", response_model=UsuarioOut)
 async def crear_usuario(
     usuario: UsuarioCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: Usuario = Depends(require_roles(["Administrador", "Admisionista"]))
 ):
-    existe = db.query(Usuario).filter(Usuario.numero_documento == usuario.numero_documento).first()
+    existe = await db.scalar(select(Usuario.id).where(Usuario.numero_documento == usuario.numero_documento))
     if existe:
         raise HTTPException(status_code=400, detail="El documento ya está registrado")
     
@@ -67,81 +79,81 @@ async def crear_usuario(
     )
     
     db.add(nuevo_usuario)
-    db.commit()
-    db.refresh(nuevo_usuario)
-    
-    rol = db.query(Rol).filter(Rol.id == usuario.rol_id).first()
-    user_data = {
-        "numero_documento": usuario.numero_documento,
-        "nombres": usuario.nombres,
-        "apellidos": usuario.apellidos,
-        "genero": usuario.genero,
-        "fecha_nacimiento": usuario.fecha_nacimiento,
-        "telefono": usuario.telefono,
-        "email": usuario.email
-    }
+    await db.flush()
     
+    rol = await db.get(Rol, usuario.rol_id)
     if rol:
         if rol.nombre == "Paciente":
-            fhir_id = await fhir_service.create_patient(user_data)
-            if fhir_id:
-                nuevo_usuario.fhir_patient_id = fhir_id
-                db.commit()
+            encolar(db, "sync_patient", nuevo_usuario.id)
         elif rol.nombre == "Medico":
-            fhir_id = await fhir_service.create_practitioner(user_data)
-            if fhir_id:
-                nuevo_usuario.fhir_practitioner_id = fhir_id
-                db.commit()
+            encolar(db, "sync_practitioner", nuevo_usuario.id)
+    
+    await db.commit()
+    await db.refresh(nuevo_usuario)
+    fhir_sync_worker.notify()
     
     return nuevo_usuario
 
+@router.post("/importar")
+async def importar_pacientes(
+    archivo: UploadFile = File(..., description="CSV con encabezado o NDJSON, un paciente por fila con los campos de UsuarioCreate"),
+    formato: Optional[str] = Query(None, description="csv o ndjson; por defecto según la extensión del archivo"),
+    sede_id: Optional[int] = Query(None, description="Sede de registro de las filas que no traen sede_registro_id"),
+    current_user: Usuario = Depends(require_roles(["Administrador", "Admisionista"]))
+):
+    # Todas las filas se crean como pacientes. Devuelve el resumen y el error de cada fila rechazada;
+    # los Patient se crean en HAPI después, por lotes, desde el outbox.
+    formato = formato or formato_de(archivo.filename)
+    if formato not in FORMATOS:
+        raise HTTPException(status_code=400, detail=f"Formato no soportado: {formato}")
+    try:
+        contenido = (await archivo.read()).decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="El archivo debe estar en UTF-8")
+    
+    reporte = await asyncio.to_thread(importar, contenido, formato, sede_id)
+    fhir_sync_worker.notify()
+    return reporte
+
 @router.put("/{usuario_id}", response_model=UsuarioOut)
 async def actualizar_usuario(
     usuario_id: int,
     usuario_data: UsuarioUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: Usuario = Depends(require_roles(["Administrador", "Admisionista"]))
 ):
-    usuario = db.query(Usuario).filter(Usuario.id == usuario_id).first()
+    usuario = await db.scalar(select(Usuario).options(joinedload(Usuario.rol)).where(Usuario.id == usuario_id))
     if not usuario:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
     
     rol_anterior = usuario.rol.nombre if usuario.rol else None
     rol_nuevo_id = usuario_data.rol_id if usuario_data.rol_id else usuario.rol_id
-    rol_nuevo = db.query(Rol).filter(Rol.id == rol_nuevo_id).first()
+    rol_nuevo = await db.get(Rol, rol_nuevo_id)
     rol_nuevo_nombre = rol_nuevo.nombre if rol_nuevo else None
     
     for key, value in usuario_data.model_dump(exclude_unset=True).items():
         setattr(usuario, key, value)
     
-    db.commit()
-    db.refresh(usuario)
-    
-    user_data = get_user_data(usuario)
-    
+    # Recurso FHIR del rol anterior que ya no corresponde
+    eliminar = None
     if rol_anterior != rol_nuevo_nombre:
         if rol_anterior == "Paciente" and usuario.fhir_patient_id:
-            await fhir_service.delete_patient(usuario.fhir_patient_id)
+            eliminar = ("delete_patient", f"Patient/{usuario.fhir_patient_id}", usuario.fhir_patient_id)
             usuario.fhir_patient_id = None
         elif rol_anterior == "Medico" and usuario.fhir_practitioner_id:
-            await fhir_service.delete_practitioner(usuario.fhir_practitioner_id)
+            eliminar = ("delete_practitioner", f"Practitioner/{usuario.fhir_practitioner_id}", usuario.fhir_practitioner_id)
             usuario.fhir_practitioner_id = None
-        
-        if rol_nuevo_nombre == "Paciente":
-            fhir_id = await fhir_service.create_patient(user_data)
-            if fhir_id:
-                usuario.fhir_patient_id = fhir_id
-        elif rol_nuevo_nombre == "Medico":
-            fhir_id = await fhir_service.create_practitioner(user_data)
-            if fhir_id:
-                usuario.fhir_practitioner_id = fhir_id
-        
-        db.commit()
-    else:
-        if rol_nuevo_nombre == "Paciente" and usuario.fhir_patient_id:
-            await fhir_service.update_patient(usuario.fhir_patient_id, user_data)
-        elif rol_nuevo_nombre == "Medico" and usuario.fhir_practitioner_id:
-            await fhir_service.update_practitioner(usuario.fhir_practitioner_id, user_data)
+    
+    operacion = {"Paciente": "sync_patient", "Medico": "sync_practitioner"}.get(rol_nuevo_nombre)
+    if operacion:
+        # El DELETE del recurso anterior viaja en la misma transacción FHIR que el upsert del nuevo
+        encolar(db, operacion, usuario.id, {"eliminar": eliminar[1]} if eliminar else None)
+    elif eliminar:
+        encolar(db, eliminar[0], usuario.id, {"fhir_id": eliminar[2]})
+    
+    await db.commit()
+    await db.refresh(usuario)
+    fhir_sync_worker.notify()
     
     return usuario
 
@@ -149,37 +161,36 @@ async def actualizar_usuario(
 async def toggle_estado_usuario(
     usuario_id: int,
     estado: ToggleEstado,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: Usuario = Depends(require_roles(["Administrador"]))
 ):
-    usuario = db.query(Usuario).filter(Usuario.id == usuario_id).first()
+    usuario = await db.get(Usuario, usuario_id)
     if not usuario:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
     
     usuario.activo = estado.activo
-    db.commit()
+    await db.commit()
     
     return {"message": f"Usuario {'activado' if estado.activo else 'desactivado'}", "activo": estado.activo}
 
 @router.delete("/{usuario_id}")
 async def eliminar_usuario(
     usuario_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: Usuario = Depends(require_roles(["Administrador"]))
 ):
-    usuario = db.query(Usuario).filter(Usuario.id == usuario_id).first()
+    usuario = await db.get(Usuario, usuario_id)
     if not usuario:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
     
     if usuario.fhir_patient_id:
-        await fhir_service.delete_patient(usuario.fhir_patient_id)
-        print(f"[FHIR] Deleted Patient: {usuario.fhir_patient_id}")
+        encolar(db, "delete_patient", usuario.id, {"fhir_id": usuario.fhir_patient_id})
     
     if usuario.fhir_practitioner_id:
-        await fhir_service.delete_practitioner(usuario.fhir_practitioner_id)
-        print(f"[FHIR] Deleted Practitioner: {usuario.fhir_practitioner_id}")
+        encolar(db, "delete_practitioner", usuario.id, {"fhir_id": usuario.fhir_practitioner_id})
     
-    db.delete(usuario)
-    db.commit()
+    await db.delete(usuario)
+    await db.commit()
+    fhir_sync_worker.notify()
     
     return {"message": "Usuario eliminado completamente"}
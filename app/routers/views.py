@@ -1,34 +1,47 @@
-from fastapi import APIRouter, Depends, Request
+from fastapi import APIRouter, Depends, Query, Request
 from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
-from app.database import get_db
-from app.models.models import Usuario, Rol, TipoDocumento, Sede, TipoEncuentroMedico, EncuentroMedico
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from app.config import settings
+from app.database import get_db, get_db_lectura
+from app.models.models import Usuario, Rol, TipoDocumento, Sede, TipoEncuentroMedico
 from app.services.auth import decode_token
+from app.services.busqueda import buscar_pacientes
+from app.services.consultas import USUARIO_CON_RELACIONES, consultas_medico, historial_paciente
 
 router = APIRouter(tags=["views"])
 templates = Jinja2Templates(directory="/opt/clinica-fhir/app/templates")
 
-def get_current_user_optional(request: Request, db: Session):
+async def get_current_user_optional(request: Request, db: AsyncSession):
     token = request.cookies.get("access_token")
     if not token:
         return None
     payload = decode_token(token)
     if not payload:
         return None
-    usuario = db.query(Usuario).filter(Usuario.numero_documento == payload.get("sub")).first()
+    usuario = await db.scalar(
+        select(Usuario).options(joinedload(Usuario.rol)).where(Usuario.numero_documento == payload.get("sub"))
+    )
     return usuario
 
+async def _todos(db: AsyncSession, query) -> list:
+    return (await db.scalars(query)).all()
+
+async def _rol_paciente(db: AsyncSession) -> Rol:
+    return await db.scalar(select(Rol).where(Rol.nombre == "Paciente"))
+
 @router.get("/", response_class=HTMLResponse)
-async def home(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user_optional(request, db)
+async def home(request: Request, db: AsyncSession = Depends(get_db)):
+    user = await get_current_user_optional(request, db)
     if user:
         return RedirectResponse(url="/dashboard")
     return templates.TemplateResponse("login.html", {"request": request})
 
 @router.get("/dashboard", response_class=HTMLResponse)
-async def dashboard(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user_optional(request, db)
+async def dashboard(request: Request, db: AsyncSession = Depends(get_db)):
+    user = await get_current_user_optional(request, db)
     if not user:
         return RedirectResponse(url="/")
     
@@ -44,15 +57,15 @@ async def dashboard(request: Request, db: Session = Depends(get_db)):
 
 # ==================== ADMIN ====================
 @router.get("/admin/usuarios", response_class=HTMLResponse)
-async def admin_usuarios(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user_optional(request, db)
+async def admin_usuarios(request: Request, db: AsyncSession = Depends(get_db_lectura)):
+    user = await get_current_user_optional(request, db)
     if not user or user.rol.nombre != "Administrador":
         return RedirectResponse(url="/")
     
-    usuarios = db.query(Usuario).all()
-    tipos_doc = db.query(TipoDocumento).all()
-    roles = db.query(Rol).filter(Rol.activo == True).all()
-    sedes = db.query(Sede).filter(Sede.activo == True).all()
+    usuarios = await _todos(db, select(Usuario).options(*USUARIO_CON_RELACIONES))
+    tipos_doc = await _todos(db, select(TipoDocumento))
+    roles = await _todos(db, select(Rol).where(Rol.activo == True))
+    sedes = await _todos(db, select(Sede).where(Sede.activo == True))
     
     return templates.TemplateResponse("admin/usuarios.html", {
         "request": request,
@@ -64,12 +77,12 @@ async def admin_usuarios(request: Request, db: Session = Depends(get_db)):
     })
 
 @router.get("/admin/roles", response_class=HTMLResponse)
-async def admin_roles(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user_optional(request, db)
+async def admin_roles(request: Request, db: AsyncSession = Depends(get_db_lectura)):
+    user = await get_current_user_optional(request, db)
     if not user or user.rol.nombre != "Administrador":
         return RedirectResponse(url="/")
     
-    roles = db.query(Rol).all()
+    roles = await _todos(db, select(Rol))
     return templates.TemplateResponse("admin/roles.html", {
         "request": request,
         "user": user,
@@ -77,12 +90,12 @@ async def admin_roles(request: Request, db: Session = Depends(get_db)):
     })
 
 @router.get("/admin/sedes", response_class=HTMLResponse)
-async def admin_sedes(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user_optional(request, db)
+async def admin_sedes(request: Request, db: AsyncSession = Depends(get_db_lectura)):
+    user = await get_current_user_optional(request, db)
     if not user or user.rol.nombre != "Administrador":
         return RedirectResponse(url="/")
     
-    sedes = db.query(Sede).all()
+    sedes = await _todos(db, select(Sede))
     return templates.TemplateResponse("admin/sedes.html", {
         "request": request,
         "user": user,
@@ -90,8 +103,8 @@ async def admin_sedes(request: Request, db: Session = Depends(get_db)):
     })
 
 @router.get("/admin/reportes", response_class=HTMLResponse)
-async def admin_reportes(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user_optional(request, db)
+async def admin_reportes(request: Request, db: AsyncSession = Depends(get_db_lectura)):
+    user = await get_current_user_optional(request, db)
     if not user or user.rol.nombre != "Administrador":
         return RedirectResponse(url="/")
     
@@ -102,14 +115,12 @@ async def admin_reportes(request: Request, db: Session = Depends(get_db)):
 
 # ==================== MEDICO ====================
 @router.get("/medico/consultas", response_class=HTMLResponse)
-async def medico_consultas(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user_optional(request, db)
+async def medico_consultas(request: Request, db: AsyncSession = Depends(get_db)):
+    user = await get_current_user_optional(request, db)
     if not user or user.rol.nombre != "Medico":
         return RedirectResponse(url="/")
     
-    encuentros = db.query(EncuentroMedico).filter(
-        EncuentroMedico.medico_id == user.id
-    ).order_by(EncuentroMedico.fecha.desc()).all()
+    encuentros = await _todos(db, consultas_medico(user.id))
     
     return templates.TemplateResponse("medico/consultas.html", {
         "request": request,
@@ -118,34 +129,44 @@ async def medico_consultas(request: Request, db: Session = Depends(get_db)):
     })
 
 @router.get("/medico/nuevo-encuentro", response_class=HTMLResponse)
-async def medico_nuevo_encuentro(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user_optional(request, db)
+async def medico_nuevo_encuentro(request: Request, db: AsyncSession = Depends(get_db)):
+    user = await get_current_user_optional(request, db)
     if not user or user.rol.nombre != "Medico":
         return RedirectResponse(url="/")
     
-    rol_paciente = db.query(Rol).filter(Rol.nombre == "Paciente").first()
-    pacientes = db.query(Usuario).filter(Usuario.rol_id == rol_paciente.id, Usuario.activo == True).all()
-    tipos = db.query(TipoEncuentroMedico).filter(TipoEncuentroMedico.activo == True).all()
-    sedes = db.query(Sede).filter(Sede.activo == True).all()
+    # Los pacientes no se cargan aquí: el formulario los busca en /medico/api/pacientes
+    tipos = await _todos(db, select(TipoEncuentroMedico).where(TipoEncuentroMedico.activo == True))
+    sedes = await _todos(db, select(Sede).where(Sede.activo == True))
     
     return templates.TemplateResponse("medico/nuevo_encuentro.html", {
         "request": request,
         "user": user,
-        "pacientes": pacientes,
         "tipos_encuentro": tipos,
         "sedes": sedes
     })
 
+@router.get("/medico/api/pacientes")
+async def medico_api_pacientes(
+    request: Request,
+    q: str = "",
+    limite: int = Query(settings.BUSQUEDA_LIMITE, ge=1, le=settings.BUSQUEDA_MAX_LIMITE),
+    db: AsyncSession = Depends(get_db)
+):
+    # Typeahead del nuevo encuentro: pacientes activos por nombre o documento, primero los que el
+    # médico atendió hace poco; sin q devuelve sólo esos recientes
+    user = await get_current_user_optional(request, db)
+    if not user or user.rol.nombre != "Medico":
+        return {"resultados": []}
+    return {"resultados": await buscar_pacientes(db, q, limite, medico_id=user.id, solo_activos=True)}
+
 # ==================== PACIENTE ====================
 @router.get("/paciente/historial", response_class=HTMLResponse)
-async def paciente_historial(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user_optional(request, db)
+async def paciente_historial(request: Request, db: AsyncSession = Depends(get_db_lectura)):
+    user = await get_current_user_optional(request, db)
     if not user or user.rol.nombre != "Paciente":
         return RedirectResponse(url="/")
     
-    encuentros = db.query(EncuentroMedico).filter(
-        EncuentroMedico.paciente_id == user.id
-    ).order_by(EncuentroMedico.fecha.desc()).all()
+    encuentros = await _todos(db, historial_paciente(user.id))
     
     return templates.TemplateResponse("paciente/historial.html", {
         "request": request,
@@ -155,33 +176,31 @@ async def paciente_historial(request: Request, db: Session = Depends(get_db)):
 
 # ==================== ADMISIONISTA ====================
 @router.get("/admisionista/pacientes", response_class=HTMLResponse)
-async def admisionista_pacientes(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user_optional(request, db)
+async def admisionista_pacientes(request: Request, db: AsyncSession = Depends(get_db)):
+    user = await get_current_user_optional(request, db)
     if not user or user.rol.nombre != "Admisionista":
         return RedirectResponse(url="/")
     
-    rol_paciente = db.query(Rol).filter(Rol.nombre == "Paciente").first()
-    pacientes = db.query(Usuario).filter(Usuario.rol_id == rol_paciente.id).all()
-    tipos_doc = db.query(TipoDocumento).all()
-    sedes = db.query(Sede).filter(Sede.activo == True).all()
+    # La tabla se llena desde /admisionista/api/pacientes: la página no crece con el número de pacientes
+    tipos_doc = await _todos(db, select(TipoDocumento))
+    sedes = await _todos(db, select(Sede).where(Sede.activo == True))
     
     return templates.TemplateResponse("admisionista/pacientes.html", {
         "request": request,
         "user": user,
-        "pacientes": pacientes,
         "tipos_documento": tipos_doc,
         "sedes": sedes
     })
 
 @router.get("/admisionista/nuevo-paciente", response_class=HTMLResponse)
-async def admisionista_nuevo_paciente(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user_optional(request, db)
+async def admisionista_nuevo_paciente(request: Request, db: AsyncSession = Depends(get_db)):
+    user = await get_current_user_optional(request, db)
     if not user or user.rol.nombre != "Admisionista":
         return RedirectResponse(url="/")
     
-    tipos_doc = db.query(TipoDocumento).all()
-    sedes = db.query(Sede).filter(Sede.activo == True).all()
-    rol_paciente = db.query(Rol).filter(Rol.nombre == "Paciente").first()
+    tipos_doc = await _todos(db, select(TipoDocumento))
+    sedes = await _todos(db, select(Sede).where(Sede.activo == True))
+    rol_paciente = await _rol_paciente(db)
     
     return templates.TemplateResponse("admisionista/nuevo_paciente.html", {
         "request": request,
@@ -192,8 +211,8 @@ async def admisionista_nuevo_paciente(request: Request, db: Session = Depends(ge
     })
 
 @router.get("/admisionista/buscar", response_class=HTMLResponse)
-async def admisionista_buscar(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user_optional(request, db)
+async def admisionista_buscar(request: Request, db: AsyncSession = Depends(get_db)):
+    user = await get_current_user_optional(request, db)
     if not user or user.rol.nombre != "Admisionista":
         return RedirectResponse(url="/")
     
@@ -203,16 +222,16 @@ async def admisionista_buscar(request: Request, db: Session = Depends(get_db)):
     })
 
 @router.get("/admisionista/api/buscar/{documento}")
-async def api_buscar_paciente(documento: str, request: Request, db: Session = Depends(get_db)):
-    user = get_current_user_optional(request, db)
+async def api_buscar_paciente(documento: str, request: Request, db: AsyncSession = Depends(get_db)):
+    user = await get_current_user_optional(request, db)
     if not user or user.rol.nombre != "Admisionista":
         return {"encontrado": False}
     
-    rol_paciente = db.query(Rol).filter(Rol.nombre == "Paciente").first()
-    paciente = db.query(Usuario).filter(
+    rol_paciente = await _rol_paciente(db)
+    paciente = await db.scalar(select(Usuario).where(
         Usuario.numero_documento == documento,
         Usuario.rol_id == rol_paciente.id
-    ).first()
+    ))
     
     if paciente:
         return {
@@ -229,3 +248,16 @@ async def api_buscar_paciente(documento: str, request: Request, db: Session = De
             }
         }
     return {"encontrado": False}
+
+@router.get("/admisionista/api/pacientes")
+async def api_buscar_pacientes(
+    request: Request,
+    q: str = "",
+    limite: int = Query(settings.BUSQUEDA_LIMITE, ge=1, le=settings.BUSQUEDA_MAX_LIMITE),
+    db: AsyncSession = Depends(get_db)
+):
+    # Búsqueda aproximada por nombre (sin tildes, tolera errores de digitación) o documento (prefijo)
+    user = await get_current_user_optional(request, db)
+    if not user or user.rol.nombre != "Admisionista":
+        return {"resultados": []}
+    return {"resultados": await buscar_pacientes(db, q, limite)}
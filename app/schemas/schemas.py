@@ -107,6 +107,11 @@ class ObservacionCreate(ObservacionBase):
 class ObservacionOut(ObservacionBase):
     id: int
     fecha: datetime
+    valor_numerico: Optional[float] = None
+    valor_normalizado: Optional[float] = None
+    unidad_normalizada: Optional[str] = None
+    presion_sistolica: Optional[float] = None
+    presion_diastolica: Optional[float] = None
     fhir_observation_id: Optional[str] = None
     class Config:
         from_attributes = True
@@ -123,6 +128,19 @@ class EncuentroBase(BaseModel):
 class EncuentroCreate(EncuentroBase):
     observaciones: Optional[List[ObservacionCreate]] = []
 
+# Ingesta por lotes (POST /encuentros/lote): historias heredadas y equipos traen su propia fecha;
+# el administrador indica además el médico de cada encuentro
+class ObservacionLote(ObservacionCreate):
+    fecha: Optional[datetime] = None
+
+class EncuentroLote(EncuentroCreate):
+    fecha: Optional[datetime] = None
+    medico_id: Optional[int] = None
+    observaciones: Optional[List[ObservacionLote]] = []
+
+class LoteEncuentros(BaseModel):
+    encuentros: List[EncuentroLote]
+
 class EncuentroOut(EncuentroBase):
     id: int
     fecha: datetime
@@ -139,6 +157,23 @@ class EncuentroConRelaciones(EncuentroOut):
     medico: Optional[UsuarioOut] = None
     observaciones: List[ObservacionOut] = []
 
+# Listados paginados por keyset: siguiente es el cursor de la próxima página (None en la última)
+class PaginaRoles(BaseModel):
+    resultados: List[RolOut]
+    siguiente: Optional[str] = None
+
+class PaginaSedes(BaseModel):
+    resultados: List[SedeOut]
+    siguiente: Optional[str] = None
+
+class PaginaUsuarios(BaseModel):
+    resultados: List[UsuarioConRelaciones]
+    siguiente: Optional[str] = None
+
+class PaginaEncuentros(BaseModel):
+    resultados: List[EncuentroConRelaciones]
+    siguiente: Optional[str] = None
+
 # Login
 class LoginForm(BaseModel):
     numero_documento: str
@@ -4,7 +4,9 @@ from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status, Request
 from fastapi.security import HTTPBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
 from app.config import settings
 from app.database import get_db
 from app.models.models import Usuario
@@ -31,7 +33,7 @@ def decode_token(token: str) -> Optional[dict]:
     except JWTError:
         return None
 
-async def get_current_user(request: Request, db: Session = Depends(get_db)) -> Usuario:
+async def get_current_user(request: Request, db: AsyncSession = Depends(get_db)) -> Usuario:
     token = request.cookies.get("access_token")
     if not token:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="No autenticado")
@@ -44,7 +46,10 @@ async def get_current_user(request: Request, db: Session = Depends(get_db)) -> U
     if not numero_documento:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token inválido")
     
-    usuario = db.query(Usuario).filter(Usuario.numero_documento == numero_documento).first()
+    # El rol se carga junto al usuario: todas las rutas lo consultan para autorizar
+    usuario = await db.scalar(
+        select(Usuario).options(joinedload(Usuario.rol)).where(Usuario.numero_documento == numero_documento)
+    )
     if not usuario:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Usuario no encontrado")
     
@@ -0,0 +1,132 @@
+import html
+import re
+import unicodedata
+from datetime import datetime, timedelta
+from typing import List, Optional
+from sqlalchemy import case, func, literal, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from app.config import settings
+from app.models.models import EncuentroMedico, Rol, Usuario
+
+# Búsqueda aproximada de pacientes por nombre o documento con pg_trgm (postgres/init.sql):
+#   - nombres: word_similarity del término contra "nombres apellidos" sin tildes ni mayúsculas,
+#     con un índice GIN de trigramas sobre nombre_busqueda(nombres, apellidos)
+#   - documento: prefijo (índice btree text_pattern_ops) o similitud de trigramas, que tolera un
+#     dígito cambiado u omitido
+# Los operadores <% y % usan el índice y filtran por umbral; el orden final es por puntaje.
+# Con medico_id (selector de paciente del nuevo encuentro) los pacientes que ese médico atendió hace
+# poco van primero.
+
+SOLO_DOCUMENTO = re.compile(r"[^0-9A-Za-z]")
+
+def _plegar(caracter: str) -> str:
+    # Un carácter de entrada -> un carácter de salida, para poder mapear posiciones al resaltar
+    base = unicodedata.normalize("NFD", caracter)[0]
+    return base.lower() if len(base.lower()) == 1 else caracter
+
+def resaltar(texto: Optional[str], termino: str) -> Optional[str]:
+    # HTML escapado con <mark> en las apariciones de cada palabra del término, sin importar tildes
+    if not texto:
+        return texto
+    plegado = "".join(_plegar(c) for c in texto)
+    marcas = [False] * len(texto)
+    for palabra in {"".join(_plegar(c) for c in p) for p in termino.split() if len(p) >= 2}:
+        inicio = plegado.find(palabra)
+        while inicio != -1:
+            marcas[inicio:inicio + len(palabra)] = [True] * len(palabra)
+            inicio = plegado.find(palabra, inicio + 1)
+
+    partes, i = [], 0
+    while i < len(texto):
+        j = i
+        while j < len(texto) and marcas[j] == marcas[i]:
+            j += 1
+        segmento = html.escape(texto[i:j])
+        partes.append(f"<mark>{segmento}</mark>" if marcas[i] else segmento)
+        i = j
+    return "".join(partes)
+
+def consulta_pacientes(termino: str, limite: int, medico_id: Optional[int] = None, solo_activos: bool = False):
+    termino_sql = func.normalizar_busqueda(literal(termino))
+    nombre = func.nombre_busqueda(Usuario.nombres, Usuario.apellidos)
+    documento = SOLO_DOCUMENTO.sub("", termino)
+    prefijo = Usuario.numero_documento.like(f"{documento}%")
+
+    condiciones = [termino_sql.op("<%")(nombre)]
+    # Quien escribe el comienzo del nombre va primero aunque la similitud de la palabra sea baja
+    puntajes = [func.word_similarity(termino_sql, nombre), case((nombre.startswith(termino_sql), 1.0), else_=0.0)]
+    if any(c.isdigit() for c in documento):
+        condiciones += [prefijo, Usuario.numero_documento.op("%")(documento)]
+        puntajes.append(case(
+            (Usuario.numero_documento == documento, 1.0),
+            (prefijo, 0.9),
+            else_=func.similarity(Usuario.numero_documento, documento)
+        ))
+    puntaje = func.greatest(*puntajes).label("puntaje")
+
+    filtros = [Usuario.rol_id == select(Rol.id).where(Rol.nombre == "Paciente").scalar_subquery()]
+    if solo_activos:
+        filtros.append(Usuario.activo == True)
+    if termino:
+        filtros.append(or_(*condiciones))
+
+    if medico_id is None:
+        return select(Usuario, puntaje).options(joinedload(Usuario.tipo_documento)).where(
+            *filtros
+        ).order_by(puntaje.desc(), Usuario.id).limit(limite)
+
+    # Pacientes atendidos por el médico en los últimos días: salen primero, los más recientes arriba.
+    # Recorre idx_encuentros_medico sólo en las particiones del rango.
+    recientes = select(
+        EncuentroMedico.paciente_id, func.max(EncuentroMedico.fecha).label("ultima")
+    ).where(
+        EncuentroMedico.medico_id == medico_id,
+        EncuentroMedico.fecha >= datetime.now() - timedelta(days=settings.BUSQUEDA_RECIENTES_DIAS)
+    ).group_by(EncuentroMedico.paciente_id).subquery("recientes")
+
+    consulta = select(Usuario, puntaje, recientes.c.ultima).options(joinedload(Usuario.tipo_documento))
+    if termino:
+        consulta = consulta.outerjoin(recientes, recientes.c.paciente_id == Usuario.id)
+    else:
+        # Sin término: sólo los recientes, para ofrecerlos apenas se enfoca el campo
+        consulta = consulta.join(recientes, recientes.c.paciente_id == Usuario.id)
+    return consulta.where(*filtros).order_by(
+        recientes.c.ultima.is_(None), puntaje.desc(), recientes.c.ultima.desc(), Usuario.id
+    ).limit(limite)
+
+async def buscar_pacientes(db: AsyncSession, termino: str, limite: int = settings.BUSQUEDA_LIMITE,
+                           medico_id: Optional[int] = None, solo_activos: bool = False) -> List[dict]:
+    # Con medico_id, un término vacío devuelve los pacientes que ese médico atendió hace poco
+    termino = termino.strip()
+    if len(termino) < 2 and not (medico_id and not termino):
+        return []
+
+    # Umbrales de los operadores de pg_trgm, sólo para esta transacción
+    await db.execute(select(
+        func.set_config("pg_trgm.word_similarity_threshold", str(settings.BUSQUEDA_UMBRAL_NOMBRE), True),
+        func.set_config("pg_trgm.similarity_threshold", str(settings.BUSQUEDA_UMBRAL_DOCUMENTO), True)
+    ))
+    filas = (await db.execute(consulta_pacientes(termino, limite, medico_id, solo_activos))).all()
+
+    resultados = []
+    for fila in filas:
+        p = fila[0]
+        resultado = {
+            "id": p.id,
+            "nombres": p.nombres,
+            "apellidos": p.apellidos,
+            "tipo_documento": p.tipo_documento.prefijo if p.tipo_documento else None,
+            "numero_documento": p.numero_documento,
+            "fecha_nacimiento": str(p.fecha_nacimiento) if p.fecha_nacimiento else None,
+            "telefono": p.telefono,
+            "fhir_patient_id": p.fhir_patient_id,
+            "activo": p.activo,
+            "puntaje": round(float(fila.puntaje), 3),
+            "nombre_resaltado": resaltar(f"{p.nombres} {p.apellidos}", termino),
+            "documento_resaltado": resaltar(p.numero_documento, SOLO_DOCUMENTO.sub("", termino) or termino)
+        }
+        if medico_id is not None:
+            resultado["ultimo_encuentro"] = fila.ultima.isoformat() if fila.ultima else None
+        resultados.append(resultado)
+    return resultados
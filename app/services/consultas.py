@@ -0,0 +1,121 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional
+from sqlalchemy import Select, column, event, select, table, union_all
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased, joinedload, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from app.models.models import Usuario, EncuentroMedico, ObservacionClinica, TipoEncuentroMedico, Sede
+
+# Consultas compartidas de las rutas que listan encuentros. Las relaciones muchos-a-uno (tipo, sede,
+# médico, paciente) llegan en la misma sentencia con joinedload y las observaciones en una segunda
+# con selectinload: el número de sentencias no depende de cuántos encuentros haya.
+
+# ==================== USUARIOS ====================
+# Lo que serializa UsuarioConRelaciones y lista admin/usuarios
+USUARIO_CON_RELACIONES = (
+    joinedload(Usuario.tipo_documento),
+    joinedload(Usuario.sede_registro),
+    joinedload(Usuario.rol)
+)
+
+def paciente_con_documento(paciente_id: int) -> Select:
+    # El PDF y el carné muestran el prefijo del tipo de documento
+    return select(Usuario).options(joinedload(Usuario.tipo_documento)).where(Usuario.id == paciente_id)
+
+# ==================== ENCUENTROS ====================
+# EncuentroConRelaciones serializa las entidades completas
+ENCUENTRO_CON_RELACIONES = (
+    joinedload(EncuentroMedico.tipo),
+    joinedload(EncuentroMedico.sede),
+    joinedload(EncuentroMedico.paciente),
+    joinedload(EncuentroMedico.medico),
+    selectinload(EncuentroMedico.observaciones)
+)
+
+# Historial (JSON, PDF y vista del paciente): sólo las columnas que se muestran
+HISTORIAL = (
+    joinedload(EncuentroMedico.tipo).load_only(TipoEncuentroMedico.nombre),
+    joinedload(EncuentroMedico.sede).load_only(Sede.nombre),
+    joinedload(EncuentroMedico.medico).load_only(Usuario.nombres, Usuario.apellidos),
+    selectinload(EncuentroMedico.observaciones).load_only(
+        ObservacionClinica.encuentro_id, ObservacionClinica.fecha, ObservacionClinica.descripcion,
+        ObservacionClinica.valor, ObservacionClinica.unidad, ObservacionClinica.interpretacion,
+        ObservacionClinica.codigo_loinc
+    )
+)
+
+def historial_paciente(paciente_id: int) -> Select:
+    return select(EncuentroMedico).options(*HISTORIAL).where(
+        EncuentroMedico.paciente_id == paciente_id
+    ).order_by(EncuentroMedico.fecha.desc())
+
+# Meses archivados (python -m app.particiones archivar): viven en archivo.<tabla> con las mismas
+# columnas. Con incluir_archivo el historial lee la unión de ambas tablas a través de un alias de
+# la entidad, así la vista y el PDF reciben los mismos objetos de siempre.
+def _con_archivo(modelo):
+    caliente = modelo.__table__
+    archivo = table(caliente.name, *(column(c.name, c.type) for c in caliente.columns), schema="archivo")
+    union = union_all(select(caliente), select(*(archivo.c[c.name] for c in caliente.columns)))
+    return aliased(modelo, union.subquery(f"{caliente.name}_con_archivo"), adapt_on_names=True)
+
+async def cargar_historial(db: AsyncSession, paciente_id: int, incluir_archivo: bool = False) -> List[EncuentroMedico]:
+    if not incluir_archivo:
+        return (await db.scalars(historial_paciente(paciente_id))).all()
+
+    encuentro, observacion = _con_archivo(EncuentroMedico), _con_archivo(ObservacionClinica)
+    encuentros = (await db.scalars(select(encuentro).options(
+        joinedload(encuentro.tipo).load_only(TipoEncuentroMedico.nombre),
+        joinedload(encuentro.sede).load_only(Sede.nombre),
+        joinedload(encuentro.medico).load_only(Usuario.nombres, Usuario.apellidos)
+    ).where(encuentro.paciente_id == paciente_id).order_by(encuentro.fecha.desc()))).all()
+
+    # Las observaciones van en una segunda consulta, también sobre la unión, y se asignan sin
+    # marcar cambios: la relación no puede cargarse sola desde el alias
+    por_encuentro = defaultdict(list)
+    if encuentros:
+        for obs in (await db.scalars(select(observacion).where(
+            observacion.encuentro_id.in_([e.id for e in encuentros])
+        ).order_by(observacion.fecha))).all():
+            por_encuentro[obs.encuentro_id].append(obs)
+    for e in encuentros:
+        set_committed_value(e, "observaciones", por_encuentro[e.id])
+    return encuentros
+
+def consultas_medico(medico_id: int) -> Select:
+    # Vista medico/consultas: paciente, tipo y sede de cada encuentro, sin observaciones
+    return select(EncuentroMedico).options(
+        joinedload(EncuentroMedico.paciente).load_only(Usuario.nombres, Usuario.apellidos),
+        joinedload(EncuentroMedico.tipo).load_only(TipoEncuentroMedico.nombre),
+        joinedload(EncuentroMedico.sede).load_only(Sede.nombre)
+    ).where(EncuentroMedico.medico_id == medico_id).order_by(EncuentroMedico.fecha.desc())
+
+# ==================== CONTEO DE SENTENCIAS ====================
+# Cuenta las sentencias SQL ejecutadas dentro de un bloque, en cualquiera de los dos motores.
+# El contador viaja en un ContextVar, así que peticiones concurrentes no se mezclan.
+_contador: ContextVar[Optional[list]] = ContextVar("contador_sentencias", default=None)
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _contar_sentencia(conn, cursor, statement, parameters, context, executemany):
+    contador = _contador.get()
+    if contador is not None:
+        contador[0] += 1
+
+@contextmanager
+def contar_sentencias():
+    contador = [0]
+    token = _contador.set(contador)
+    try:
+        yield contador
+    finally:
+        _contador.reset(token)
+
+@contextmanager
+def asegurar_sentencias(maximo: int):
+    # Falla si el bloque ejecuta más de `maximo` sentencias, p. ej. por una carga perezosa nueva
+    with contar_sentencias() as contador:
+        yield contador
+    if contador[0] > maximo:
+        raise AssertionError(f"Se ejecutaron {contador[0]} sentencias SQL, el máximo es {maximo}")
@@ -0,0 +1,167 @@
+import asyncio
+from datetime import date, datetime
+from typing import List, Optional
+from sqlalchemy import Date, cast, func, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import settings
+from app.database import engine
+from app.models.models import Estadistica, SerieDiaria, Rol, Sede, TipoEncuentroMedico, Usuario
+
+# Contadores del tablero de administración. Los mantienen triggers por sentencia sobre usuarios,
+# encuentros_medicos y observaciones_clinicas (postgres/init.sql), así que leerlos cuesta lo mismo
+# con mil encuentros que con diez millones. La reconciliación periódica recalcula todo desde las
+# tablas base y corrige lo que se haya desviado (TRUNCATE, cargas con los triggers desactivados).
+# Las series de /reportes/series (series_diarias) se mantienen y reconcilian igual.
+
+async def resumen(db: AsyncSession) -> dict:
+    contadores = {}
+    for dimension, clave, total in (await db.execute(select(
+        Estadistica.dimension, Estadistica.clave, func.sum(Estadistica.total)
+    ).group_by(Estadistica.dimension, Estadistica.clave))).all():
+        if total:
+            contadores.setdefault(dimension, {})[clave] = int(total)
+
+    # Catálogos pequeños: traducen las claves a nombres
+    roles = dict((await db.execute(select(Rol.id, Rol.nombre))).all())
+    tipos = dict((await db.execute(select(TipoEncuentroMedico.id, TipoEncuentroMedico.nombre))).all())
+    sedes = (await db.execute(select(Sede.id, Sede.nombre, Sede.activo))).all()
+    nombres_sedes = {s.id: s.nombre for s in sedes}
+
+    def total(dimension: str, clave: int = 0) -> int:
+        return contadores.get(dimension, {}).get(clave, 0)
+
+    def desglose(dimension: str, nombres: dict, campo: str) -> list:
+        return [{campo: nombres[clave], "total": n} for clave, n in contadores.get(dimension, {}).items() if clave in nombres]
+
+    usuarios_activos, usuarios_inactivos = total("usuarios_activo", 1), total("usuarios_activo", 0)
+    return {
+        "usuarios": {
+            "total": usuarios_activos + usuarios_inactivos,
+            "activos": usuarios_activos,
+            "inactivos": usuarios_inactivos,
+            "por_rol": desglose("usuarios_rol", roles, "rol")
+        },
+        "encuentros": {
+            "total": total("encuentros"),
+            "por_tipo": desglose("encuentros_tipo", tipos, "tipo"),
+            "por_sede": desglose("encuentros_sede", nombres_sedes, "sede")
+        },
+        "observaciones": {
+            "total": total("observaciones")
+        },
+        "sedes": {
+            "activas": sum(1 for s in sedes if s.activo)
+        },
+        "fhir": {
+            "pacientes_sincronizados": total("pacientes_fhir"),
+            "medicos_sincronizados": total("medicos_fhir")
+        }
+    }
+
+# ==================== SERIES ====================
+# intervalo -> unidad de date_trunc; los días se leen tal cual
+INTERVALOS = {"dia": None, "semana": "week", "mes": "month"}
+DIMENSIONES = ("sede", "tipo", "medico")
+
+async def series(db: AsyncSession, desde: date, hasta: date, intervalo: str = "dia",
+                 por: List[str] = (), sede_id: Optional[int] = None, tipo_id: Optional[int] = None,
+                 medico_id: Optional[int] = None) -> list:
+    # Agrega series_diarias (una fila por día y combinación sede/tipo/médico con actividad): el costo
+    # depende de los días pedidos y no del número de encuentros, y el rango se lee por la llave primaria.
+    unidad = INTERVALOS[intervalo]
+    periodo = SerieDiaria.dia if unidad is None else cast(func.date_trunc(unidad, SerieDiaria.dia), Date)
+    columnas = [periodo.label("periodo")] + [getattr(SerieDiaria, f"{d}_id") for d in por]
+
+    filtros = [SerieDiaria.dia >= desde, SerieDiaria.dia <= hasta]
+    for columna, valor in ((SerieDiaria.sede_id, sede_id), (SerieDiaria.tipo_id, tipo_id), (SerieDiaria.medico_id, medico_id)):
+        if valor is not None:
+            filtros.append(columna == valor)
+
+    filas = (await db.execute(select(
+        *columnas,
+        func.sum(SerieDiaria.encuentros).label("encuentros"),
+        func.sum(SerieDiaria.observaciones).label("observaciones")
+    ).where(*filtros).group_by(*columnas).order_by(*columnas))).all()
+
+    nombres = {}
+    if "sede" in por:
+        nombres["sede"] = dict((await db.execute(select(Sede.id, Sede.nombre))).all())
+    if "tipo" in por:
+        nombres["tipo"] = dict((await db.execute(select(TipoEncuentroMedico.id, TipoEncuentroMedico.nombre))).all())
+    if "medico" in por:
+        ids = {f.medico_id for f in filas if f.medico_id}
+        nombres["medico"] = {u.id: f"{u.nombres} {u.apellidos}" for u in (await db.execute(
+            select(Usuario.id, Usuario.nombres, Usuario.apellidos).where(Usuario.id.in_(ids))
+        )).all()} if ids else {}
+
+    resultado = []
+    for fila in filas:
+        if not fila.encuentros and not fila.observaciones:
+            continue
+        punto = {"periodo": fila.periodo.isoformat()}
+        for d in por:
+            clave = getattr(fila, f"{d}_id")
+            punto[f"{d}_id"] = clave or None
+            punto[d] = nombres[d].get(clave)
+        punto["encuentros"] = int(fila.encuentros)
+        punto["observaciones"] = int(fila.observaciones)
+        resultado.append(punto)
+    return resultado
+
+# ==================== RECONCILIACIÓN ====================
+def reconciliar() -> Optional[int]:
+    # Devuelve cuántos contadores y baldes de series estaban desviados, o None si otro proceso está
+    # reconciliando. Cada función corre en su propia transacción: ninguna bloquea a los escritores y
+    # los row locks de sus deltas se sueltan apenas termina cada una.
+    with engine.begin() as conexion:
+        desviados = conexion.execute(text("SELECT estadisticas_reconciliar()")).scalar()
+    if desviados is None:
+        return None
+    with engine.begin() as conexion:
+        series = conexion.execute(text("SELECT series_reconciliar()")).scalar()
+    return desviados + (series or 0)
+
+class ReconciliadorEstadisticas:
+    def __init__(self):
+        self.interval = settings.ESTADISTICAS_RECONCILIAR_INTERVAL
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+        self.ultima: Optional[dict] = None
+
+    async def start(self):
+        if self._task is None and self.interval > 0:
+            self._stopping.clear()
+            self._task = asyncio.create_task(self.run())
+            print("[ESTADISTICAS] Reconciliación periódica iniciada")
+
+    async def stop(self):
+        if self._task is not None:
+            self._stopping.set()
+            await self._task
+            self._task = None
+            print("[ESTADISTICAS] Reconciliación periódica detenida")
+
+    async def run(self):
+        # Espera un intervalo antes de la primera pasada: los contadores ya están al día al arrancar
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.interval)
+                break
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.ejecutar()
+            except Exception as e:
+                print(f"[ESTADISTICAS] Error en la reconciliación: {type(e).__name__}: {e}")
+
+    async def ejecutar(self) -> Optional[int]:
+        inicio = datetime.now()
+        desviados = await asyncio.to_thread(reconciliar)
+        if desviados is None:
+            return None
+        self.ultima = {"inicio": inicio.isoformat(), "fin": datetime.now().isoformat(), "desviados": desviados}
+        if desviados:
+            print(f"[ESTADISTICAS] Reconciliación corrigió {desviados} contadores")
+        return desviados
+
+reconciliador_estadisticas = ReconciliadorEstadisticas()
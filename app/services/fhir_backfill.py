@@ -0,0 +1,243 @@
+import asyncio
+import json
+import os
+import time
+from collections import defaultdict
+from typing import Optional
+from sqlalchemy import Integer, and_, cast, exists, func, select
+from app.config import settings
+from app.database import SessionLocal
+from app.models.models import OutboxFHIR, Usuario, Rol, EncuentroMedico, ObservacionClinica, TipoEncuentroMedico
+from app.services.fhir_breaker import HAPINoDisponible
+from app.services.fhir_service import fhir_service
+from app.services.fhir_sync import get_user_data
+
+BACKFILL_TIPOS = ("patient", "practitioner", "encounter")
+
+class FHIRBackfill:
+    # Re-sincroniza las filas que quedaron sin id FHIR. Recorre cada tabla por id (keyset), envía a HAPI
+    # hasta `concurrency` lotes a la vez y guarda el último id confirmado para poder reanudar.
+    def __init__(self, batch_size: Optional[int] = None, concurrency: Optional[int] = None,
+                 checkpoint_path: Optional[str] = None):
+        self.batch_size = batch_size or settings.FHIR_BACKFILL_BATCH_SIZE
+        self.concurrency = concurrency or settings.FHIR_BACKFILL_CONCURRENCY
+        self.checkpoint_path = checkpoint_path or settings.FHIR_BACKFILL_CHECKPOINT
+        self.checkpoint = self._leer_checkpoint()
+        self.personas = {
+            "patient": ("Paciente", "fhir_patient_id", "sync_patient", fhir_service.build_patient, "sync_patients"),
+            "practitioner": ("Medico", "fhir_practitioner_id", "sync_practitioner", fhir_service.build_practitioner, None),
+        }
+
+    # ==================== CHECKPOINT ====================
+    def _leer_checkpoint(self) -> dict:
+        try:
+            with open(self.checkpoint_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _guardar_checkpoint(self):
+        temporal = f"{self.checkpoint_path}.tmp"
+        with open(temporal, "w") as f:
+            json.dump(self.checkpoint, f)
+        os.replace(temporal, self.checkpoint_path)
+
+    def reiniciar(self, tipos: list):
+        for tipo in tipos:
+            self.checkpoint.pop(tipo, None)
+        self._guardar_checkpoint()
+
+    # ==================== CONSULTAS ====================
+    # Cada lote se lee y se actualiza en transacciones cortas, sin bloquear las tablas de la aplicación.
+    # Se omiten las filas con una entrada pendiente en el outbox, individual o dentro de un lote (también
+    # las ya reclamadas por el worker): de esas se encarga él, y reenviarlas duplicaría los Encounter.
+    @staticmethod
+    def _sin_outbox_pendiente(operacion: str, columna_id, operacion_lote: Optional[str] = None):
+        condicion = ~exists().where(and_(
+            OutboxFHIR.operacion == operacion,
+            OutboxFHIR.entidad_id == columna_id,
+            OutboxFHIR.estado == "pendiente"
+        ))
+        if operacion_lote:
+            # Los lotes (importación, ingesta) no llevan entidad_id sino payload["ids"]; NOT IN con una
+            # subconsulta no correlacionada: PostgreSQL la resuelve una vez por consulta, como hash
+            en_lotes = select(cast(func.jsonb_array_elements_text(OutboxFHIR.payload["ids"]), Integer)).where(
+                OutboxFHIR.operacion == operacion_lote,
+                OutboxFHIR.estado == "pendiente"
+            )
+            condicion = and_(condicion, columna_id.notin_(en_lotes))
+        return condicion
+
+    def _cargar_personas(self, tipo: str, desde_id: int) -> list:
+        rol, columna, operacion, _, operacion_lote = self.personas[tipo]
+        with SessionLocal() as db:
+            usuarios = db.query(Usuario).join(Rol, Usuario.rol_id == Rol.id).filter(
+                Rol.nombre == rol,
+                getattr(Usuario, columna) == None,
+                Usuario.id > desde_id,
+                self._sin_outbox_pendiente(operacion, Usuario.id, operacion_lote)
+            ).order_by(Usuario.id).limit(self.batch_size).all()
+            return [{"id": u.id, "data": get_user_data(u)} for u in usuarios]
+
+    def _guardar_personas(self, tipo: str, ids: dict):
+        columna = self.personas[tipo][1]
+        with SessionLocal() as db:
+            for usuario_id, fhir_id in ids.items():
+                # Sólo si sigue vacío: el worker pudo sincronizarlo mientras tanto
+                db.query(Usuario).filter(
+                    Usuario.id == usuario_id,
+                    getattr(Usuario, columna) == None
+                ).update({columna: fhir_id}, synchronize_session=False)
+            db.commit()
+
+    def _cargar_encuentros(self, desde_id: int) -> list:
+        with SessionLocal() as db:
+            filas = db.query(
+                EncuentroMedico, Usuario.fhir_patient_id, TipoEncuentroMedico.codigo_fhir, TipoEncuentroMedico.nombre
+            ).join(Usuario, EncuentroMedico.paciente_id == Usuario.id).outerjoin(
+                TipoEncuentroMedico, EncuentroMedico.tipo_id == TipoEncuentroMedico.id
+            ).filter(
+                EncuentroMedico.fhir_encounter_id == None,
+                EncuentroMedico.id > desde_id,
+                self._sin_outbox_pendiente("sync_encounter", EncuentroMedico.id, "sync_encounters")
+            ).order_by(EncuentroMedico.id).limit(self.batch_size).all()
+
+            observaciones = defaultdict(list)
+            if filas:
+                for obs in db.query(ObservacionClinica).filter(
+                    ObservacionClinica.encuentro_id.in_([f[0].id for f in filas])
+                ).order_by(ObservacionClinica.id):
+                    observaciones[obs.encuentro_id].append(obs)
+
+            return [{
+                "id": encuentro.id,
+                "paciente_fhir_id": paciente_fhir_id,
+                "medico_id": encuentro.medico_id,
+                "encuentro": {
+                    "fecha": encuentro.fecha.isoformat(),
+                    "codigo_fhir": codigo_fhir or "AMB",
+                    "tipo_nombre": tipo_nombre or "Consulta",
+                    "diagnostico": encuentro.diagnostico,
+                    "diagnostico_codigo_icd10": encuentro.diagnostico_codigo_icd10
+                },
+                "observacion_ids": [obs.id for obs in observaciones[encuentro.id]],
+                "observaciones": [{
+                    "fecha": obs.fecha.isoformat(),
+                    "descripcion": obs.descripcion,
+                    "valor": obs.valor,
+                    "unidad": obs.unidad,
+                    "codigo_loinc": obs.codigo_loinc,
+                    "interpretacion": obs.interpretacion
+                } for obs in observaciones[encuentro.id]]
+            } for encuentro, paciente_fhir_id, codigo_fhir, tipo_nombre in filas]
+
+    def _guardar_encuentros(self, resultados: list):
+        with SessionLocal() as db:
+            for item, fhir_ids in resultados:
+                db.query(EncuentroMedico).filter(
+                    EncuentroMedico.id == item["id"],
+                    EncuentroMedico.fhir_encounter_id == None
+                ).update({"fhir_encounter_id": fhir_ids["encounter"]}, synchronize_session=False)
+                for obs_id, fhir_obs_id in zip(item["observacion_ids"], fhir_ids["observations"]):
+                    db.query(ObservacionClinica).filter(ObservacionClinica.id == obs_id).update(
+                        {"fhir_observation_id": fhir_obs_id}, synchronize_session=False
+                    )
+            db.commit()
+
+    # ==================== ENVÍO ====================
+    async def _enviar_personas(self, tipo: str, lote: list) -> dict:
+        build = self.personas[tipo][3]
+        fhir_ids = await fhir_service.create_batch([build(item["data"]) for item in lote])
+        creados = {item["id"]: fhir_id for item, fhir_id in zip(lote, fhir_ids) if fhir_id}
+        await asyncio.to_thread(self._guardar_personas, tipo, creados)
+        return {"ok": len(creados), "fallidos": [item["id"] for item in lote if item["id"] not in creados], "omitidos": 0}
+
+    async def _enviar_encuentros(self, lote: list) -> dict:
+        sincronizables = [item for item in lote if item["paciente_fhir_id"]]
+        omitidos = len(lote) - len(sincronizables)
+        if not sincronizables:
+            return {"ok": 0, "fallidos": [], "omitidos": omitidos}
+
+        resultados = []
+        fhir_ids = await fhir_service.create_encounters_bundle(sincronizables)
+        if fhir_ids:
+            resultados = list(zip(sincronizables, fhir_ids))
+        else:
+            # La transacción del lote es atómica: si falla, se reintenta encuentro por encuentro
+            # para que un solo registro inválido no deje sin sincronizar al resto.
+            for item in sincronizables:
+                try:
+                    ids = await fhir_service.create_encounters_bundle([item])
+                except HAPINoDisponible:
+                    # Los ya creados se guardan; el resto queda como fallido para no duplicarlos al reintentar
+                    break
+                if ids:
+                    resultados.append((item, ids[0]))
+
+        await asyncio.to_thread(self._guardar_encuentros, resultados)
+        sincronizados = {item["id"] for item, _ in resultados}
+        return {
+            "ok": len(resultados),
+            "fallidos": [item["id"] for item in sincronizables if item["id"] not in sincronizados],
+            "omitidos": omitidos
+        }
+
+    async def _enviar(self, tipo: str, lote: list) -> dict:
+        try:
+            while True:
+                try:
+                    if tipo == "encounter":
+                        return await self._enviar_encuentros(lote)
+                    return await self._enviar_personas(tipo, lote)
+                except HAPINoDisponible as e:
+                    # Breaker abierto: se espera a que HAPI se recupere en vez de marcar el lote como fallido
+                    print(f"[FHIR-BACKFILL] {e}")
+                    await asyncio.sleep(max(e.reintentar_en, 1.0))
+        except Exception as e:
+            print(f"[FHIR-BACKFILL] Error enviando lote de {tipo}: {type(e).__name__}: {e}")
+            return {"ok": 0, "fallidos": [item["id"] for item in lote], "omitidos": 0}
+
+    # ==================== EJECUCIÓN ====================
+    async def ejecutar_tipo(self, tipo: str) -> dict:
+        estado = self.checkpoint.setdefault(tipo, {"ultimo_id": 0, "fallidos": []})
+        reporte = {"procesados": 0, "ok": 0, "fallidos": 0, "omitidos": 0}
+        inicio = time.monotonic()
+
+        while True:
+            # Se leen hasta `concurrency` lotes consecutivos y se envían en paralelo; el checkpoint
+            # sólo avanza cuando toda la ronda terminó, así una interrupción nunca se salta filas.
+            lotes, desde_id = [], estado["ultimo_id"]
+            for _ in range(self.concurrency):
+                if tipo == "encounter":
+                    lote = await asyncio.to_thread(self._cargar_encuentros, desde_id)
+                else:
+                    lote = await asyncio.to_thread(self._cargar_personas, tipo, desde_id)
+                if not lote:
+                    break
+                lotes.append(lote)
+                desde_id = lote[-1]["id"]
+            if not lotes:
+                break
+
+            resultados = await asyncio.gather(*(self._enviar(tipo, lote) for lote in lotes))
+            for lote, resultado in zip(lotes, resultados):
+                reporte["procesados"] += len(lote)
+                reporte["ok"] += resultado["ok"]
+                reporte["fallidos"] += len(resultado["fallidos"])
+                reporte["omitidos"] += resultado["omitidos"]
+                estado["fallidos"] = (estado["fallidos"] + resultado["fallidos"])[-1000:]
+
+            estado["ultimo_id"] = desde_id
+            self._guardar_checkpoint()
+
+            segundos = time.monotonic() - inicio
+            print(f"[FHIR-BACKFILL] {tipo}: {reporte['procesados']} procesados, {reporte['ok']} ok, "
+                  f"{reporte['fallidos']} fallidos, {reporte['omitidos']} omitidos "
+                  f"({reporte['procesados'] / segundos:.1f} filas/s) - último id {desde_id}")
+
+        reporte["segundos"] = round(time.monotonic() - inicio, 2)
+        return reporte
+
+    async def ejecutar(self, tipos: list) -> dict:
+        # Primero Patient y Practitioner: los Encounter necesitan el id FHIR del paciente
+        return {tipo: await self.ejecutar_tipo(tipo) for tipo in BACKFILL_TIPOS if tipo in tipos}
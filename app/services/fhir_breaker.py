@@ -0,0 +1,112 @@
+import time
+from typing import Optional
+
+class HAPINoDisponible(Exception):
+    """El circuit breaker está abierto: la llamada a HAPI se rechaza sin intentarla."""
+
+    def __init__(self, reintentar_en: float):
+        super().__init__(f"HAPI FHIR no disponible, reintentar en {reintentar_en:.0f}s")
+        self.reintentar_en = reintentar_en
+
+class CircuitBreaker:
+    # cerrado -> abierto tras `failure_threshold` fallos consecutivos (errores de red, deadlines, 5xx
+    # o respuestas más lentas que `slow_call_seconds`). Abierto rechaza todo durante `open_seconds`;
+    # luego pasa a semiabierto y deja pasar `half_open_max_calls` sondas: si responden bien se cierra,
+    # si fallan vuelve a abrirse. Una sonda cancelada devuelve su cupo con liberar(); si aun así las
+    # sondas llevan más de `open_seconds` sin respuesta, el breaker vuelve a abrirse en vez de quedar
+    # semiabierto y sin cupos para siempre.
+    def __init__(self, failure_threshold: int, slow_call_seconds: float, open_seconds: float, half_open_max_calls: int = 1):
+        self.failure_threshold = failure_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+        self.estado = "cerrado"
+        self.fallos_consecutivos = 0
+        self.abierto_hasta = 0.0
+        self.sondas_en_curso = 0
+        self.ultima_sonda = 0.0
+        self.ultimo_error: Optional[str] = None
+        self.aperturas = 0
+        self.rechazadas = 0
+        self.llamadas_lentas = 0
+
+    @property
+    def reintentar_en(self) -> float:
+        return max(0.0, self.abierto_hasta - time.monotonic())
+
+    @property
+    def disponible(self) -> bool:
+        # Sin efectos: indica si una llamada ahora mismo tendría oportunidad de pasar
+        if self.estado == "abierto":
+            return self.reintentar_en == 0
+        if self.estado == "semiabierto":
+            return self.sondas_en_curso < self.half_open_max_calls or self._sondas_vencidas()
+        return True
+
+    def _sondas_vencidas(self) -> bool:
+        return time.monotonic() - self.ultima_sonda >= self.open_seconds
+
+    def permitir(self):
+        if self.estado == "abierto":
+            if self.reintentar_en > 0:
+                self.rechazadas += 1
+                raise HAPINoDisponible(self.reintentar_en)
+            self.estado = "semiabierto"
+            self.sondas_en_curso = 0
+            print("[FHIR] Circuit breaker semiabierto, probando HAPI")
+
+        if self.estado == "semiabierto":
+            if self.sondas_en_curso >= self.half_open_max_calls and self._sondas_vencidas():
+                self.ultimo_error = f"Sondas sin respuesta tras {self.open_seconds:.0f}s"
+                self._abrir()
+                self.rechazadas += 1
+                raise HAPINoDisponible(self.reintentar_en)
+            if self.sondas_en_curso >= self.half_open_max_calls:
+                self.rechazadas += 1
+                raise HAPINoDisponible(self.open_seconds)
+            self.sondas_en_curso += 1
+            self.ultima_sonda = time.monotonic()
+
+    def liberar(self):
+        # La llamada terminó sin decir nada de HAPI (cancelada): si era una sonda, su cupo queda libre
+        if self.estado == "semiabierto":
+            self.sondas_en_curso = max(0, self.sondas_en_curso - 1)
+
+    def registrar_exito(self, duracion: float):
+        if duracion >= self.slow_call_seconds:
+            self.llamadas_lentas += 1
+            self.registrar_fallo(f"Respuesta lenta: {duracion:.2f}s")
+            return
+
+        if self.estado == "semiabierto":
+            self.sondas_en_curso = max(0, self.sondas_en_curso - 1)
+            self.estado = "cerrado"
+            print("[FHIR] Circuit breaker cerrado, HAPI respondió")
+        self.fallos_consecutivos = 0
+
+    def registrar_fallo(self, motivo: str):
+        self.fallos_consecutivos += 1
+        self.ultimo_error = motivo
+        if self.estado == "semiabierto" or (self.estado == "cerrado" and self.fallos_consecutivos >= self.failure_threshold):
+            self._abrir()
+
+    def _abrir(self):
+        self.estado = "abierto"
+        self.abierto_hasta = time.monotonic() + self.open_seconds
+        self.sondas_en_curso = 0
+        self.aperturas += 1
+        print(f"[FHIR] Circuit breaker abierto tras {self.fallos_consecutivos} fallos: {self.ultimo_error}")
+
+    def stats(self) -> dict:
+        return {
+            "estado": self.estado,
+            "fallos_consecutivos": self.fallos_consecutivos,
+            "reintentar_en_segundos": round(self.reintentar_en, 1) if self.estado == "abierto" else None,
+            "ultimo_error": self.ultimo_error,
+            "aperturas": self.aperturas,
+            "rechazadas": self.rechazadas,
+            "llamadas_lentas": self.llamadas_lentas,
+            "failure_threshold": self.failure_threshold,
+            "slow_call_seconds": self.slow_call_seconds,
+            "open_seconds": self.open_seconds
+        }
@@ -0,0 +1,71 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Optional, Tuple
+
+@dataclass
+class CacheEntry:
+    value: Any
+    etag: Optional[str]
+    stored_at: float
+    ttl: float
+
+    @property
+    def fresh(self) -> bool:
+        return time.monotonic() - self.stored_at < self.ttl
+
+class FHIRCache:
+    # LRU acotado por número de entradas. Una entrada vencida no se descarta de inmediato:
+    # se conserva su ETag para revalidar contra HAPI con If-None-Match.
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Tuple[str, str], CacheEntry]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.stale = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, resource_type: str, resource_id: str) -> Optional[CacheEntry]:
+        key = (resource_type, resource_id)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, resource_type: str, resource_id: str, value: Any, etag: Optional[str] = None, ttl: Optional[float] = None):
+        key = (resource_type, resource_id)
+        self._entries[key] = CacheEntry(value, etag, time.monotonic(), self.ttl if ttl is None else ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def touch(self, resource_type: str, resource_id: str):
+        entry = self._entries.get((resource_type, resource_id))
+        if entry is not None:
+            entry.stored_at = time.monotonic()
+
+    def invalidate(self, resource_type: str, resource_id: str):
+        if self._entries.pop((resource_type, resource_id), None) is not None:
+            self.invalidations += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        consultas = self.hits + self.misses + self.revalidations
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidations": self.revalidations,
+            "stale": self.stale,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_ratio": round((self.hits + self.revalidations) / consultas, 4) if consultas else None
+        }
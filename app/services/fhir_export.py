@@ -0,0 +1,177 @@
+import asyncio
+import json
+import os
+import shutil
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Iterator, Optional
+from app.config import settings
+from app.database import SessionLocal
+from app.services.fhir_local import fhir_local, LOCAL_TYPES
+
+EXPORT_TYPES = LOCAL_TYPES
+# Marca de cancelación dentro del directorio del job: el DELETE puede llegar a otro worker de uvicorn
+CANCELADO = "cancelado"
+
+class ExportCancelado(Exception):
+    """El job se eliminó con DELETE mientras se estaba generando."""
+
+class FHIRExporter:
+    # Bulk Data $export generado desde PostgreSQL. Cada job vive en su propio directorio con un
+    # estado.json y un archivo NDJSON por tipo, así cualquier worker de uvicorn puede responder el estado
+    # o cancelarlo.
+    def __init__(self):
+        self.base_dir = settings.FHIR_EXPORT_DIR
+        self.chunk_size = settings.FHIR_EXPORT_CHUNK_SIZE
+        self._tasks: dict = {}
+
+    # ==================== JOBS ====================
+    def _job_dir(self, job_id: str) -> str:
+        return os.path.join(self.base_dir, job_id)
+
+    def _guardar_estado(self, job_id: str, estado: dict):
+        ruta = os.path.join(self._job_dir(job_id), "estado.json")
+        temporal = f"{ruta}.tmp"
+        with open(temporal, "w") as f:
+            json.dump(estado, f)
+        os.replace(temporal, ruta)
+
+    def _cancelado(self, job_id: str) -> bool:
+        return os.path.exists(os.path.join(self._job_dir(job_id), CANCELADO))
+
+    def _leer_estado(self, job_id: str) -> Optional[dict]:
+        try:
+            with open(os.path.join(self._job_dir(job_id), "estado.json")) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def estado(self, job_id: str) -> Optional[dict]:
+        # Un job cancelado deja de existir para la API aunque su directorio siga ahí un momento
+        if not job_id.isalnum() or self._cancelado(job_id):
+            return None
+        return self._leer_estado(job_id)
+
+    def archivo(self, job_id: str, nombre: str) -> Optional[str]:
+        estado = self.estado(job_id)
+        if not estado or estado["estado"] != "completado":
+            return None
+        if nombre not in {f"{tipo}.ndjson" for tipo in estado["tipos"]}:
+            return None
+        return os.path.join(self._job_dir(job_id), nombre)
+
+    def iniciar(self, tipos: list, since: Optional[datetime], request_url: str) -> str:
+        self._purgar_vencidos()
+        job_id = uuid.uuid4().hex
+        os.makedirs(self._job_dir(job_id))
+
+        self._guardar_estado(job_id, {
+            "estado": "en_progreso",
+            "transactionTime": datetime.now().astimezone().isoformat(),
+            "request": request_url,
+            "tipos": tipos,
+            "since": since.isoformat() if since else None,
+            "progreso": {tipo: 0 for tipo in tipos},
+            "output": [],
+            "error": None
+        })
+
+        self._tasks[job_id] = asyncio.create_task(self._ejecutar(job_id, tipos, since))
+        return job_id
+
+    def eliminar(self, job_id: str) -> bool:
+        estado = self.estado(job_id)
+        if estado is None:
+            return False
+        if estado["estado"] == "en_progreso":
+            # Los hilos del worker dueño del job ven la marca en el siguiente bloque y ese worker
+            # borra el directorio al terminar; aquí no se toca mientras siga en progreso
+            open(os.path.join(self._job_dir(job_id), CANCELADO), "w").close()
+            if (self._leer_estado(job_id) or {}).get("estado") == "en_progreso":
+                return True
+        shutil.rmtree(self._job_dir(job_id), ignore_errors=True)
+        return True
+
+    def _purgar_vencidos(self):
+        if not os.path.isdir(self.base_dir):
+            os.makedirs(self.base_dir, exist_ok=True)
+            return
+        limite = datetime.now() - timedelta(hours=settings.FHIR_EXPORT_RETENTION_HOURS)
+        for job_id in os.listdir(self.base_dir):
+            ruta = self._job_dir(job_id)
+            if job_id not in self._tasks and datetime.fromtimestamp(os.path.getmtime(ruta)) < limite:
+                shutil.rmtree(ruta, ignore_errors=True)
+
+    async def _ejecutar(self, job_id: str, tipos: list, since: Optional[datetime]):
+        progreso = {tipo: 0 for tipo in tipos}
+        bloqueo = threading.Lock()
+
+        def avanzar(tipo: str, total: int):
+            with bloqueo:
+                progreso[tipo] = total
+                estado = self._leer_estado(job_id) or {}
+                estado["progreso"] = dict(progreso)
+                self._guardar_estado(job_id, estado)
+
+        # Un hilo y una conexión por tipo de recurso, cada uno con su cursor del lado del servidor.
+        # Se espera a todos los hilos antes de tocar el directorio del job.
+        resultados = await asyncio.gather(*(
+            asyncio.to_thread(self._exportar_tipo, job_id, tipo, since, avanzar) for tipo in tipos
+        ), return_exceptions=True)
+        errores = [r for r in resultados if isinstance(r, Exception) and not isinstance(r, ExportCancelado)]
+
+        try:
+            if self._cancelado(job_id):
+                shutil.rmtree(self._job_dir(job_id), ignore_errors=True)
+                print(f"[FHIR-EXPORT] Job {job_id} cancelado")
+            elif errores:
+                estado = self._leer_estado(job_id) or {}
+                estado.update({"estado": "error", "error": f"{type(errores[0]).__name__}: {errores[0]}"})
+                self._guardar_estado(job_id, estado)
+                print(f"[FHIR-EXPORT] Job {job_id} falló: {errores[0]}")
+            else:
+                conteos = dict(zip(tipos, resultados))
+                estado = self._leer_estado(job_id) or {}
+                estado.update({
+                    "estado": "completado",
+                    "progreso": conteos,
+                    "output": [{"type": tipo, "count": total} for tipo, total in conteos.items()]
+                })
+                self._guardar_estado(job_id, estado)
+                print(f"[FHIR-EXPORT] Job {job_id} completado: {conteos}")
+        finally:
+            self._tasks.pop(job_id, None)
+
+    def _exportar_tipo(self, job_id: str, tipo: str, since: Optional[datetime],
+                       avanzar: Callable[[str, int], None]) -> int:
+        total = 0
+        ruta = os.path.join(self._job_dir(job_id), f"{tipo}.ndjson")
+        with SessionLocal() as db, open(ruta, "w", encoding="utf-8") as f:
+            for resource in self._recursos(db, tipo, since):
+                f.write(json.dumps(resource, ensure_ascii=False, separators=(",", ":")))
+                f.write("\n")
+                total += 1
+                if total % self.chunk_size == 0:
+                    if self._cancelado(job_id):
+                        raise ExportCancelado()
+                    avanzar(tipo, total)
+        if self._cancelado(job_id):
+            raise ExportCancelado()
+        avanzar(tipo, total)
+        return total
+
+    # ==================== CONSULTAS ====================
+    # yield_per abre en psycopg2 un cursor con nombre: las filas llegan por bloques de chunk_size
+    # y la memoria no crece con el tamaño de la tabla.
+    def _recursos(self, db, tipo: str, since: Optional[datetime]) -> Iterator[dict]:
+        columnas = fhir_local.columnas[tipo]
+        query = fhir_local.consulta(tipo)
+        if since:
+            query = query.where(columnas["lastUpdated"] >= since)
+
+        query = query.order_by(columnas["id"]).execution_options(yield_per=self.chunk_size)
+        for fila in db.execute(query):
+            yield fhir_local.resource(tipo, fila)
+
+fhir_exporter = FHIRExporter()
@@ -0,0 +1,286 @@
+import asyncio
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+from sqlalchemy import text
+from app.config import settings
+from app.database import SessionLocal, engine
+from app.models.models import MarcaAguaFHIR, Usuario, Rol, EncuentroMedico, ObservacionClinica, TipoEncuentroMedico
+from app.services.fhir_service import fhir_service
+from app.services.mediciones import parsear
+
+INBOUND_TYPES = ("Patient", "Practitioner", "Encounter", "Observation")
+# Clave del advisory lock de PostgreSQL: un solo proceso hace el ciclo aunque haya varios workers
+INBOUND_LOCK_KEY = 740011
+
+def fecha_local(valor: Optional[str]) -> Optional[datetime]:
+    # Instantes FHIR -> TIMESTAMP sin zona en hora local del servidor, como el resto de columnas
+    if not valor:
+        return None
+    try:
+        fecha = datetime.fromisoformat(valor.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return fecha.astimezone().replace(tzinfo=None) if fecha.tzinfo else fecha
+
+class FHIRInboundSync:
+    # Trae a PostgreSQL los cambios hechos directamente en HAPI. Por cada tipo recorre una búsqueda
+    # _lastUpdated=ge<marca de agua> ordenada por _lastUpdated, y aplica cada página en una transacción
+    # que también avanza la marca: cada ciclo cuesta lo que cambió desde el anterior.
+    def __init__(self):
+        self.interval = settings.FHIR_INBOUND_INTERVAL
+        self.page_size = settings.FHIR_INBOUND_PAGE_SIZE
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+        self.ultimo_ciclo: Optional[dict] = None
+        self.aplicadores = {
+            "Patient": lambda db, page: self._aplicar_personas(db, page, "Paciente", "fhir_patient_id", fhir_service.parse_patient),
+            "Practitioner": lambda db, page: self._aplicar_personas(db, page, "Medico", "fhir_practitioner_id", fhir_service.parse_practitioner),
+            "Encounter": self._aplicar_encuentros,
+            "Observation": self._aplicar_observaciones,
+        }
+
+    # ==================== CICLO ====================
+    async def start(self):
+        if self._task is None:
+            self._stopping.clear()
+            self._task = asyncio.create_task(self.run())
+            print("[FHIR-INBOUND] Sincronización entrante iniciada")
+
+    async def stop(self):
+        if self._task is not None:
+            self._stopping.set()
+            await self._task
+            self._task = None
+            print("[FHIR-INBOUND] Sincronización entrante detenida")
+
+    async def run(self):
+        while not self._stopping.is_set():
+            if fhir_service.disponible:
+                try:
+                    await self.ciclo()
+                except Exception as e:
+                    print(f"[FHIR-INBOUND] Error en el ciclo: {type(e).__name__}: {e}")
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def ciclo(self) -> Optional[dict]:
+        conexion = await asyncio.to_thread(self._tomar_lock)
+        if conexion is None:
+            return None
+        try:
+            inicio = datetime.now()
+            # Primero Patient/Practitioner: los Encounter nuevos se vinculan por su id FHIR
+            reporte = {tipo: await self.sincronizar_tipo(tipo) for tipo in INBOUND_TYPES}
+            self.ultimo_ciclo = {"inicio": inicio.isoformat(), "fin": datetime.now().isoformat(), "tipos": reporte}
+            return reporte
+        finally:
+            await asyncio.to_thread(self._soltar_lock, conexion)
+
+    def _tomar_lock(self):
+        conexion = engine.connect()
+        if conexion.execute(text("SELECT pg_try_advisory_lock(:k)"), {"k": INBOUND_LOCK_KEY}).scalar():
+            # El lock es de sesión: sobrevive al commit y no deja la conexión con una transacción abierta
+            conexion.commit()
+            return conexion
+        conexion.close()
+        return None
+
+    def _soltar_lock(self, conexion):
+        try:
+            conexion.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": INBOUND_LOCK_KEY})
+            conexion.commit()
+        finally:
+            conexion.close()
+
+    async def sincronizar_tipo(self, tipo: str) -> dict:
+        marca = await asyncio.to_thread(self._leer_marca, tipo)
+        # Se deja fuera lo modificado en los últimos segundos: transacciones de HAPI aún en curso
+        # podrían confirmarse con un lastUpdated anterior a la marca y no verse nunca.
+        hasta = datetime.now(timezone.utc) - timedelta(seconds=settings.FHIR_INBOUND_LAG_SECONDS)
+        filtros = [f"lt{hasta.isoformat(timespec='seconds')}"]
+        if marca:
+            # ge y no gt: varios recursos pueden compartir el mismo instante; reaplicarlos es idempotente
+            filtros.insert(0, f"ge{marca}")
+        params = {"_lastUpdated": filtros, "_sort": "_lastUpdated", "_count": self.page_size}
+
+        reporte = {"recibidos": 0, "actualizados": 0, "creados": 0, "omitidos": 0}
+        async for page in fhir_service.search_pages(tipo, params):
+            if not page:
+                continue
+            resultado = await asyncio.to_thread(self._aplicar_pagina, tipo, page)
+            for clave, valor in resultado.items():
+                reporte[clave] += valor
+        if reporte["recibidos"]:
+            print(f"[FHIR-INBOUND] {tipo}: {reporte}")
+        return reporte
+
+    # ==================== PÁGINAS ====================
+    def _leer_marca(self, tipo: str) -> Optional[str]:
+        with SessionLocal() as db:
+            marca = db.query(MarcaAguaFHIR).filter(MarcaAguaFHIR.tipo_recurso == tipo).first()
+            return marca.ultima_actualizacion if marca else None
+
+    def _aplicar_pagina(self, tipo: str, page: list) -> dict:
+        with SessionLocal() as db:
+            resultado = self.aplicadores[tipo](db, page)
+            # La marca avanza en la misma transacción que los cambios de la página
+            instantes = [r.get("meta", {}).get("lastUpdated") for r in page]
+            instantes = [i for i in instantes if fecha_local(i)]
+            marca = db.query(MarcaAguaFHIR).filter(MarcaAguaFHIR.tipo_recurso == tipo).first()
+            if marca is None:
+                marca = MarcaAguaFHIR(tipo_recurso=tipo, recursos_procesados=0)
+                db.add(marca)
+            if instantes:
+                ultimo = max(instantes, key=fecha_local)
+                if not marca.ultima_actualizacion or fecha_local(ultimo) > fecha_local(marca.ultima_actualizacion):
+                    marca.ultima_actualizacion = ultimo
+            marca.recursos_procesados = (marca.recursos_procesados or 0) + len(page)
+            db.commit()
+        resultado["recibidos"] = len(page)
+        return resultado
+
+    @staticmethod
+    def _asignar(fila, cambios: dict) -> bool:
+        cambio = False
+        for campo, valor in cambios.items():
+            if getattr(fila, campo) != valor:
+                setattr(fila, campo, valor)
+                cambio = True
+        return cambio
+
+    def _aplicar_personas(self, db, page: list, rol: str, columna: str, parse) -> dict:
+        # Sólo se actualizan usuarios que ya existen aquí: un Patient creado en HAPI no trae credenciales.
+        # El número de documento es la clave de negocio local y no se sobrescribe desde HAPI.
+        resultado = {"actualizados": 0, "creados": 0, "omitidos": 0}
+        columna_fhir = getattr(Usuario, columna)
+        vinculados = {getattr(u, columna): u for u in db.query(Usuario).filter(columna_fhir.in_([r["id"] for r in page]))}
+
+        datos = {r["id"]: parse(r) for r in page}
+        documentos = [d["numero_documento"] for fhir_id, d in datos.items() if fhir_id not in vinculados and d.get("numero_documento")]
+        por_documento = {}
+        if documentos:
+            por_documento = {u.numero_documento: u for u in db.query(Usuario).join(Rol, Usuario.rol_id == Rol.id).filter(
+                Rol.nombre == rol, Usuario.numero_documento.in_(documentos), columna_fhir == None
+            )}
+
+        for fhir_id, usuario_data in datos.items():
+            usuario = vinculados.get(fhir_id) or por_documento.get(usuario_data.get("numero_documento"))
+            if usuario is None:
+                resultado["omitidos"] += 1
+                continue
+            cambios = {k: v for k, v in usuario_data.items() if k != "numero_documento"}
+            if "fecha_nacimiento" in cambios:
+                cambios["fecha_nacimiento"] = date.fromisoformat(cambios["fecha_nacimiento"][:10])
+            cambios[columna] = fhir_id
+            if self._asignar(usuario, cambios):
+                resultado["actualizados"] += 1
+        return resultado
+
+    def _aplicar_encuentros(self, db, page: list) -> dict:
+        resultado = {"actualizados": 0, "creados": 0, "omitidos": 0}
+        datos = {r["id"]: (fhir_service.parse_encounter(r), fhir_service.es_propio(r)) for r in page}
+        existentes = {e.fhir_encounter_id: e for e in db.query(EncuentroMedico).filter(
+            EncuentroMedico.fhir_encounter_id.in_(list(datos))
+        )}
+        referencias = [d["paciente_fhir_id"] for d, _ in datos.values() if d["paciente_fhir_id"]]
+        medicos_ref = [d["medico_fhir_id"] for d, _ in datos.values() if d["medico_fhir_id"]]
+        pacientes = dict(db.query(Usuario.fhir_patient_id, Usuario.id).filter(Usuario.fhir_patient_id.in_(referencias))) if referencias else {}
+        medicos = dict(db.query(Usuario.fhir_practitioner_id, Usuario.id).filter(Usuario.fhir_practitioner_id.in_(medicos_ref))) if medicos_ref else {}
+        tipos = dict(db.query(TipoEncuentroMedico.codigo_fhir, TipoEncuentroMedico.id))
+
+        for fhir_id, (encuentro, propio) in datos.items():
+            cambios = {
+                "diagnostico": encuentro["diagnostico"],
+                "diagnostico_codigo_icd10": encuentro["diagnostico_codigo_icd10"]
+            }
+            if fecha_local(encuentro["fecha"]):
+                cambios["fecha"] = fecha_local(encuentro["fecha"])
+            if encuentro["estado"]:
+                cambios["estado"] = encuentro["estado"]
+            if encuentro["codigo_fhir"] in tipos:
+                cambios["tipo_id"] = tipos[encuentro["codigo_fhir"]]
+
+            fila = existentes.get(fhir_id)
+            if fila is not None:
+                if self._asignar(fila, cambios):
+                    resultado["actualizados"] += 1
+                continue
+
+            # Los Encounter propios sin fila vinculada los está guardando el worker del outbox
+            paciente_id = pacientes.get(encuentro["paciente_fhir_id"])
+            if propio or paciente_id is None:
+                resultado["omitidos"] += 1
+                continue
+            cambios.setdefault("fecha", datetime.now())
+            db.add(EncuentroMedico(
+                paciente_id=paciente_id,
+                medico_id=medicos.get(encuentro["medico_fhir_id"]),
+                fhir_encounter_id=fhir_id,
+                **cambios
+            ))
+            resultado["creados"] += 1
+        return resultado
+
+    def _aplicar_observaciones(self, db, page: list) -> dict:
+        resultado = {"actualizados": 0, "creados": 0, "omitidos": 0}
+        datos = {r["id"]: (fhir_service.parse_observation(r), fhir_service.es_propio(r)) for r in page}
+        existentes = {o.fhir_observation_id: o for o in db.query(ObservacionClinica).filter(
+            ObservacionClinica.fhir_observation_id.in_(list(datos))
+        )}
+        referencias = [d["encounter_fhir_id"] for d, _ in datos.values() if d["encounter_fhir_id"]]
+        encuentros = {}
+        if referencias:
+            encuentros = {e.fhir_encounter_id: e for e in db.query(
+                EncuentroMedico.id, EncuentroMedico.sede_id, EncuentroMedico.fhir_encounter_id
+            ).filter(EncuentroMedico.fhir_encounter_id.in_(referencias))}
+
+        for fhir_id, (observacion, propio) in datos.items():
+            cambios = {
+                campo: observacion[campo]
+                for campo in ("valor", "unidad", "codigo_loinc", "interpretacion")
+            }
+            if observacion["descripcion"]:
+                cambios["descripcion"] = observacion["descripcion"]
+            cambios.update(parsear(
+                observacion["valor"], observacion["unidad"], observacion["codigo_loinc"], observacion["descripcion"]
+            ).columnas())
+            if fecha_local(observacion["fecha"]):
+                cambios["fecha"] = fecha_local(observacion["fecha"])
+
+            fila = existentes.get(fhir_id)
+            if fila is not None:
+                if self._asignar(fila, cambios):
+                    resultado["actualizados"] += 1
+                continue
+
+            encuentro = encuentros.get(observacion["encounter_fhir_id"])
+            if propio or encuentro is None or not cambios.get("descripcion"):
+                resultado["omitidos"] += 1
+                continue
+            cambios.setdefault("fecha", datetime.now())
+            db.add(ObservacionClinica(
+                encuentro_id=encuentro.id,
+                sede_id=encuentro.sede_id,
+                fhir_observation_id=fhir_id,
+                **cambios
+            ))
+            resultado["creados"] += 1
+        return resultado
+
+    # ==================== ESTADO ====================
+    def stats(self) -> dict:
+        with SessionLocal() as db:
+            marcas = db.query(MarcaAguaFHIR).order_by(MarcaAguaFHIR.tipo_recurso).all()
+            return {
+                "activo": self._task is not None,
+                "ultimo_ciclo": self.ultimo_ciclo,
+                "marcas": [{
+                    "tipo": m.tipo_recurso,
+                    "ultima_actualizacion": m.ultima_actualizacion,
+                    "recursos_procesados": m.recursos_procesados
+                } for m in marcas]
+            }
+
+fhir_inbound_sync = FHIRInboundSync()
@@ -0,0 +1,97 @@
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import Select, select
+from app.models.models import Usuario, Rol, EncuentroMedico, ObservacionClinica, TipoEncuentroMedico
+from app.services.fhir_service import fhir_service
+
+LOCAL_TYPES = ("Patient", "Practitioner", "Encounter", "Observation")
+
+class FHIRLocal:
+    # Recursos FHIR construidos directamente desde PostgreSQL con los mismos builders de FHIRService.
+    # Los ids son los de nuestras tablas (Patient/15 es usuarios.id = 15), así las referencias entre
+    # recursos se resuelven sin pasar por HAPI. Lo usan el $export y la fachada /fhir/R4.
+    def __init__(self):
+        self.roles = {"Patient": "Paciente", "Practitioner": "Medico"}
+        # Columnas sobre las que se filtra y se pagina, por tipo de recurso
+        self.columnas = {
+            "Patient": {"id": Usuario.id, "lastUpdated": Usuario.updated_at, "identifier": Usuario.numero_documento},
+            "Practitioner": {"id": Usuario.id, "lastUpdated": Usuario.updated_at, "identifier": Usuario.numero_documento},
+            "Encounter": {
+                "id": EncuentroMedico.id,
+                "lastUpdated": EncuentroMedico.created_at,
+                "date": EncuentroMedico.fecha,
+                "subject": EncuentroMedico.paciente_id,
+                "practitioner": EncuentroMedico.medico_id,
+                "reason-code": EncuentroMedico.diagnostico_codigo_icd10
+            },
+            "Observation": {
+                "id": ObservacionClinica.id,
+                "lastUpdated": ObservacionClinica.created_at,
+                "date": ObservacionClinica.fecha,
+                "subject": EncuentroMedico.paciente_id,
+                "encounter": ObservacionClinica.encuentro_id,
+                "code": ObservacionClinica.codigo_loinc
+            },
+        }
+
+    # ==================== CONSULTAS ====================
+    # Sólo se proyectan las columnas que usan los builders: sin objetos ORM ni cargas perezosas.
+    # Devuelve un Select sin ejecutar: la fachada lo corre en la sesión asíncrona y el $export
+    # en una síncrona con yield_per.
+    def consulta(self, resource_type: str) -> Select:
+        if resource_type in self.roles:
+            return select(
+                Usuario.id, Usuario.numero_documento, Usuario.nombres, Usuario.apellidos, Usuario.genero,
+                Usuario.fecha_nacimiento, Usuario.telefono, Usuario.email, Usuario.updated_at
+            ).join(Rol, Usuario.rol_id == Rol.id).where(Rol.nombre == self.roles[resource_type])
+
+        if resource_type == "Encounter":
+            return select(
+                EncuentroMedico.id, EncuentroMedico.fecha, EncuentroMedico.paciente_id, EncuentroMedico.medico_id,
+                EncuentroMedico.diagnostico, EncuentroMedico.diagnostico_codigo_icd10, EncuentroMedico.created_at,
+                TipoEncuentroMedico.codigo_fhir, TipoEncuentroMedico.nombre.label("tipo_nombre")
+            ).outerjoin(TipoEncuentroMedico, EncuentroMedico.tipo_id == TipoEncuentroMedico.id)
+
+        return select(
+            ObservacionClinica.id, ObservacionClinica.fecha, ObservacionClinica.encuentro_id,
+            ObservacionClinica.descripcion, ObservacionClinica.valor, ObservacionClinica.unidad,
+            ObservacionClinica.codigo_loinc, ObservacionClinica.interpretacion, ObservacionClinica.created_at,
+            EncuentroMedico.paciente_id
+        ).join(EncuentroMedico, ObservacionClinica.encuentro_id == EncuentroMedico.id)
+
+    # ==================== RECURSOS ====================
+    @staticmethod
+    def _meta(fecha: Optional[datetime]) -> dict:
+        return {"lastUpdated": fecha.astimezone().isoformat()} if fecha else {}
+
+    def resource(self, resource_type: str, fila) -> dict:
+        if resource_type == "Patient":
+            resource = fhir_service.build_patient(fila._asdict(), str(fila.id))
+            resource["meta"] = self._meta(fila.updated_at)
+        elif resource_type == "Practitioner":
+            resource = fhir_service.build_practitioner(fila._asdict(), str(fila.id))
+            resource["meta"] = self._meta(fila.updated_at)
+        elif resource_type == "Encounter":
+            encuentro = {
+                "fecha": fila.fecha.isoformat(),
+                "codigo_fhir": fila.codigo_fhir or "AMB",
+                "tipo_nombre": fila.tipo_nombre or "Consulta",
+                "diagnostico": fila.diagnostico,
+                "diagnostico_codigo_icd10": fila.diagnostico_codigo_icd10
+            }
+            resource = fhir_service.build_encounter(encuentro, f"Patient/{fila.paciente_id}", fila.medico_id)
+            resource["id"] = str(fila.id)
+            resource["meta"] = self._meta(fila.created_at)
+            if fila.medico_id:
+                resource["participant"][0]["individual"]["reference"] = f"Practitioner/{fila.medico_id}"
+        else:
+            observacion = fila._asdict()
+            observacion["fecha"] = fila.fecha.isoformat()
+            resource = fhir_service.build_observation(
+                observacion, f"Patient/{fila.paciente_id}", f"Encounter/{fila.encuentro_id}"
+            )
+            resource["id"] = str(fila.id)
+            resource["meta"] = self._meta(fila.created_at)
+        return resource
+
+fhir_local = FHIRLocal()
@@ -1,46 +1,164 @@
+import asyncio
+import json
+import time
+import uuid
 import httpx
-from typing import Optional
+from typing import AsyncIterator, Optional
+from urllib.parse import urlencode
 from app.config import settings
+from app.services.fhir_breaker import CircuitBreaker, HAPINoDisponible
+from app.services.fhir_cache import FHIRCache
+from app.services.mediciones import (
+    parsear, UCUM_SYSTEM, LOINC_SYSTEM, LOINC_PRESION_ARTERIAL, LOINC_SISTOLICA, LOINC_DIASTOLICA
+)
+
+try:
+    import h2  # noqa: F401
+    HTTP2_DISPONIBLE = True
+except ImportError:
+    HTTP2_DISPONIBLE = False
+
+PACIENTES_SYSTEM = "http://clinica.local/pacientes"
+MEDICOS_SYSTEM = "http://clinica.local/medicos"
+# Marca los Encounter/Observation que creamos nosotros, para distinguirlos de los que llegan de otros sistemas
+ORIGEN_TAG = {"system": "http://clinica.local/origen", "code": "clinica"}
 
 class FHIRService:
     def __init__(self):
         self.base_url = settings.FHIR_SERVER_URL
-    
-    # ==================== PATIENT ====================
-    async def create_patient(self, usuario: dict) -> Optional[str]:
-        patient = {
-            "resourceType": "Patient",
-            "identifier": [{
-                "system": "http://clinica.local/pacientes",
-                "value": usuario["numero_documento"]
-            }],
-            "name": [{
-                "use": "official",
-                "family": usuario["apellidos"],
-                "given": [usuario["nombres"]]
-            }],
-            "gender": "male" if usuario["genero"] == "Masculino" else "female",
-            "birthDate": str(usuario["fecha_nacimiento"])
+        self._client: Optional[httpx.AsyncClient] = None
+        # Timeouts por tipo de operación
+        self.timeouts = {
+            "read": httpx.Timeout(settings.FHIR_TIMEOUT_READ, connect=settings.FHIR_TIMEOUT_CONNECT),
+            "write": httpx.Timeout(settings.FHIR_TIMEOUT_WRITE, connect=settings.FHIR_TIMEOUT_CONNECT),
+            "search": httpx.Timeout(settings.FHIR_TIMEOUT_SEARCH, connect=settings.FHIR_TIMEOUT_CONNECT),
         }
+        # Plazo total por operación (incluye la espera por una conexión libre del pool)
+        self.deadlines = {
+            "read": settings.FHIR_DEADLINE_READ,
+            "write": settings.FHIR_DEADLINE_WRITE,
+            "search": settings.FHIR_DEADLINE_SEARCH,
+        }
+        self.cache = FHIRCache(settings.FHIR_CACHE_MAX_ENTRIES, settings.FHIR_CACHE_TTL)
+        self.breaker = CircuitBreaker(
+            settings.FHIR_BREAKER_FAILURE_THRESHOLD,
+            settings.FHIR_BREAKER_SLOW_CALL_SECONDS,
+            settings.FHIR_BREAKER_OPEN_SECONDS,
+            settings.FHIR_BREAKER_HALF_OPEN_CALLS
+        )
+    
+    # ==================== CLIENT ====================
+    async def start(self):
+        if self._client is not None:
+            return
         
-        if usuario.get("telefono"):
-            patient["telecom"] = [{"system": "phone", "value": usuario["telefono"]}]
-        if usuario.get("email"):
-            patient.setdefault("telecom", []).append({"system": "email", "value": usuario["email"]})
+        http2 = settings.FHIR_HTTP2
+        if http2 and not HTTP2_DISPONIBLE:
+            print("[FHIR] HTTP/2 solicitado pero el paquete 'h2' no está instalado, usando HTTP/1.1")
+            http2 = False
+        
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=settings.FHIR_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.FHIR_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.FHIR_KEEPALIVE_EXPIRY
+            ),
+            timeout=self.timeouts["read"]
+        )
+        print(f"[FHIR] Cliente iniciado - http2: {http2}, max_connections: {settings.FHIR_MAX_CONNECTIONS}")
+    
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            print("[FHIR] Cliente cerrado")
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            raise RuntimeError("FHIRService no iniciado, llamar a fhir_service.start()")
+        return self._client
+    
+    async def _request(self, method: str, path: str, operation: str = "read", **kwargs) -> httpx.Response:
+        # Con el breaker abierto se lanza HAPINoDisponible sin tocar la red
+        self.breaker.permitir()
+        inicio = time.monotonic()
+        try:
+            response = await asyncio.wait_for(
+                self.client.request(method, path, timeout=self.timeouts[operation], **kwargs),
+                timeout=self.deadlines[operation]
+            )
+        except asyncio.TimeoutError:
+            self.breaker.registrar_fallo(f"Deadline {operation} de {self.deadlines[operation]}s excedido")
+            raise httpx.TimeoutException(f"{method} {path}: deadline de {self.deadlines[operation]}s excedido")
+        except httpx.HTTPError as e:
+            self.breaker.registrar_fallo(f"{type(e).__name__}: {e}")
+            raise
+        except BaseException:
+            # Cancelada (cliente desconectado, tarea cancelada, apagado) u otro error ajeno a HAPI
+            self.breaker.liberar()
+            raise
+        
+        if response.status_code >= 500:
+            self.breaker.registrar_fallo(f"{method} {path} - Status: {response.status_code}")
+        else:
+            self.breaker.registrar_exito(time.monotonic() - inicio)
+        return response
+    
+    @property
+    def disponible(self) -> bool:
+        return self.breaker.disponible
+    
+    # ==================== READ (CACHE) ====================
+    async def read(self, resource_type: str, fhir_id: str) -> Optional[dict]:
+        entry = self.cache.get(resource_type, fhir_id)
+        if entry and entry.fresh:
+            self.cache.hits += 1
+            return entry.value
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(f"{self.base_url}/Patient", json=patient)
-            print(f"[FHIR] Create Patient - Status: {response.status_code}")
-            if response.status_code == 201:
-                return response.json().get("id")
+        headers = {"If-None-Match": entry.etag} if entry and entry.etag else {}
+        try:
+            response = await self._request("GET", f"/{resource_type}/{fhir_id}", "read", headers=headers)
+        except (HAPINoDisponible, httpx.HTTPError):
+            # Degradación: mejor una copia vencida que ninguna mientras HAPI no responde
+            if entry:
+                self.cache.stale += 1
+                return entry.value
+            raise
+        
+        if response.status_code == 304 and entry:
+            self.cache.revalidations += 1
+            self.cache.touch(resource_type, fhir_id)
+            return entry.value
+        
+        if response.status_code >= 500 and entry:
+            # HAPI degradado (p. ej. 503 en mantenimiento): igual que sin respuesta, la copia se conserva
+            self.cache.stale += 1
+            return entry.value
+        
+        self.cache.misses += 1
+        if response.status_code == 200:
+            resource = response.json()
+            version = resource.get("meta", {}).get("versionId")
+            etag = response.headers.get("ETag") or (f'W/"{version}"' if version else None)
+            self.cache.put(resource_type, fhir_id, resource, etag)
+            return resource
+        
+        # Sólo se descarta lo que HAPI confirma que ya no existe
+        if response.status_code in (404, 410):
+            self.cache.invalidate(resource_type, fhir_id)
         return None
     
-    async def update_patient(self, fhir_id: str, usuario: dict) -> bool:
-        patient = {
-            "resourceType": "Patient",
-            "id": fhir_id,
+    # ==================== PATIENT ====================
+    def build_persona(self, resource_type: str, system: str, usuario: dict, fhir_id: Optional[str] = None) -> dict:
+        resource = {"resourceType": resource_type}
+        if fhir_id:
+            resource["id"] = fhir_id
+        resource.update({
             "identifier": [{
-                "system": "http://clinica.local/pacientes",
+                "system": system,
                 "value": usuario["numero_documento"]
             }],
             "name": [{
@@ -50,97 +168,140 @@ class FHIRService:
             }],
             "gender": "male" if usuario["genero"] == "Masculino" else "female",
             "birthDate": str(usuario["fecha_nacimiento"])
-        }
+        })
         
         if usuario.get("telefono"):
-            patient["telecom"] = [{"system": "phone", "value": usuario["telefono"]}]
+            resource["telecom"] = [{"system": "phone", "value": usuario["telefono"]}]
         if usuario.get("email"):
-            patient.setdefault("telecom", []).append({"system": "email", "value": usuario["email"]})
+            resource.setdefault("telecom", []).append({"system": "email", "value": usuario["email"]})
         
-        async with httpx.AsyncClient() as client:
-            response = await client.put(f"{self.base_url}/Patient/{fhir_id}", json=patient)
-            print(f"[FHIR] Update Patient - Status: {response.status_code}")
-            return response.status_code == 200
+        return resource
+    
+    def build_patient(self, usuario: dict, fhir_id: Optional[str] = None) -> dict:
+        return self.build_persona("Patient", PACIENTES_SYSTEM, usuario, fhir_id)
+    
+    async def create_patient(self, usuario: dict) -> Optional[str]:
+        return await self.create_conditional(self.build_patient(usuario))
+    
+    async def upsert_patient(self, usuario: dict, eliminar: Optional[str] = None) -> Optional[str]:
+        return await self.upsert(self.build_patient(usuario), eliminar)
+    
+    async def update_patient(self, fhir_id: str, usuario: dict) -> bool:
+        patient = self.build_patient(usuario, fhir_id)
+        response = await self._request("PUT", f"/Patient/{fhir_id}", "write", json=patient)
+        print(f"[FHIR] Update Patient - Status: {response.status_code}")
+        self.cache.invalidate("Patient", fhir_id)
+        return response.status_code == 200
     
     async def delete_patient(self, fhir_id: str) -> bool:
-        async with httpx.AsyncClient() as client:
-            response = await client.delete(f"{self.base_url}/Patient/{fhir_id}")
-            print(f"[FHIR] Delete Patient {fhir_id} - Status: {response.status_code}")
-            return response.status_code in [200, 204]
+        response = await self._request("DELETE", f"/Patient/{fhir_id}", "write")
+        print(f"[FHIR] Delete Patient {fhir_id} - Status: {response.status_code}")
+        self.cache.invalidate("Patient", fhir_id)
+        self.cache.invalidate("PatientHistory", fhir_id)
+        return response.status_code in [200, 204]
     
     async def get_patient(self, fhir_id: str) -> Optional[dict]:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{self.base_url}/Patient/{fhir_id}")
-            if response.status_code == 200:
-                return response.json()
-        return None
+        return await self.read("Patient", fhir_id)
     
     # ==================== PRACTITIONER ====================
+    def build_practitioner(self, usuario: dict, fhir_id: Optional[str] = None) -> dict:
+        return self.build_persona("Practitioner", MEDICOS_SYSTEM, usuario, fhir_id)
+    
     async def create_practitioner(self, usuario: dict) -> Optional[str]:
-        practitioner = {
-            "resourceType": "Practitioner",
-            "identifier": [{
-                "system": "http://clinica.local/medicos",
-                "value": usuario["numero_documento"]
-            }],
-            "name": [{
-                "use": "official",
-                "family": usuario["apellidos"],
-                "given": [usuario["nombres"]]
-            }],
-            "gender": "male" if usuario["genero"] == "Masculino" else "female",
-            "birthDate": str(usuario["fecha_nacimiento"])
-        }
-        
-        if usuario.get("telefono"):
-            practitioner["telecom"] = [{"system": "phone", "value": usuario["telefono"]}]
-        if usuario.get("email"):
-            practitioner.setdefault("telecom", []).append({"system": "email", "value": usuario["email"]})
-        
-        print(f"[FHIR] Creating Practitioner: {practitioner}")
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.post(f"{self.base_url}/Practitioner", json=practitioner)
-            print(f"[FHIR] Create Practitioner - Status: {response.status_code}, Response: {response.text}")
-            if response.status_code == 201:
-                return response.json().get("id")
-        return None
+        return await self.create_conditional(self.build_practitioner(usuario))
+    
+    async def upsert_practitioner(self, usuario: dict, eliminar: Optional[str] = None) -> Optional[str]:
+        return await self.upsert(self.build_practitioner(usuario), eliminar)
     
     async def update_practitioner(self, fhir_id: str, usuario: dict) -> bool:
-        practitioner = {
-            "resourceType": "Practitioner",
-            "id": fhir_id,
-            "identifier": [{
-                "system": "http://clinica.local/medicos",
-                "value": usuario["numero_documento"]
-            }],
-            "name": [{
-                "use": "official",
-                "family": usuario["apellidos"],
-                "given": [usuario["nombres"]]
-            }],
-            "gender": "male" if usuario["genero"] == "Masculino" else "female",
-            "birthDate": str(usuario["fecha_nacimiento"])
-        }
+        practitioner = self.build_practitioner(usuario, fhir_id)
+        response = await self._request("PUT", f"/Practitioner/{fhir_id}", "write", json=practitioner)
+        print(f"[FHIR] Update Practitioner - Status: {response.status_code}")
+        self.cache.invalidate("Practitioner", fhir_id)
+        return response.status_code == 200
+    
+    async def delete_practitioner(self, fhir_id: str) -> bool:
+        response = await self._request("DELETE", f"/Practitioner/{fhir_id}", "write")
+        print(f"[FHIR] Delete Practitioner {fhir_id} - Status: {response.status_code}")
+        self.cache.invalidate("Practitioner", fhir_id)
+        return response.status_code in [200, 204]
+    
+    async def get_practitioner(self, fhir_id: str) -> Optional[dict]:
+        return await self.read("Practitioner", fhir_id)
+    
+    # ==================== CONDITIONAL ====================
+    # Operaciones condicionales sobre el identificador de negocio (tipo de recurso + número de documento):
+    # reintentar una sincronización nunca crea un segundo Patient/Practitioner para la misma persona.
+    @staticmethod
+    def _identifier_search(resource: dict) -> str:
+        identifier = resource["identifier"][0]
+        return f"{identifier['system']}|{identifier['value']}"
+    
+    def _id_from_response(self, response: httpx.Response) -> Optional[str]:
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
+        if body.get("id") and body.get("resourceType") != "OperationOutcome":
+            return body["id"]
+        return self._id_from_location(response.headers.get("Location") or response.headers.get("Content-Location"))
+    
+    async def create_conditional(self, resource: dict) -> Optional[str]:
+        # If-None-Exist: si ya hay un recurso con ese identificador HAPI responde 200 con el existente
+        resource_type = resource["resourceType"]
+        headers = {"If-None-Exist": urlencode({"identifier": self._identifier_search(resource)})}
+        response = await self._request("POST", f"/{resource_type}", "write", json=resource, headers=headers)
+        print(f"[FHIR] Create {resource_type} (If-None-Exist) - Status: {response.status_code}")
+        if response.status_code in (200, 201):
+            return self._id_from_response(response)
+        return None
+    
+    async def upsert(self, resource: dict, eliminar: Optional[str] = None) -> Optional[str]:
+        # PUT ?identifier=: crea el recurso si no existe o actualiza el que ya tiene ese identificador.
+        # Con `eliminar` (p. ej. "Patient/123" en un cambio de rol) el DELETE del recurso anterior
+        # viaja en la misma transacción, así el cambio cuesta un solo round trip.
+        resource_type = resource["resourceType"]
+        identifier = self._identifier_search(resource)
         
-        if usuario.get("telefono"):
-            practitioner["telecom"] = [{"system": "phone", "value": usuario["telefono"]}]
-        if usuario.get("email"):
-            practitioner.setdefault("telecom", []).append({"system": "email", "value": usuario["email"]})
+        if eliminar is None:
+            response = await self._request("PUT", f"/{resource_type}", "write", params={"identifier": identifier}, json=resource)
+            print(f"[FHIR] Upsert {resource_type} - Status: {response.status_code}")
+            fhir_id = self._id_from_response(response) if response.status_code in (200, 201) else None
+        else:
+            bundle = {
+                "resourceType": "Bundle",
+                "type": "transaction",
+                "entry": [{
+                    "request": {"method": "DELETE", "url": eliminar}
+                }, {
+                    "resource": resource,
+                    "request": {"method": "PUT", "url": f"{resource_type}?{urlencode({'identifier': identifier})}"}
+                }]
+            }
+            response = await self._request("POST", "", "write", json=bundle)
+            print(f"[FHIR] Transaction DELETE {eliminar} + Upsert {resource_type} - Status: {response.status_code}")
+            fhir_id = None
+            if response.status_code == 200:
+                entries = response.json().get("entry", [])
+                if len(entries) == 2:
+                    fhir_id = self._id_from_location(entries[1].get("response", {}).get("location"))
+            if fhir_id:
+                tipo_eliminado, id_eliminado = eliminar.split("/", 1)
+                self.cache.invalidate(tipo_eliminado, id_eliminado)
+                self.cache.invalidate("PatientHistory", id_eliminado)
         
-        async with httpx.AsyncClient() as client:
-            response = await client.put(f"{self.base_url}/Practitioner/{fhir_id}", json=practitioner)
-            print(f"[FHIR] Update Practitioner - Status: {response.status_code}")
-            return response.status_code == 200
+        if fhir_id:
+            self.cache.invalidate(resource_type, fhir_id)
+        return fhir_id
     
-    async def delete_practitioner(self, fhir_id: str) -> bool:
-        async with httpx.AsyncClient() as client:
-            response = await client.delete(f"{self.base_url}/Practitioner/{fhir_id}")
-            print(f"[FHIR] Delete Practitioner {fhir_id} - Status: {response.status_code}")
-            return response.status_code in [200, 204]
+    async def delete(self, reference: str) -> bool:
+        resource_type, fhir_id = reference.split("/", 1)
+        if resource_type == "Patient":
+            return await self.delete_patient(fhir_id)
+        return await self.delete_practitioner(fhir_id)
     
     # ==================== ENCOUNTER ====================
-    async def create_encounter(self, encuentro: dict, paciente_fhir_id: str, medico_id: int) -> Optional[str]:
+    def build_encounter(self, encuentro: dict, paciente_ref: str, medico_id: int) -> dict:
         encounter = {
             "resourceType": "Encounter",
             "status": "finished",
@@ -150,7 +311,7 @@ class FHIRService:
                 "display": encuentro.get("tipo_nombre", "Consulta")
             },
             "subject": {
-                "reference": f"Patient/{paciente_fhir_id}"
+                "reference": paciente_ref
             },
             "participant": [{
                 "individual": {
@@ -172,22 +333,26 @@ class FHIRService:
                     "code": encuentro["diagnostico_codigo_icd10"]
                 }]
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(f"{self.base_url}/Encounter", json=encounter)
-            if response.status_code == 201:
-                return response.json().get("id")
+        return encounter
+    
+    async def create_encounter(self, encuentro: dict, paciente_fhir_id: str, medico_id: int) -> Optional[str]:
+        encounter = self._con_origen(self.build_encounter(encuentro, f"Patient/{paciente_fhir_id}", medico_id))
+        response = await self._request("POST", "/Encounter", "write", json=encounter)
+        self.cache.invalidate("PatientHistory", paciente_fhir_id)
+        if response.status_code == 201:
+            return response.json().get("id")
         return None
     
     # ==================== OBSERVATION ====================
-    async def create_observation(self, observacion: dict, paciente_fhir_id: str, encounter_fhir_id: str) -> Optional[str]:
+    def build_observation(self, observacion: dict, paciente_ref: str, encounter_ref: str) -> dict:
         obs = {
             "resourceType": "Observation",
             "status": "final",
             "subject": {
-                "reference": f"Patient/{paciente_fhir_id}"
+                "reference": paciente_ref
             },
             "encounter": {
-                "reference": f"Encounter/{encounter_fhir_id}"
+                "reference": encounter_ref
             },
             "effectiveDateTime": observacion["fecha"],
             "code": {
@@ -197,43 +362,377 @@ class FHIRService:
         
         if observacion.get("codigo_loinc"):
             obs["code"]["coding"] = [{
-                "system": "http://loinc.org",
+                "system": LOINC_SYSTEM,
                 "code": observacion["codigo_loinc"]
             }]
         
         if observacion.get("valor"):
-            if observacion.get("unidad"):
-                obs["valueQuantity"] = {
-                    "value": float(observacion["valor"]) if observacion["valor"].replace(".", "").isdigit() else 0,
-                    "unit": observacion["unidad"]
-                }
+            medicion = parsear(observacion["valor"], observacion.get("unidad"),
+                               observacion.get("codigo_loinc"), observacion["descripcion"])
+            if medicion.es_presion:
+                # Presión arterial "120/80": un componente por cifra, con el panel como código si no trae uno
+                obs["code"].setdefault("coding", [{"system": LOINC_SYSTEM, "code": LOINC_PRESION_ARTERIAL[0],
+                                                   "display": LOINC_PRESION_ARTERIAL[1]}])
+                obs["component"] = [{
+                    "code": {"coding": [{"system": LOINC_SYSTEM, "code": codigo, "display": display}]},
+                    "valueQuantity": self._cantidad(cifra, medicion.unidad, medicion.unidad_ucum)
+                } for (codigo, display), cifra in ((LOINC_SISTOLICA, medicion.sistolica), (LOINC_DIASTOLICA, medicion.diastolica))]
+            elif medicion.valor is not None:
+                obs["valueQuantity"] = self._cantidad(medicion.valor, medicion.unidad, medicion.unidad_ucum)
+                if medicion.comparador:
+                    obs["valueQuantity"]["comparator"] = medicion.comparador
             else:
                 obs["valueString"] = observacion["valor"]
         
         if observacion.get("interpretacion"):
             obs["interpretation"] = [{"text": observacion["interpretacion"]}]
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(f"{self.base_url}/Observation", json=obs)
-            if response.status_code == 201:
-                return response.json().get("id")
+        return obs
+    
+    @staticmethod
+    def _cantidad(valor: float, unidad: Optional[str], codigo_ucum: Optional[str]) -> dict:
+        cantidad = {"value": int(valor) if valor.is_integer() else valor}
+        if unidad:
+            cantidad["unit"] = unidad
+        if codigo_ucum:
+            cantidad["system"] = UCUM_SYSTEM
+            cantidad["code"] = codigo_ucum
+        return cantidad
+    
+    async def create_observation(self, observacion: dict, paciente_fhir_id: str, encounter_fhir_id: str) -> Optional[str]:
+        obs = self._con_origen(self.build_observation(observacion, f"Patient/{paciente_fhir_id}", f"Encounter/{encounter_fhir_id}"))
+        response = await self._request("POST", "/Observation", "write", json=obs)
+        self.cache.invalidate("PatientHistory", paciente_fhir_id)
+        if response.status_code == 201:
+            return response.json().get("id")
         return None
     
-    # ==================== HISTORY ====================
-    async def get_patient_history(self, fhir_patient_id: str) -> dict:
-        history = {"encounters": [], "observations": []}
+    # ==================== TRANSACTION ====================
+    @staticmethod
+    def _con_origen(resource: dict) -> dict:
+        resource.setdefault("meta", {}).setdefault("tag", []).append(ORIGEN_TAG)
+        return resource
+    
+    @staticmethod
+    def es_propio(resource: dict) -> bool:
+        return any(
+            t.get("system") == ORIGEN_TAG["system"] and t.get("code") == ORIGEN_TAG["code"]
+            for t in (resource.get("meta") or {}).get("tag", [])
+        )
+    
+    def _encounter_entries(self, encuentro: dict, observaciones: list, paciente_fhir_id: str, medico_id: int) -> list:
+        encounter_ref = f"urn:uuid:{uuid.uuid4()}"
+        paciente_ref = f"Patient/{paciente_fhir_id}"
+        
+        entries = [{
+            "fullUrl": encounter_ref,
+            "resource": self._con_origen(self.build_encounter(encuentro, paciente_ref, medico_id)),
+            "request": {"method": "POST", "url": "Encounter"}
+        }]
+        for observacion in observaciones:
+            entries.append({
+                "fullUrl": f"urn:uuid:{uuid.uuid4()}",
+                "resource": self._con_origen(self.build_observation(observacion, paciente_ref, encounter_ref)),
+                "request": {"method": "POST", "url": "Observation"}
+            })
+        return entries
+    
+    def build_encounter_bundle(self, encuentro: dict, observaciones: list, paciente_fhir_id: str, medico_id: int) -> dict:
+        entries = self._encounter_entries(encuentro, observaciones, paciente_fhir_id, medico_id)
+        return {"resourceType": "Bundle", "type": "transaction", "entry": entries}
+    
+    async def create_encounter_bundle(self, encuentro: dict, observaciones: list, paciente_fhir_id: str, medico_id: int) -> Optional[dict]:
+        resultado = await self.create_encounters_bundle([{
+            "encuentro": encuentro,
+            "observaciones": observaciones,
+            "paciente_fhir_id": paciente_fhir_id,
+            "medico_id": medico_id
+        }])
+        return resultado[0] if resultado else None
+    
+    async def create_encounters_bundle(self, items: list) -> Optional[list]:
+        # Varios Encounter con sus Observations en una sola transacción: o se crean todos o ninguno
+        entries, tamanos = [], []
+        for item in items:
+            item_entries = self._encounter_entries(item["encuentro"], item["observaciones"], item["paciente_fhir_id"], item["medico_id"])
+            entries.extend(item_entries)
+            tamanos.append(len(item_entries))
+        
+        bundle = {"resourceType": "Bundle", "type": "transaction", "entry": entries}
+        response = await self._request("POST", "", "write", json=bundle)
+        total_obs = sum(tamanos) - len(tamanos)
+        print(f"[FHIR] Transaction {len(items)} Encounter + {total_obs} Observation - Status: {response.status_code}")
+        for item in items:
+            self.cache.invalidate("PatientHistory", item["paciente_fhir_id"])
+        if response.status_code != 200:
+            return None
         
-        async with httpx.AsyncClient() as client:
-            enc_response = await client.get(f"{self.base_url}/Encounter?subject=Patient/{fhir_patient_id}")
-            if enc_response.status_code == 200:
-                bundle = enc_response.json()
-                history["encounters"] = [e["resource"] for e in bundle.get("entry", [])]
+        # Las entradas de la respuesta llegan en el mismo orden que las de la petición
+        ids = [self._id_from_location(e.get("response", {}).get("location")) for e in response.json().get("entry", [])]
+        if len(ids) != len(entries):
+            return None
+        
+        resultado, inicio = [], 0
+        for tamano in tamanos:
+            resultado.append({"encounter": ids[inicio], "observations": ids[inicio + 1:inicio + tamano]})
+            inicio += tamano
+        return resultado
+    
+    # ==================== BATCH ====================
+    async def create_batch(self, resources: list) -> list:
+        # Bundle batch: cada entrada se procesa por separado, así un recurso inválido no bloquea al resto.
+        # Los recursos con identificador se crean con ifNoneExist: si ya existen se devuelve su id.
+        # Devuelve el id por recurso, o None para las entradas que HAPI rechazó.
+        entries = []
+        for resource in resources:
+            request = {"method": "POST", "url": resource["resourceType"]}
+            if resource.get("identifier"):
+                request["ifNoneExist"] = urlencode({"identifier": self._identifier_search(resource)})
+            entries.append({"resource": resource, "request": request})
+        bundle = {"resourceType": "Bundle", "type": "batch", "entry": entries}
+        response = await self._request("POST", "", "write", json=bundle)
+        print(f"[FHIR] Batch {len(resources)} recursos - Status: {response.status_code}")
+        if response.status_code != 200:
+            return [None] * len(resources)
+        
+        ids = []
+        for entry in response.json().get("entry", []):
+            respuesta = entry.get("response", {})
+            creado = respuesta.get("status", "").startswith(("200", "201"))
+            ids.append(self._id_from_location(respuesta.get("location")) if creado else None)
+        return (ids + [None] * len(resources))[:len(resources)]
+    
+    @staticmethod
+    def _id_from_location(location: Optional[str]) -> Optional[str]:
+        # "Encounter/123/_history/1" -> "123"
+        if not location:
+            return None
+        return location.split("/_history")[0].rstrip("/").split("/")[-1]
+    
+    # ==================== PARSE (HAPI -> local) ====================
+    # Inversas de los build_*: sólo devuelven los campos presentes en el recurso.
+    @staticmethod
+    def _ref_id(reference: Optional[dict], resource_type: str) -> Optional[str]:
+        ref = (reference or {}).get("reference") or ""
+        partes = ref.split("/_history")[0].rstrip("/").split("/")
+        if len(partes) >= 2 and partes[-2] == resource_type:
+            return partes[-1]
+        return None
+    
+    def parse_persona(self, resource: dict, system: str) -> dict:
+        usuario = {}
+        identifier = next((i for i in resource.get("identifier", []) if i.get("system") == system), None)
+        if identifier and identifier.get("value"):
+            usuario["numero_documento"] = identifier["value"]
+        
+        name = next((n for n in resource.get("name", []) if n.get("use") == "official"), None) or (resource.get("name") or [None])[0]
+        if name:
+            if name.get("family"):
+                usuario["apellidos"] = name["family"]
+            if name.get("given"):
+                usuario["nombres"] = " ".join(name["given"])
+        
+        if resource.get("gender") in ("male", "female"):
+            usuario["genero"] = "Masculino" if resource["gender"] == "male" else "Femenino"
+        if resource.get("birthDate"):
+            usuario["fecha_nacimiento"] = resource["birthDate"]
+        
+        telecom = resource.get("telecom", [])
+        usuario["telefono"] = next((t["value"] for t in telecom if t.get("system") == "phone" and t.get("value")), None)
+        usuario["email"] = next((t["value"] for t in telecom if t.get("system") == "email" and t.get("value")), None)
+        return usuario
+    
+    def parse_patient(self, resource: dict) -> dict:
+        return self.parse_persona(resource, PACIENTES_SYSTEM)
+    
+    def parse_practitioner(self, resource: dict) -> dict:
+        return self.parse_persona(resource, MEDICOS_SYSTEM)
+    
+    def parse_encounter(self, resource: dict) -> dict:
+        encuentro = {
+            "paciente_fhir_id": self._ref_id(resource.get("subject"), "Patient"),
+            "medico_fhir_id": next((
+                self._ref_id(p.get("individual"), "Practitioner") for p in resource.get("participant", [])
+                if self._ref_id(p.get("individual"), "Practitioner")
+            ), None),
+            "fecha": (resource.get("period") or {}).get("start"),
+            "codigo_fhir": (resource.get("class") or {}).get("code"),
+            "estado": resource.get("status"),
+            "diagnostico": None,
+            "diagnostico_codigo_icd10": None
+        }
+        if resource.get("reasonCode"):
+            reason = resource["reasonCode"][0]
+            encuentro["diagnostico"] = reason.get("text")
+            encuentro["diagnostico_codigo_icd10"] = next((
+                c.get("code") for c in reason.get("coding", []) if c.get("system") == "http://hl7.org/fhir/sid/icd-10"
+            ), None)
+        return encuentro
+    
+    @staticmethod
+    def _texto_valor(valor) -> str:
+        return f"{valor:g}" if isinstance(valor, float) else str(valor)
+    
+    def parse_observation(self, resource: dict) -> dict:
+        code = resource.get("code") or {}
+        coding = code.get("coding", [])
+        observacion = {
+            "paciente_fhir_id": self._ref_id(resource.get("subject"), "Patient"),
+            "encounter_fhir_id": self._ref_id(resource.get("encounter"), "Encounter"),
+            "fecha": resource.get("effectiveDateTime"),
+            "descripcion": code.get("text") or next((c.get("display") for c in coding if c.get("display")), None),
+            "codigo_loinc": next((c.get("code") for c in coding if c.get("system") == LOINC_SYSTEM), None),
+            "valor": None,
+            "unidad": None,
+            "interpretacion": None
+        }
+        componentes = {
+            next((c.get("code") for c in comp.get("code", {}).get("coding", []) if c.get("system") == LOINC_SYSTEM), None):
+            comp.get("valueQuantity") or {}
+            for comp in resource.get("component", [])
+        }
+        if "valueQuantity" in resource:
+            cantidad = resource["valueQuantity"]
+            if cantidad.get("value") is not None:
+                observacion["valor"] = (cantidad.get("comparator") or "") + self._texto_valor(cantidad["value"])
+            observacion["unidad"] = cantidad.get("unit") or cantidad.get("code")
+        elif LOINC_SISTOLICA[0] in componentes and LOINC_DIASTOLICA[0] in componentes:
+            sistolica, diastolica = componentes[LOINC_SISTOLICA[0]], componentes[LOINC_DIASTOLICA[0]]
+            if sistolica.get("value") is not None and diastolica.get("value") is not None:
+                observacion["valor"] = f"{self._texto_valor(sistolica['value'])}/{self._texto_valor(diastolica['value'])}"
+                observacion["unidad"] = sistolica.get("unit") or "mmHg"
+        elif "valueString" in resource:
+            observacion["valor"] = resource["valueString"]
+        if resource.get("interpretation"):
+            observacion["interpretacion"] = resource["interpretation"][0].get("text")
+        return observacion
+    
+    # ==================== SEARCH ====================
+    async def search_pages(self, resource_type: str, params: dict) -> AsyncIterator[list]:
+        # Recorre todas las páginas del Bundle siguiendo link[next]. Una página que no llega con 200
+        # lanza HTTPStatusError: quien consume no debe tomar un resultado cortado por completo.
+        response = await self._request("GET", f"/{resource_type}", "search", params=params)
+        while True:
+            if response.status_code != 200:
+                print(f"[FHIR] Search {resource_type} - Status: {response.status_code}")
+                raise httpx.HTTPStatusError(
+                    f"Search {resource_type} interrumpida: status {response.status_code}",
+                    request=response.request, response=response
+                )
+            bundle = response.json()
+            yield [e["resource"] for e in bundle.get("entry", []) if "resource" in e]
             
-            obs_response = await client.get(f"{self.base_url}/Observation?subject=Patient/{fhir_patient_id}")
-            if obs_response.status_code == 200:
-                bundle = obs_response.json()
-                history["observations"] = [o["resource"] for o in bundle.get("entry", [])]
+            next_url = next((l["url"] for l in bundle.get("link", []) if l.get("relation") == "next"), None)
+            if not next_url:
+                return
+            response = await self._request("GET", next_url, "search")
+    
+    async def search_all(self, resource_type: str, params: dict) -> list:
+        resources = []
+        async for page in self.search_pages(resource_type, params):
+            resources.extend(page)
+        return resources
+    
+    # ==================== HISTORY ====================
+    def _history_params(self, fhir_patient_id: str) -> dict:
+        return {
+            "subject": f"Patient/{fhir_patient_id}",
+            "_sort": "-date",
+            "_count": settings.FHIR_PAGE_SIZE
+        }
+    
+    def _cached_history(self, fhir_patient_id: str) -> Optional[dict]:
+        entry = self.cache.get("PatientHistory", fhir_patient_id)
+        if entry and entry.fresh:
+            self.cache.hits += 1
+            return entry.value
+        if entry and not self.disponible:
+            self.cache.stale += 1
+            return entry.value
+        self.cache.misses += 1
+        return None
+    
+    async def get_patient_history(self, fhir_patient_id: str) -> dict:
+        history = self._cached_history(fhir_patient_id)
+        if history is not None:
+            return history
         
+        params = self._history_params(fhir_patient_id)
+        # Si alguna búsqueda queda a medias, gather propaga el error y no se cachea nada
+        encounters, observations = await asyncio.gather(
+            self.search_all("Encounter", params),
+            self.search_all("Observation", params)
+        )
+        history = {"encounters": encounters, "observations": observations}
+        self.cache.put("PatientHistory", fhir_patient_id, history, ttl=settings.FHIR_HISTORY_CACHE_TTL)
         return history
+    
+    async def stream_patient_history(self, fhir_patient_id: str) -> AsyncIterator[str]:
+        # Emite {"encounters": [...], "observations": [...]} a medida que llegan las páginas.
+        # Las Observations se van descargando en paralelo mientras se emiten los Encounters.
+        # El status 200 ya salió con el primer fragmento: si una búsqueda falla a mitad, el documento
+        # se cierra igual con un miembro "error" y el historial incompleto no se guarda en la caché.
+        history = self._cached_history(fhir_patient_id)
+        if history is not None:
+            yield json.dumps(history)
+            return
+        
+        encounters, observations = [], []
+        params = self._history_params(fhir_patient_id)
+        obs_pages: asyncio.Queue = asyncio.Queue(maxsize=settings.FHIR_STREAM_BUFFER_PAGES)
+        
+        async def producir_observaciones():
+            paginas = self.search_pages("Observation", params)
+            try:
+                async for page in paginas:
+                    await obs_pages.put(page)
+            except asyncio.CancelledError:
+                # Nadie va a leer el marcador de fin; esperar lugar en la cola llena no terminaría nunca
+                raise
+            except Exception:
+                await obs_pages.put(None)
+                raise
+            else:
+                await obs_pages.put(None)
+            finally:
+                await paginas.aclose()
+        
+        tarea = asyncio.create_task(producir_observaciones())
+        cierre = '], "observations": [], "error": '
+        try:
+            yield '{"encounters": ['
+            try:
+                primero = True
+                async for page in self.search_pages("Encounter", params):
+                    encounters.extend(page)
+                    if page:
+                        yield ("" if primero else ",") + ",".join(json.dumps(r) for r in page)
+                        primero = False
+                
+                yield '], "observations": ['
+                cierre = '], "error": '
+                primero = True
+                while (page := await obs_pages.get()) is not None:
+                    observations.extend(page)
+                    if page:
+                        yield ("" if primero else ",") + ",".join(json.dumps(r) for r in page)
+                        primero = False
+                # El productor termina con None también cuando falla: el error sale de la tarea
+                await tarea
+            except (HAPINoDisponible, httpx.HTTPError) as e:
+                print(f"[FHIR] Historial {fhir_patient_id} incompleto: {e}")
+                yield cierre + json.dumps(f"Historial incompleto: {e}") + "}"
+                return
+            
+            yield ']}'
+            self.cache.put("PatientHistory", fhir_patient_id, {
+                "encounters": encounters,
+                "observations": observations
+            }, ttl=settings.FHIR_HISTORY_CACHE_TTL)
+        finally:
+            # Búsqueda de Encounters fallida o cliente desconectado: el productor se detiene y se espera,
+            # así su excepción queda recogida y no sobrevive a la respuesta
+            tarea.cancel()
+            await asyncio.gather(tarea, return_exceptions=True)
 
 fhir_service = FHIRService()
@@ -0,0 +1,397 @@
+import asyncio
+import random
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import settings
+from app.database import SessionLocal
+from app.models.models import OutboxFHIR, Usuario, Rol, EncuentroMedico, ObservacionClinica, TipoEncuentroMedico
+from app.services.fhir_breaker import HAPINoDisponible
+from app.services.fhir_service import fhir_service
+
+class SyncPendiente(Exception):
+    """La operación depende de otra que aún no se ha sincronizado; se reintenta más tarde."""
+
+def encolar(db: AsyncSession, operacion: str, entidad_id: Optional[int] = None, payload: Optional[dict] = None):
+    # No hace commit: la entrada se guarda en la misma transacción que el registro clínico
+    db.add(OutboxFHIR(operacion=operacion, entidad_id=entidad_id, payload=payload or {}))
+
+def get_user_data(usuario: Usuario) -> dict:
+    return {
+        "numero_documento": usuario.numero_documento,
+        "nombres": usuario.nombres,
+        "apellidos": usuario.apellidos,
+        "genero": usuario.genero,
+        "fecha_nacimiento": usuario.fecha_nacimiento,
+        "telefono": usuario.telefono,
+        "email": usuario.email
+    }
+
+class FHIRSyncWorker:
+    def __init__(self):
+        self.batch_size = settings.FHIR_SYNC_BATCH_SIZE
+        self.concurrency = settings.FHIR_SYNC_CONCURRENCY
+        self.poll_interval = settings.FHIR_SYNC_POLL_INTERVAL
+        self.max_attempts = settings.FHIR_SYNC_MAX_ATTEMPTS
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+        self._wakeup = asyncio.Event()
+        self.handlers = {
+            "sync_patient": self._sync_patient,
+            "sync_patients": self._sync_patients,
+            "sync_practitioner": self._sync_practitioner,
+            "delete_patient": self._delete_patient,
+            "delete_practitioner": self._delete_practitioner,
+            "sync_encounter": self._sync_encounter,
+            "sync_encounters": self._sync_encounters,
+        }
+
+    # ==================== CICLO ====================
+    async def start(self):
+        if self._task is None:
+            self._stopping.clear()
+            self._task = asyncio.create_task(self.run())
+            print("[FHIR-SYNC] Worker iniciado")
+
+    async def stop(self):
+        if self._task is not None:
+            self._stopping.set()
+            self._wakeup.set()
+            await self._task
+            self._task = None
+            print("[FHIR-SYNC] Worker detenido")
+
+    def notify(self):
+        self._wakeup.set()
+
+    async def run(self):
+        while not self._stopping.is_set():
+            # Con el breaker abierto no se reclaman entradas: quedan pendientes hasta que HAPI vuelva
+            if not fhir_service.disponible:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), timeout=max(fhir_service.breaker.reintentar_en, self.poll_interval))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                procesadas = await self.drain_once()
+            except Exception as e:
+                print(f"[FHIR-SYNC] Error en el ciclo: {e}")
+                procesadas = 0
+
+            # Si el lote vino lleno probablemente quedan más entradas pendientes
+            if procesadas >= self.batch_size:
+                continue
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def drain_once(self) -> int:
+        entradas = await asyncio.to_thread(self._reclamar_lote)
+        if not entradas:
+            return 0
+
+        semaforo = asyncio.Semaphore(self.concurrency)
+
+        async def procesar(entrada: dict):
+            async with semaforo:
+                await self._procesar(entrada)
+
+        await asyncio.gather(*(procesar(e) for e in entradas))
+        return len(entradas)
+
+    def _reclamar_lote(self) -> list:
+        # Las entradas reclamadas quedan "arrendadas": si el proceso muere, vuelven a estar disponibles al vencer
+        ahora = datetime.now()
+        with SessionLocal() as db:
+            filas = db.query(OutboxFHIR).filter(
+                OutboxFHIR.estado == "pendiente",
+                OutboxFHIR.proximo_intento <= ahora
+            ).order_by(OutboxFHIR.id).limit(self.batch_size).with_for_update(skip_locked=True).all()
+
+            entradas = []
+            for fila in filas:
+                fila.proximo_intento = ahora + timedelta(seconds=settings.FHIR_SYNC_LEASE_SECONDS)
+                entradas.append({
+                    "id": fila.id,
+                    "operacion": fila.operacion,
+                    "entidad_id": fila.entidad_id,
+                    "payload": fila.payload or {},
+                    "intentos": fila.intentos
+                })
+            db.commit()
+        return entradas
+
+    async def _procesar(self, entrada: dict):
+        handler = self.handlers.get(entrada["operacion"])
+        try:
+            if handler is None:
+                raise ValueError(f"Operación desconocida: {entrada['operacion']}")
+            await handler(entrada)
+        except HAPINoDisponible as e:
+            await asyncio.to_thread(self._aplazar, entrada["id"], e.reintentar_en)
+        except SyncPendiente as e:
+            # Espera a otra entrada (p. ej. el Patient de un lote de sync_patients): tampoco cuenta como intento
+            await asyncio.to_thread(self._aplazar, entrada["id"], settings.FHIR_SYNC_PENDIENTE_DELAY, str(e))
+        except Exception as e:
+            await asyncio.to_thread(self._marcar_fallo, entrada, e)
+        else:
+            await asyncio.to_thread(self._marcar_completado, entrada["id"])
+
+    def _marcar_completado(self, outbox_id: int):
+        with SessionLocal() as db:
+            db.query(OutboxFHIR).filter(OutboxFHIR.id == outbox_id).update({
+                "estado": "completado",
+                "procesado_at": datetime.now(),
+                "ultimo_error": None
+            })
+            db.commit()
+
+    def _aplazar(self, outbox_id: int, segundos: float, motivo: Optional[str] = None):
+        # El breaker rechazó la llamada o falta una dependencia: no cuenta como intento, sólo se devuelve a la cola
+        cambios = {"proximo_intento": datetime.now() + timedelta(seconds=max(segundos, self.poll_interval))}
+        if motivo:
+            cambios["ultimo_error"] = motivo[:2000]
+        with SessionLocal() as db:
+            db.query(OutboxFHIR).filter(OutboxFHIR.id == outbox_id).update(cambios)
+            db.commit()
+
+    def _marcar_fallo(self, entrada: dict, error: Exception):
+        intentos = entrada["intentos"] + 1
+        cambios = {"intentos": intentos, "ultimo_error": f"{type(error).__name__}: {error}"[:2000]}
+
+        if intentos >= self.max_attempts:
+            # Dead letter: queda para revisión manual desde /reportes/sincronizacion
+            cambios["estado"] = "fallido"
+            print(f"[FHIR-SYNC] {entrada['operacion']} #{entrada['id']} fallido tras {intentos} intentos: {error}")
+        else:
+            espera = min(settings.FHIR_SYNC_BACKOFF_MAX, settings.FHIR_SYNC_BACKOFF_BASE * 2 ** (intentos - 1))
+            cambios["proximo_intento"] = datetime.now() + timedelta(seconds=espera * random.uniform(0.5, 1.0))
+
+        with SessionLocal() as db:
+            db.query(OutboxFHIR).filter(OutboxFHIR.id == entrada["id"]).update(cambios)
+            db.commit()
+
+    # ==================== CONSULTAS ====================
+    def _cargar_usuario(self, usuario_id: int) -> Optional[dict]:
+        with SessionLocal() as db:
+            usuario = db.query(Usuario).filter(Usuario.id == usuario_id).first()
+            if not usuario:
+                return None
+            return {
+                "data": get_user_data(usuario),
+                "rol": usuario.rol.nombre if usuario.rol else None,
+                "fhir_patient_id": usuario.fhir_patient_id,
+                "fhir_practitioner_id": usuario.fhir_practitioner_id
+            }
+
+    def _guardar_fhir_id(self, usuario_id: int, columna: str, fhir_id: str):
+        with SessionLocal() as db:
+            db.query(Usuario).filter(Usuario.id == usuario_id).update({columna: fhir_id})
+            db.commit()
+
+    def _cargar_pacientes(self, usuario_ids: list) -> list:
+        # Sólo los que siguen siendo pacientes y aún no tienen Patient
+        with SessionLocal() as db:
+            usuarios = db.query(Usuario).join(Rol, Usuario.rol_id == Rol.id).filter(
+                Usuario.id.in_(usuario_ids),
+                Rol.nombre == "Paciente",
+                Usuario.fhir_patient_id == None
+            ).order_by(Usuario.id).all()
+            return [{"id": u.id, "data": get_user_data(u)} for u in usuarios]
+
+    def _guardar_pacientes(self, creados: dict, fallidos: list):
+        # Los rechazados pasan a entradas sync_patient individuales, con su propio backoff y dead letter
+        with SessionLocal() as db:
+            for usuario_id, fhir_id in creados.items():
+                db.query(Usuario).filter(
+                    Usuario.id == usuario_id,
+                    Usuario.fhir_patient_id == None
+                ).update({"fhir_patient_id": fhir_id}, synchronize_session=False)
+            db.add_all(OutboxFHIR(operacion="sync_patient", entidad_id=usuario_id, payload={}) for usuario_id in fallidos)
+            db.commit()
+
+    @staticmethod
+    def _datos_encuentro(encuentro: EncuentroMedico, tipo: Optional[TipoEncuentroMedico],
+                         paciente_fhir_id: Optional[str], observaciones: list) -> dict:
+        return {
+            "id": encuentro.id,
+            "fhir_encounter_id": encuentro.fhir_encounter_id,
+            "paciente_fhir_id": paciente_fhir_id,
+            "medico_id": encuentro.medico_id,
+            "encuentro": {
+                "fecha": encuentro.fecha.isoformat(),
+                "codigo_fhir": tipo.codigo_fhir if tipo else "AMB",
+                "tipo_nombre": tipo.nombre if tipo else "Consulta",
+                "diagnostico": encuentro.diagnostico,
+                "diagnostico_codigo_icd10": encuentro.diagnostico_codigo_icd10
+            },
+            "observacion_ids": [obs.id for obs in observaciones],
+            "observaciones": [{
+                "fecha": obs.fecha.isoformat(),
+                "descripcion": obs.descripcion,
+                "valor": obs.valor,
+                "unidad": obs.unidad,
+                "codigo_loinc": obs.codigo_loinc,
+                "interpretacion": obs.interpretacion
+            } for obs in observaciones]
+        }
+
+    def _cargar_encuentro(self, encuentro_id: int) -> Optional[dict]:
+        with SessionLocal() as db:
+            encuentro = db.query(EncuentroMedico).filter(EncuentroMedico.id == encuentro_id).first()
+            if not encuentro:
+                return None
+            tipo = db.query(TipoEncuentroMedico).filter(TipoEncuentroMedico.id == encuentro.tipo_id).first()
+            paciente = db.query(Usuario).filter(Usuario.id == encuentro.paciente_id).first()
+            observaciones = db.query(ObservacionClinica).filter(
+                ObservacionClinica.encuentro_id == encuentro_id
+            ).order_by(ObservacionClinica.id).all()
+            return self._datos_encuentro(encuentro, tipo, paciente.fhir_patient_id if paciente else None, observaciones)
+
+    def _guardar_encuentro_ids(self, encuentro_id: int, observacion_ids: list, fhir_ids: dict):
+        with SessionLocal() as db:
+            db.query(EncuentroMedico).filter(EncuentroMedico.id == encuentro_id).update(
+                {"fhir_encounter_id": fhir_ids["encounter"]}
+            )
+            for obs_id, fhir_obs_id in zip(observacion_ids, fhir_ids["observations"]):
+                db.query(ObservacionClinica).filter(ObservacionClinica.id == obs_id).update(
+                    {"fhir_observation_id": fhir_obs_id}
+                )
+            db.commit()
+
+    def _cargar_encuentros(self, encuentro_ids: list) -> list:
+        # Un lote completo en una sesión y cuatro sentencias (encuentros, tipos, pacientes, observaciones),
+        # sin importar cuántos encuentros traiga
+        if not encuentro_ids:
+            return []
+        with SessionLocal() as db:
+            encuentros = db.query(EncuentroMedico).filter(
+                EncuentroMedico.id.in_(encuentro_ids),
+                EncuentroMedico.fhir_encounter_id == None
+            ).all()
+            if not encuentros:
+                return []
+            tipos = {t.id: t for t in db.query(TipoEncuentroMedico).filter(
+                TipoEncuentroMedico.id.in_({e.tipo_id for e in encuentros if e.tipo_id})
+            )}
+            pacientes = dict(db.query(Usuario.id, Usuario.fhir_patient_id).filter(
+                Usuario.id.in_({e.paciente_id for e in encuentros if e.paciente_id})
+            ).all())
+            observaciones = defaultdict(list)
+            for obs in db.query(ObservacionClinica).filter(
+                ObservacionClinica.encuentro_id.in_([e.id for e in encuentros])
+            ).order_by(ObservacionClinica.id):
+                observaciones[obs.encuentro_id].append(obs)
+
+            por_id = {e.id: e for e in encuentros}
+            return [self._datos_encuentro(por_id[i], tipos.get(por_id[i].tipo_id), pacientes.get(por_id[i].paciente_id),
+                                          observaciones[i]) for i in encuentro_ids if i in por_id]
+
+    def _guardar_lote_encuentros(self, resultados: list, individuales: list):
+        # Los que no entraron en la transacción del lote pasan a entradas sync_encounter individuales.
+        # UPDATE por llave primaria con executemany: una llamada por tabla para todo el lote.
+        with SessionLocal() as db:
+            if resultados:
+                db.execute(update(EncuentroMedico), [
+                    {"id": item["id"], "fhir_encounter_id": fhir_ids["encounter"]} for item, fhir_ids in resultados
+                ])
+                observaciones = [
+                    {"id": obs_id, "fhir_observation_id": fhir_obs_id}
+                    for item, fhir_ids in resultados
+                    for obs_id, fhir_obs_id in zip(item["observacion_ids"], fhir_ids["observations"])
+                ]
+                if observaciones:
+                    db.execute(update(ObservacionClinica), observaciones)
+            db.add_all(OutboxFHIR(operacion="sync_encounter", entidad_id=encuentro_id, payload={}) for encuentro_id in individuales)
+            db.commit()
+
+    # ==================== OPERACIONES ====================
+    async def _sync_persona(self, entrada: dict, rol: str, columna: str, resource_type: str, update, upsert):
+        # payload["eliminar"] = "Patient/123": recurso del rol anterior que se borra junto con el upsert
+        eliminar = entrada["payload"].get("eliminar")
+        usuario = await asyncio.to_thread(self._cargar_usuario, entrada["entidad_id"])
+        if not usuario or usuario["rol"] != rol:
+            # El rol volvió a cambiar antes de sincronizar; el recurso anterior igual debe borrarse
+            if eliminar and not await fhir_service.delete(eliminar):
+                raise RuntimeError(f"HAPI rechazó la eliminación de {eliminar}")
+            return
+
+        if usuario[columna]:
+            if eliminar and not await fhir_service.delete(eliminar):
+                raise RuntimeError(f"HAPI rechazó la eliminación de {eliminar}")
+            if not await update(usuario[columna], usuario["data"]):
+                raise RuntimeError(f"HAPI rechazó la actualización del {resource_type}")
+            return
+
+        # Upsert condicional por identificador: idempotente ante reintentos y cambios de rol repetidos
+        fhir_id = await upsert(usuario["data"], eliminar)
+        if not fhir_id:
+            raise RuntimeError(f"HAPI rechazó el upsert del {resource_type}")
+        await asyncio.to_thread(self._guardar_fhir_id, entrada["entidad_id"], columna, fhir_id)
+
+    async def _sync_patient(self, entrada: dict):
+        await self._sync_persona(entrada, "Paciente", "fhir_patient_id", "Patient",
+                                 fhir_service.update_patient, fhir_service.upsert_patient)
+
+    async def _sync_patients(self, entrada: dict):
+        # Lote de la importación masiva: un Bundle batch con ifNoneExist por identificador, idempotente
+        # ante reintentos. Si HAPI rechaza el Bundle completo se reintenta entero con backoff.
+        pacientes = await asyncio.to_thread(self._cargar_pacientes, entrada["payload"].get("ids", []))
+        if not pacientes:
+            return
+        fhir_ids = await fhir_service.create_batch([fhir_service.build_patient(p["data"]) for p in pacientes])
+        creados = {p["id"]: fhir_id for p, fhir_id in zip(pacientes, fhir_ids) if fhir_id}
+        if not creados:
+            raise RuntimeError(f"HAPI rechazó el Bundle de {len(pacientes)} Patient")
+        await asyncio.to_thread(self._guardar_pacientes, creados, [p["id"] for p in pacientes if p["id"] not in creados])
+
+    async def _sync_practitioner(self, entrada: dict):
+        await self._sync_persona(entrada, "Medico", "fhir_practitioner_id", "Practitioner",
+                                 fhir_service.update_practitioner, fhir_service.upsert_practitioner)
+
+    async def _delete_patient(self, entrada: dict):
+        if not await fhir_service.delete_patient(entrada["payload"]["fhir_id"]):
+            raise RuntimeError("HAPI rechazó la eliminación del Patient")
+
+    async def _delete_practitioner(self, entrada: dict):
+        if not await fhir_service.delete_practitioner(entrada["payload"]["fhir_id"]):
+            raise RuntimeError("HAPI rechazó la eliminación del Practitioner")
+
+    async def _sync_encounter(self, entrada: dict):
+        datos = await asyncio.to_thread(self._cargar_encuentro, entrada["entidad_id"])
+        if not datos or datos["fhir_encounter_id"]:
+            return
+        if not datos["paciente_fhir_id"]:
+            raise SyncPendiente("El paciente aún no tiene Patient en HAPI")
+
+        fhir_ids = await fhir_service.create_encounter_bundle(
+            datos["encuentro"], datos["observaciones"], datos["paciente_fhir_id"], datos["medico_id"]
+        )
+        if not fhir_ids:
+            raise RuntimeError("HAPI rechazó la transacción del Encounter")
+        await asyncio.to_thread(self._guardar_encuentro_ids, entrada["entidad_id"], datos["observacion_ids"], fhir_ids)
+
+    async def _sync_encounters(self, entrada: dict):
+        # Lote de la ingesta (POST /encuentros/lote): una sola transacción FHIR para todos los encuentros
+        # cuyo paciente ya tiene Patient. Los demás, o todos si HAPI rechaza la transacción, siguen
+        # como sync_encounter individuales: un registro inválido no bloquea al resto.
+        encuentros = await asyncio.to_thread(self._cargar_encuentros, entrada["payload"].get("ids", []))
+        listos = [e for e in encuentros if e["paciente_fhir_id"]]
+        resultados = []
+        if listos:
+            fhir_ids = await fhir_service.create_encounters_bundle(listos)
+            if fhir_ids:
+                resultados = list(zip(listos, fhir_ids))
+        enviados = {item["id"] for item, _ in resultados}
+        await asyncio.to_thread(self._guardar_lote_encuentros, resultados,
+                                [e["id"] for e in encuentros if e["id"] not in enviados])
+
+
+fhir_sync_worker = FHIRSyncWorker()
@@ -0,0 +1,200 @@
+import csv
+import io
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+from pydantic import ValidationError
+from sqlalchemy import insert, select
+from app.config import settings
+from app.database import engine
+from app.models.models import OutboxFHIR, Rol, Sede, TipoDocumento, Usuario
+from app.schemas.schemas import UsuarioCreate
+from app.services.auth import get_password_hash
+
+# Importación masiva de pacientes (POST /usuarios/importar, python -m app.importar_pacientes):
+#   1. cada fila se valida con UsuarioCreate, contra los catálogos y los límites de las columnas
+#   2. las contraseñas se hashean con bcrypt en un pool de procesos, el lote siguiente mientras se carga el actual
+#   3. cada lote entra con COPY a una tabla temporal y de ahí a usuarios con ON CONFLICT DO NOTHING
+#   4. en la misma transacción se encola un sync_patients por cada Bundle batch de Patient para HAPI
+# Las filas rechazadas no detienen la importación: se devuelven con su línea y el motivo.
+
+FORMATOS = ("csv", "ndjson")
+COLUMNAS = ("nombres", "apellidos", "tipo_documento_id", "numero_documento", "fecha_nacimiento", "genero",
+            "telefono", "email", "sede_registro_id", "rol_id", "password_hash")
+GENEROS = ("Masculino", "Femenino")
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+def _pool_hash() -> ProcessPoolExecutor:
+    # spawn: los procesos hijos no heredan el event loop ni las conexiones abiertas del proceso web
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=settings.IMPORTACION_HASH_WORKERS or os.cpu_count(),
+                                    mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+def cerrar_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+def formato_de(nombre: Optional[str]) -> str:
+    return "csv" if (nombre or "").lower().endswith(".csv") else "ndjson"
+
+# ==================== LECTURA ====================
+def leer_filas(contenido: str, formato: str) -> Iterator[Tuple[int, Optional[dict], Optional[str]]]:
+    # (línea, fila, error de formato); en CSV la línea 1 es el encabezado
+    if formato == "csv":
+        for linea, fila in enumerate(csv.DictReader(io.StringIO(contenido)), start=2):
+            yield linea, {k.strip(): (v.strip() or None) if isinstance(v, str) else v for k, v in fila.items() if k}, None
+        return
+    for linea, texto in enumerate(contenido.splitlines(), start=1):
+        if not texto.strip():
+            continue
+        try:
+            fila = json.loads(texto)
+        except ValueError as e:
+            yield linea, None, f"JSON inválido: {e}"
+            continue
+        yield (linea, fila, None) if isinstance(fila, dict) else (linea, None, "Se esperaba un objeto JSON")
+
+# ==================== VALIDACIÓN ====================
+def _catalogos() -> dict:
+    with engine.connect() as conexion:
+        return {
+            "paciente": conexion.execute(select(Rol.id).where(Rol.nombre == "Paciente")).scalar_one(),
+            "tipos_documento": set(conexion.execute(select(TipoDocumento.id)).scalars()),
+            "sedes": set(conexion.execute(select(Sede.id).where(Sede.activo == True)).scalars())
+        }
+
+def _longitudes() -> dict:
+    return {c.name: c.type.length for c in Usuario.__table__.columns if getattr(c.type, "length", None)}
+
+def validar(filas, sede_id: Optional[int], catalogos: dict, errores: list) -> Iterator[Tuple[int, UsuarioCreate]]:
+    # Todas las filas se importan como pacientes; sede_id aplica a las que no traen sede_registro_id
+    longitudes = _longitudes()
+    vistos = set()
+    for linea, fila, error in filas:
+        documento = fila.get("numero_documento") if fila else None
+        if error:
+            errores.append({"linea": linea, "numero_documento": documento, "errores": [error]})
+            continue
+
+        fila["rol_id"] = catalogos["paciente"]
+        if not fila.get("sede_registro_id") and sede_id:
+            fila["sede_registro_id"] = sede_id
+        try:
+            usuario = UsuarioCreate(**fila)
+        except ValidationError as e:
+            errores.append({"linea": linea, "numero_documento": documento, "errores": [
+                f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors()
+            ]})
+            continue
+
+        problemas = []
+        if usuario.tipo_documento_id not in catalogos["tipos_documento"]:
+            problemas.append(f"tipo_documento_id: {usuario.tipo_documento_id} no existe")
+        if usuario.sede_registro_id not in catalogos["sedes"]:
+            problemas.append(f"sede_registro_id: {usuario.sede_registro_id} no existe o está inactiva")
+        if usuario.genero not in GENEROS:
+            problemas.append(f"genero: debe ser {' o '.join(GENEROS)}")
+        for campo, maximo in longitudes.items():
+            valor = getattr(usuario, campo, None)
+            if isinstance(valor, str) and len(valor) > maximo:
+                problemas.append(f"{campo}: máximo {maximo} caracteres")
+        if usuario.numero_documento in vistos:
+            problemas.append("Documento repetido en el archivo")
+        if problemas:
+            errores.append({"linea": linea, "numero_documento": usuario.numero_documento, "errores": problemas})
+            continue
+
+        vistos.add(usuario.numero_documento)
+        yield linea, usuario
+
+def _lotes(validas, tamano: int) -> Iterator[List[Tuple[int, UsuarioCreate]]]:
+    lote = []
+    for item in validas:
+        lote.append(item)
+        if len(lote) >= tamano:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+# ==================== CARGA ====================
+def _cargar_lote(lote: list, hashes, errores: list) -> int:
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    for (linea, u), password_hash in zip(lote, hashes):
+        escritor.writerow([linea, u.nombres, u.apellidos, u.tipo_documento_id, u.numero_documento, u.fecha_nacimiento,
+                           u.genero, u.telefono, u.email, u.sede_registro_id, u.rol_id, password_hash])
+    buffer.seek(0)
+
+    with engine.begin() as conexion:
+        cursor = conexion.connection.cursor()
+        cursor.execute(f"""
+            CREATE TEMP TABLE importacion_usuarios ON COMMIT DROP AS
+            SELECT 0 AS linea, {', '.join(COLUMNAS)} FROM usuarios WITH NO DATA
+        """)
+        # CSV de Python: los None quedan como campo vacío sin comillas, que COPY lee como NULL
+        cursor.copy_expert(f"COPY importacion_usuarios (linea, {', '.join(COLUMNAS)}) FROM STDIN WITH (FORMAT csv)", buffer)
+        cursor.execute(f"""
+            INSERT INTO usuarios ({', '.join(COLUMNAS)})
+            SELECT {', '.join(COLUMNAS)} FROM importacion_usuarios ORDER BY linea
+            ON CONFLICT (numero_documento) DO NOTHING
+            RETURNING id, numero_documento
+        """)
+        creados = dict((documento, usuario_id) for usuario_id, documento in cursor.fetchall())
+
+        ids = [creados[u.numero_documento] for _, u in lote if u.numero_documento in creados]
+        tamano = settings.IMPORTACION_BUNDLE_SIZE
+        if ids:
+            conexion.execute(insert(OutboxFHIR), [
+                {"operacion": "sync_patients", "payload": {"ids": ids[i:i + tamano]}}
+                for i in range(0, len(ids), tamano)
+            ])
+
+    for linea, u in lote:
+        if u.numero_documento not in creados:
+            errores.append({"linea": linea, "numero_documento": u.numero_documento,
+                            "errores": ["El documento ya está registrado"]})
+    return len(creados)
+
+def importar(contenido: str, formato: str, sede_id: Optional[int] = None) -> dict:
+    inicio = time.monotonic()
+    errores: list = []
+    catalogos = _catalogos()
+    leidas = {"filas": 0}
+
+    def contar(filas):
+        for fila in filas:
+            leidas["filas"] += 1
+            yield fila
+
+    validas = validar(contar(leer_filas(contenido, formato)), sede_id, catalogos, errores)
+
+    # El pool hashea el lote siguiente mientras el actual se copia a la base
+    pool = _pool_hash()
+    creados, total_validas, pendiente = 0, 0, None
+    for lote in _lotes(validas, settings.IMPORTACION_BATCH_SIZE):
+        hashes = pool.map(get_password_hash, [u.password for _, u in lote], chunksize=32)
+        if pendiente:
+            creados += _cargar_lote(*pendiente, errores)
+        pendiente = (lote, hashes)
+        total_validas += len(lote)
+        print(f"[IMPORTACION] {total_validas} filas válidas, {creados} pacientes creados")
+    if pendiente:
+        creados += _cargar_lote(*pendiente, errores)
+
+    errores.sort(key=lambda e: e["linea"])
+    return {
+        "procesadas": leidas["filas"],
+        "creados": creados,
+        "rechazados": len(errores),
+        "segundos": round(time.monotonic() - inicio, 2),
+        "errores": errores
+    }
@@ -0,0 +1,114 @@
+import asyncio
+from datetime import date, datetime
+from typing import List
+from fastapi import HTTPException
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import settings
+from app.models.models import EncuentroMedico, ObservacionClinica, OutboxFHIR, Rol, Sede, TipoEncuentroMedico, Usuario
+from app.schemas.schemas import EncuentroLote
+from app.services.mediciones import parsear
+from app.services.particiones import asegurar
+
+# Ingesta de encuentros por lotes (POST /encuentros/lote): migración de historias heredadas y equipos.
+# Un lote es una transacción: un INSERT ... RETURNING para los encuentros, uno para las observaciones
+# y uno para las entradas del outbox. Si una fila es inválida no se guarda nada y se devuelve el
+# error de cada una; así el lote se puede corregir y reenviar completo.
+# La sincronización con HAPI corre aparte: cada sync_encounters del outbox es una transacción FHIR.
+
+async def _ids_validos(db: AsyncSession, columna, ids: set, *filtros) -> set:
+    if not ids:
+        return set()
+    return set((await db.scalars(select(columna).where(columna.in_(ids), *filtros))).all())
+
+def _rol(nombre: str):
+    return select(Rol.id).where(Rol.nombre == nombre).scalar_subquery()
+
+async def validar(db: AsyncSession, items: List[EncuentroLote], usuario: Usuario) -> list:
+    # Devuelve el médico de cada encuentro; los médicos sólo pueden cargar encuentros propios
+    es_medico = usuario.rol.nombre == "Medico"
+    medicos = [usuario.id if es_medico else item.medico_id for item in items]
+
+    pacientes = await _ids_validos(db, Usuario.id, {i.paciente_id for i in items}, Usuario.rol_id == _rol("Paciente"))
+    medicos_validos = await _ids_validos(db, Usuario.id, {m for m in medicos if m}, Usuario.rol_id == _rol("Medico"))
+    tipos = await _ids_validos(db, TipoEncuentroMedico.id, {i.tipo_id for i in items})
+    sedes = await _ids_validos(db, Sede.id, {i.sede_id for i in items})
+
+    ahora = datetime.now()
+    errores = []
+    for indice, (item, medico_id) in enumerate(zip(items, medicos)):
+        problemas = []
+        if item.paciente_id not in pacientes:
+            problemas.append(f"paciente_id: {item.paciente_id} no es un paciente")
+        if not medico_id:
+            problemas.append("medico_id: requerido")
+        elif medico_id not in medicos_validos:
+            problemas.append(f"medico_id: {medico_id} no es un médico")
+        if item.tipo_id not in tipos:
+            problemas.append(f"tipo_id: {item.tipo_id} no existe")
+        if item.sede_id not in sedes:
+            problemas.append(f"sede_id: {item.sede_id} no existe")
+        if item.fecha and item.fecha > ahora:
+            problemas.append("fecha: no puede ser futura")
+        if problemas:
+            errores.append({"indice": indice, "errores": problemas})
+    if errores:
+        raise HTTPException(status_code=400, detail=errores)
+    return medicos
+
+async def ingerir(db: AsyncSession, items: List[EncuentroLote], usuario: Usuario) -> dict:
+    if not items:
+        return {"encuentros": [], "observaciones": 0}
+    if len(items) > settings.ENCUENTROS_LOTE_MAX:
+        raise HTTPException(status_code=413, detail=f"Máximo {settings.ENCUENTROS_LOTE_MAX} encuentros por lote")
+    medicos = await validar(db, items, usuario)
+
+    ahora = datetime.now()
+    fechas = [item.fecha or ahora for item in items]
+    meses = {date(f.year, f.month, 1) for f in fechas}
+    meses.update(date(o.fecha.year, o.fecha.month, 1) for item in items for o in item.observaciones or [] if o.fecha)
+    hoy = date.today().replace(day=1)
+    if any(m < hoy for m in meses):
+        await asyncio.to_thread(asegurar, [m for m in meses if m < hoy])
+
+    # sort_by_parameter_order: los ids vuelven en el orden de las filas enviadas
+    encuentro_ids = (await db.scalars(
+        insert(EncuentroMedico).returning(EncuentroMedico.id, sort_by_parameter_order=True),
+        [{
+            "fecha": fecha,
+            "tipo_id": item.tipo_id,
+            "sede_id": item.sede_id,
+            "paciente_id": item.paciente_id,
+            "medico_id": medico_id,
+            "diagnostico": item.diagnostico,
+            "diagnostico_codigo_icd10": item.diagnostico_codigo_icd10,
+            "diagnostico_codigo_snomed": item.diagnostico_codigo_snomed
+        } for item, fecha, medico_id in zip(items, fechas, medicos)]
+    )).all()
+
+    observaciones = [{
+        "fecha": obs.fecha or fecha,
+        "encuentro_id": encuentro_id,
+        "descripcion": obs.descripcion,
+        "valor": obs.valor,
+        "unidad": obs.unidad,
+        "codigo_loinc": obs.codigo_loinc,
+        "interpretacion": obs.interpretacion,
+        "sede_id": item.sede_id,
+        **parsear(obs.valor, obs.unidad, obs.codigo_loinc, obs.descripcion).columnas()
+    } for item, fecha, encuentro_id in zip(items, fechas, encuentro_ids) for obs in item.observaciones or []]
+    if observaciones:
+        await db.execute(insert(ObservacionClinica), observaciones)
+
+    tamano = settings.ENCUENTROS_LOTE_BUNDLE_SIZE
+    await db.execute(insert(OutboxFHIR), [
+        {"operacion": "sync_encounters", "payload": {"ids": list(encuentro_ids[i:i + tamano])}}
+        for i in range(0, len(encuentro_ids), tamano)
+    ])
+    await db.commit()
+
+    return {
+        "encuentros": [{"indice": i, "id": encuentro_id, "fecha": fecha.isoformat()}
+                       for i, (encuentro_id, fecha) in enumerate(zip(encuentro_ids, fechas))],
+        "observaciones": len(observaciones)
+    }
@@ -0,0 +1,148 @@
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Iterable, Optional
+
+UCUM_SYSTEM = "http://unitsofmeasure.org"
+LOINC_SYSTEM = "http://loinc.org"
+
+# Panel de presión arterial y sus componentes
+LOINC_PRESION_ARTERIAL = ("85354-9", "Blood pressure panel with all children optional")
+LOINC_SISTOLICA = ("8480-6", "Systolic blood pressure")
+LOINC_DIASTOLICA = ("8462-4", "Diastolic blood pressure")
+
+# Unidades como las escriben los médicos (minúsculas, sin espacios) -> código UCUM
+UNIDADES = {
+    "mg/dl": "mg/dL", "mgdl": "mg/dL",
+    "mmol/l": "mmol/L", "mmoll": "mmol/L",
+    "umol/l": "umol/L", "µmol/l": "umol/L",
+    "g/dl": "g/dL", "mg/l": "mg/L", "u/l": "U/L", "ui/l": "U/L",
+    "°c": "Cel", "ºc": "Cel", "c": "Cel", "cel": "Cel", "celsius": "Cel", "gradoscelsius": "Cel",
+    "°f": "[degF]", "ºf": "[degF]", "f": "[degF]", "[degf]": "[degF]", "fahrenheit": "[degF]",
+    "kg": "kg", "kgs": "kg", "kilos": "kg", "kilogramos": "kg",
+    "g": "g", "gr": "g", "gramos": "g",
+    "lb": "[lb_av]", "lbs": "[lb_av]", "libras": "[lb_av]", "[lb_av]": "[lb_av]",
+    "cm": "cm", "m": "m", "mts": "m", "metros": "m",
+    "mmhg": "mm[Hg]", "mm[hg]": "mm[Hg]",
+    "lpm": "/min", "bpm": "/min", "rpm": "/min", "/min": "/min", "latidos/min": "/min", "resp/min": "/min",
+    "%": "%",
+    "kg/m2": "kg/m2", "kg/m²": "kg/m2",
+}
+
+# Conversiones a la unidad canónica como transformación afín: normalizado = valor * factor + desplazamiento
+CONVERSIONES = {
+    "[degF]": ("Cel", 5 / 9, -160 / 9),
+    "[lb_av]": ("kg", 0.45359237, 0.0),
+    "g": ("kg", 0.001, 0.0),
+    "m": ("cm", 100.0, 0.0),
+}
+
+# mg/dL <-> mmol/L depende del analito: mmol/L = mg/dL * 10 / masa molar
+ANALITOS = {
+    "glucosa": {"loinc": {"2339-0", "2345-7", "15074-8", "41653-7"}, "palabras": ("glucosa", "glicemia", "glucemia"), "masa_molar": 180.16},
+    "colesterol": {"loinc": {"2093-3", "2085-9", "13457-7", "18262-6"}, "palabras": ("colesterol", "hdl", "ldl"), "masa_molar": 386.65},
+    "trigliceridos": {"loinc": {"2571-8"}, "palabras": ("triglic",), "masa_molar": 885.7},
+}
+
+_NUMERO = re.compile(r"^\s*(<=|>=|<|>)?\s*([-+]?(?:\d+(?:[.,]\d+)?|[.,]\d+))\s*(.*?)\s*$")
+_PRESION = re.compile(r"^\s*(\d{2,3})\s*/\s*(\d{2,3})\s*(.*?)\s*$")
+
+@dataclass
+class Medicion:
+    valor: Optional[float] = None
+    comparador: Optional[str] = None
+    unidad: Optional[str] = None
+    unidad_ucum: Optional[str] = None
+    valor_normalizado: Optional[float] = None
+    unidad_normalizada: Optional[str] = None
+    sistolica: Optional[float] = None
+    diastolica: Optional[float] = None
+
+    @property
+    def es_presion(self) -> bool:
+        return self.sistolica is not None
+
+    def columnas(self) -> dict:
+        # Valores para las columnas tipadas de observaciones_clinicas
+        return {
+            "valor_numerico": self.valor,
+            "valor_normalizado": self.valor_normalizado,
+            "unidad_normalizada": self.unidad_normalizada,
+            "presion_sistolica": self.sistolica,
+            "presion_diastolica": self.diastolica,
+        }
+
+def ucum(unidad: Optional[str]) -> Optional[str]:
+    if not unidad:
+        return None
+    return UNIDADES.get(unidad.strip().lower().replace(" ", ""))
+
+def _analito(codigo_loinc: Optional[str], descripcion: Optional[str]) -> Optional[str]:
+    texto = (descripcion or "").lower()
+    for nombre, analito in ANALITOS.items():
+        if codigo_loinc in analito["loinc"] or any(p in texto for p in analito["palabras"]):
+            return nombre
+    return None
+
+@lru_cache(maxsize=1024)
+def conversion(codigo: str, analito: Optional[str]) -> tuple:
+    # (unidad canónica, factor, desplazamiento) para una unidad UCUM ya reconocida
+    if codigo in CONVERSIONES:
+        return CONVERSIONES[codigo]
+    if codigo == "mg/dL" and analito:
+        return "mmol/L", 10 / ANALITOS[analito]["masa_molar"], 0.0
+    return codigo, 1.0, 0.0
+
+def _numero(texto: str) -> float:
+    return float(texto.replace(",", "."))
+
+def parsear(valor: Optional[str], unidad: Optional[str] = None, codigo_loinc: Optional[str] = None,
+            descripcion: Optional[str] = None) -> Medicion:
+    # Interpreta el texto libre de valor/unidad. Si no es una medición numérica reconocible,
+    # devuelve una Medicion vacía y el valor se conserva sólo como texto.
+    if not valor:
+        return Medicion()
+    unidad = (unidad or "").strip() or None
+
+    presion = _PRESION.match(valor)
+    if presion:
+        unidad_texto = unidad or presion.group(3) or None
+        if unidad_texto is None or ucum(unidad_texto) == "mm[Hg]":
+            return Medicion(
+                unidad=unidad_texto or "mmHg",
+                unidad_ucum="mm[Hg]",
+                unidad_normalizada="mm[Hg]",
+                sistolica=float(presion.group(1)),
+                diastolica=float(presion.group(2))
+            )
+        return Medicion()
+
+    numero = _NUMERO.match(valor)
+    if not numero:
+        return Medicion()
+    comparador, cifra, resto = numero.groups()
+    # Texto tras el número: sólo se acepta si es una unidad reconocida ("98.6 F", "70kg")
+    if resto:
+        if ucum(resto) is None or (unidad and ucum(unidad) != ucum(resto)):
+            return Medicion()
+        unidad = unidad or resto
+
+    medicion = Medicion(valor=_numero(cifra), comparador=comparador, unidad=unidad, unidad_ucum=ucum(unidad))
+    if unidad is None:
+        medicion.valor_normalizado = medicion.valor
+    elif medicion.unidad_ucum:
+        canonica, factor, desplazamiento = conversion(medicion.unidad_ucum, _analito(codigo_loinc, descripcion))
+        medicion.valor_normalizado = round(medicion.valor * factor + desplazamiento, 6)
+        medicion.unidad_normalizada = canonica
+    # Con una unidad desconocida no se normaliza: comparar valores en unidades distintas daría rangos falsos
+    return medicion
+
+def parsear_lote(filas: Iterable) -> list:
+    # Para el backfill: cada fila trae id, valor, unidad, codigo_loinc y descripcion.
+    # Devuelve los cambios por id, sólo de las filas que resultaron numéricas.
+    cambios = []
+    for fila in filas:
+        medicion = parsear(fila.valor, fila.unidad, fila.codigo_loinc, fila.descripcion)
+        if medicion.valor is not None or medicion.es_presion:
+            cambios.append({"id": fila.id, **medicion.columnas()})
+    return cambios
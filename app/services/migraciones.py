@@ -0,0 +1,203 @@
+import hashlib
+import os
+import re
+from typing import List, Optional
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+from app.database import Base, engine as engine_app
+
+# Migraciones versionadas del esquema: postgres/migraciones/NNN_descripcion.sql, en orden de NNN.
+# schema_migraciones registra cuáles se aplicaron y con qué checksum; init.sql ya la crea con las
+# versiones que incluye, así una base nueva no vuelve a correrlas.
+#   - un archivo sin BEGIN/COMMIT propios ni CONCURRENTLY se aplica en una sola transacción junto con
+#     su registro en schema_migraciones
+#   - los demás se ejecutan sentencia por sentencia en autocommit (CREATE INDEX CONCURRENTLY no admite
+#     transacción) y se registran al terminar: si fallan a mitad, deben poder volver a correrse
+DIRECTORIO = os.path.join(os.path.dirname(__file__), "..", "..", "postgres", "migraciones")
+ARCHIVO = re.compile(r"^(\d{3})_[\w-]+\.sql$")
+LOCK_MIGRACIONES = 740025
+
+TABLA = """
+    CREATE TABLE IF NOT EXISTS schema_migraciones (
+        version VARCHAR(10) PRIMARY KEY,
+        nombre VARCHAR(200) NOT NULL,
+        checksum VARCHAR(64),
+        aplicada_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+# ==================== ARCHIVOS ====================
+def disponibles(directorio: str = DIRECTORIO) -> List[dict]:
+    migraciones = []
+    for nombre in sorted(os.listdir(directorio)):
+        coincidencia = ARCHIVO.match(nombre)
+        if coincidencia:
+            with open(os.path.join(directorio, nombre), encoding="utf-8") as f:
+                contenido = f.read()
+            migraciones.append({
+                "version": coincidencia.group(1),
+                "nombre": nombre,
+                "sql": contenido,
+                "checksum": hashlib.sha256(contenido.encode()).hexdigest()
+            })
+    return migraciones
+
+def dividir_sentencias(sql: str) -> List[str]:
+    # Separa por ';' fuera de comillas, identificadores entre comillas, cuerpos $tag$...$tag$ y comentarios
+    sentencias, actual, i = [], [], 0
+    while i < len(sql):
+        c = sql[i]
+        if sql.startswith("--", i):
+            fin = sql.find("\n", i)
+            i = len(sql) if fin == -1 else fin
+            continue
+        if sql.startswith("/*", i):
+            fin = sql.find("*/", i + 2)
+            i = len(sql) if fin == -1 else fin + 2
+            continue
+        if c in ("'", '"'):
+            fin = i + 1
+            while fin < len(sql):
+                if sql[fin] == c and sql.startswith(c * 2, fin):
+                    fin += 2
+                elif sql[fin] == c:
+                    break
+                else:
+                    fin += 1
+            actual.append(sql[i:fin + 1])
+            i = fin + 1
+            continue
+        dolar = re.match(r"\$[A-Za-z_]*\$", sql[i:]) if c == "$" else None
+        if dolar:
+            etiqueta = dolar.group(0)
+            fin = sql.find(etiqueta, i + len(etiqueta))
+            fin = len(sql) if fin == -1 else fin + len(etiqueta)
+            actual.append(sql[i:fin])
+            i = fin
+            continue
+        if c == ";":
+            sentencia = "".join(actual).strip()
+            if sentencia:
+                sentencias.append(sentencia)
+            actual = []
+        else:
+            actual.append(c)
+        i += 1
+    sentencia = "".join(actual).strip()
+    if sentencia:
+        sentencias.append(sentencia)
+    return sentencias
+
+def _ejecutar(conexion, sentencia: str):
+    # Cursor del driver sin parámetros: los '%' de format() llegan tal cual
+    cursor = conexion.connection.cursor()
+    try:
+        cursor.execute(sentencia)
+    finally:
+        cursor.close()
+
+def ejecutar_script(engine: Engine, sql: str):
+    # Sentencia por sentencia en autocommit (p. ej. init.sql sobre una base vacía)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conexion:
+        for sentencia in dividir_sentencias(sql):
+            _ejecutar(conexion, sentencia)
+
+def _transaccional(sentencias: List[str]) -> bool:
+    return not any(
+        re.match(r"(BEGIN|COMMIT|ROLLBACK|START\s+TRANSACTION)\b", s, re.IGNORECASE) or re.search(r"\bCONCURRENTLY\b", s, re.IGNORECASE)
+        for s in sentencias
+    )
+
+# ==================== ESTADO ====================
+def aplicadas(engine: Engine = engine_app) -> dict:
+    with engine.begin() as conexion:
+        conexion.execute(text(TABLA))
+        return {f.version: dict(f._mapping) for f in conexion.execute(text(
+            "SELECT version, nombre, checksum, aplicada_at FROM schema_migraciones ORDER BY version"
+        ))}
+
+def estado(engine: Engine = engine_app) -> List[dict]:
+    registradas = aplicadas(engine)
+    filas = []
+    for m in disponibles():
+        registro = registradas.get(m["version"])
+        if registro is None:
+            situacion = "pendiente"
+        elif registro["checksum"] and registro["checksum"] != m["checksum"]:
+            situacion = "modificada"
+        else:
+            situacion = "aplicada"
+        filas.append({"version": m["version"], "nombre": m["nombre"], "estado": situacion,
+                      "aplicada_at": registro["aplicada_at"] if registro else None})
+    return filas
+
+# ==================== APLICACIÓN ====================
+def _registrar(conexion, migracion: dict):
+    conexion.execute(text("""
+        INSERT INTO schema_migraciones (version, nombre, checksum) VALUES (:version, :nombre, :checksum)
+        ON CONFLICT (version) DO UPDATE SET nombre = EXCLUDED.nombre, checksum = EXCLUDED.checksum,
+                                            aplicada_at = CURRENT_TIMESTAMP
+    """), {k: migracion[k] for k in ("version", "nombre", "checksum")})
+
+def aplicar(hasta: Optional[str] = None, engine: Engine = engine_app) -> List[str]:
+    # Aplica en orden las pendientes hasta la versión indicada; un advisory lock evita que dos
+    # despliegues las corran a la vez
+    aplicadas_ahora = []
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as control:
+        control.execute(text("SELECT pg_advisory_lock(:lock)"), {"lock": LOCK_MIGRACIONES})
+        try:
+            registradas = aplicadas(engine)
+            for m in disponibles():
+                if hasta and m["version"] > hasta:
+                    break
+                if m["version"] in registradas:
+                    if registradas[m["version"]]["checksum"] not in (None, m["checksum"]):
+                        print(f"[MIGRACIONES] {m['nombre']} cambió después de aplicada; no se vuelve a correr")
+                    continue
+
+                print(f"[MIGRACIONES] Aplicando {m['nombre']}...")
+                sentencias = dividir_sentencias(m["sql"])
+                if _transaccional(sentencias):
+                    with engine.begin() as conexion:
+                        for sentencia in sentencias:
+                            _ejecutar(conexion, sentencia)
+                        _registrar(conexion, m)
+                else:
+                    ejecutar_script(engine, m["sql"])
+                    with engine.begin() as conexion:
+                        _registrar(conexion, m)
+                aplicadas_ahora.append(m["nombre"])
+        finally:
+            control.execute(text("SELECT pg_advisory_unlock(:lock)"), {"lock": LOCK_MIGRACIONES})
+    return aplicadas_ahora
+
+def marcar(version: str, engine: Engine = engine_app) -> List[str]:
+    # Línea base de una base creada antes de las migraciones versionadas: registra como aplicadas
+    # las versiones hasta `version` sin ejecutarlas
+    marcadas = []
+    aplicadas(engine)
+    with engine.begin() as conexion:
+        for m in disponibles():
+            if m["version"] > version:
+                break
+            _registrar(conexion, m)
+            marcadas.append(m["nombre"])
+    return marcadas
+
+# ==================== VERIFICACIÓN ====================
+def diferencias(engine: Engine = engine_app) -> List[str]:
+    # Compara las tablas y columnas de app/models/models.py con las de la base
+    inspector = inspect(engine)
+    tablas = set(inspector.get_table_names())
+    problemas = []
+    for tabla in Base.metadata.sorted_tables:
+        if tabla.name not in tablas:
+            problemas.append(f"Falta la tabla {tabla.name}")
+            continue
+        columnas = {c["name"]: c for c in inspector.get_columns(tabla.name)}
+        for columna in tabla.columns:
+            if columna.name not in columnas:
+                problemas.append(f"Falta la columna {tabla.name}.{columna.name}")
+            elif not columna.primary_key and columna.nullable is False and columnas[columna.name]["nullable"]:
+                problemas.append(f"{tabla.name}.{columna.name} admite NULL en la base y no en el modelo")
+    return problemas
@@ -0,0 +1,32 @@
+import base64
+import binascii
+from datetime import datetime
+from typing import Callable, List
+from fastapi import HTTPException
+
+# Paginación por keyset de los listados (GET /encuentros/, /usuarios/, /sedes/, /roles/).
+# El cursor es la clave de orden de la última fila devuelta, codificada en base64 para que el cliente
+# la trate como opaca; cada página es un rango del índice y cuesta lo mismo sin importar su posición.
+
+def codificar_cursor(*valores) -> str:
+    texto = "|".join(v.isoformat() if isinstance(v, datetime) else str(v) for v in valores)
+    return base64.urlsafe_b64encode(texto.encode()).decode().rstrip("=")
+
+def decodificar_cursor(cursor: str, *tipos) -> tuple:
+    # tipos: datetime o int por cada componente de la clave, en el orden en que se codificó
+    try:
+        texto = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        partes = texto.split("|")
+        if len(partes) != len(tipos):
+            raise ValueError(texto)
+        return tuple(datetime.fromisoformat(p) if t is datetime else t(p) for p, t in zip(partes, tipos))
+    except (ValueError, UnicodeDecodeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+def pagina(filas: List, limite: int, clave: Callable) -> dict:
+    # filas trae hasta limite + 1 elementos: el sobrante sólo indica que hay otra página
+    siguiente = None
+    if len(filas) > limite:
+        filas = filas[:limite]
+        siguiente = codificar_cursor(*clave(filas[-1]))
+    return {"resultados": filas, "siguiente": siguiente}
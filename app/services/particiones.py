@@ -0,0 +1,106 @@
+import asyncio
+from datetime import date
+from typing import List, Optional
+from sqlalchemy import text
+from app.config import settings
+from app.database import engine
+
+# Mantenimiento de las particiones mensuales de encuentros_medicos y observaciones_clinicas.
+# Las funciones SQL (particion_mensual, crear_particiones, archivar_particion) están en init.sql;
+# aquí sólo se invocan y se listan los meses existentes.
+TABLAS_PARTICIONADAS = ("encuentros_medicos", "observaciones_clinicas")
+
+def crear(meses_adelante: int = settings.PARTICIONES_MESES_ADELANTE) -> Optional[int]:
+    # Devuelve cuántas particiones creó, o None si otro proceso ya las está creando
+    with engine.begin() as conexion:
+        return conexion.execute(text("SELECT crear_particiones(:meses)"), {"meses": meses_adelante}).scalar()
+
+def asegurar(meses: List[date]) -> int:
+    # Crea ya las particiones de meses pasados que van a recibir filas (ingesta de historias heredadas),
+    # en vez de dejarlas en la partición por defecto hasta la siguiente pasada del mantenimiento.
+    # Los meses archivados no se recrean: sus filas nuevas quedan en la partición por defecto.
+    with engine.begin() as conexion:
+        faltan = [(tabla, mes) for tabla in TABLAS_PARTICIONADAS for mes in sorted(set(meses)) if conexion.execute(
+            text("SELECT to_regclass(:nombre) IS NULL AND to_regclass('archivo.' || :nombre) IS NULL"),
+            {"nombre": f"{tabla}_{mes:%Y_%m}"}
+        ).scalar()]
+        if not faltan:
+            return 0
+        # El mismo lock que crear_particiones: no compite con el mantenimiento
+        conexion.execute(text("SELECT pg_advisory_xact_lock(740013)"))
+        return sum(1 for tabla, mes in faltan if conexion.execute(
+            text("SELECT particion_mensual(:tabla, :mes)"), {"tabla": tabla, "mes": mes}
+        ).scalar())
+
+def listar() -> List[dict]:
+    # Particiones calientes y archivadas con su rango y tamaño en disco
+    with engine.connect() as conexion:
+        filas = conexion.execute(text("""
+            SELECT padre.relname AS tabla, ns.nspname AS esquema, hija.relname AS particion,
+                   pg_get_expr(hija.relpartbound, hija.oid) AS rango,
+                   pg_total_relation_size(hija.oid) AS bytes
+            FROM pg_inherits i
+            JOIN pg_class padre ON padre.oid = i.inhparent
+            JOIN pg_class hija ON hija.oid = i.inhrelid
+            JOIN pg_namespace ns ON ns.oid = hija.relnamespace
+            WHERE padre.relname = ANY(:tablas)
+            ORDER BY padre.relname, ns.nspname, hija.relname
+        """), {"tablas": list(TABLAS_PARTICIONADAS)}).mappings().all()
+    return [dict(f) for f in filas]
+
+def meses_calientes(tabla: str) -> List[date]:
+    return sorted(
+        date(int(f["particion"][-7:-3]), int(f["particion"][-2:]), 1)
+        for f in listar()
+        if f["tabla"] == tabla and f["esquema"] == "public" and not f["particion"].endswith("_default")
+    )
+
+def archivar(tabla: str, mes: date, espacio: Optional[str] = None) -> Optional[str]:
+    # Desprende el mes de la tabla caliente y lo cuelga de archivo.<tabla>. DETACH toma un lock
+    # exclusivo breve sobre la tabla madre; con espacio la partición se reescribe en ese tablespace.
+    with engine.begin() as conexion:
+        archivada = conexion.execute(
+            text("SELECT archivar_particion(:tabla, :mes, :espacio)"),
+            {"tabla": tabla, "mes": mes, "espacio": espacio}
+        ).scalar()
+    if archivada:
+        # Ya no recibe escrituras: congelarla evita que vacuum vuelva a recorrerla
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conexion:
+            conexion.execute(text(f"VACUUM (FREEZE, ANALYZE) {archivada}"))
+    return archivada
+
+class MantenimientoParticiones:
+    # Crea por adelantado las particiones de los próximos meses; lo que llegue a la partición por
+    # defecto (fechas pasadas traídas de HAPI, p. ej.) se mueve a su mes en la siguiente pasada.
+    def __init__(self):
+        self.interval = settings.PARTICIONES_INTERVAL
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+
+    async def start(self):
+        if self._task is None and self.interval > 0:
+            self._stopping.clear()
+            self._task = asyncio.create_task(self.run())
+            print("[PARTICIONES] Mantenimiento iniciado")
+
+    async def stop(self):
+        if self._task is not None:
+            self._stopping.set()
+            await self._task
+            self._task = None
+            print("[PARTICIONES] Mantenimiento detenido")
+
+    async def run(self):
+        while not self._stopping.is_set():
+            try:
+                creadas = await asyncio.to_thread(crear)
+                if creadas:
+                    print(f"[PARTICIONES] {creadas} particiones creadas")
+            except Exception as e:
+                print(f"[PARTICIONES] Error creando particiones: {type(e).__name__}: {e}")
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+mantenimiento_particiones = MantenimientoParticiones()
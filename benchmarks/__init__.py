@@ -0,0 +1,8 @@
+import os
+
+# Los microbenchmarks no abren conexiones: HAPI y PostgreSQL se reemplazan por datos sintéticos en memoria
+# (benchmarks/planes.py sí: corre contra la base de prueba que recibe en --database-url).
+# Settings exige estas variables, así que se les da un valor ficticio si no vienen del entorno.
+os.environ.setdefault("DATABASE_URL", "postgresql://benchmark@localhost/benchmark")
+os.environ.setdefault("FHIR_SERVER_URL", "http://localhost:8080/fhir")
+os.environ.setdefault("SECRET_KEY", "benchmark")
@@ -0,0 +1,154 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from benchmarks.casos import CASOS
+
+# Microbenchmarks de las funciones calientes: python -m benchmarks [--casos pdf_historia] [--tamanos 1,50]
+#   --guardar   escribe los resultados como nueva línea base
+#   sin él      compara contra la línea base y sale con código 1 si algo empeoró más que --umbral
+# El tiempo es el mínimo de varias repeticiones (el menos afectado por ruido); la memoria es el pico
+# de asignaciones Python medido con tracemalloc en una corrida aparte, para no inflar el tiempo.
+
+LINEA_BASE = os.path.join(os.path.dirname(__file__), "linea_base.json")
+TAMANOS = (1, 50, 500, 5000)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Microbenchmarks con detección de regresiones")
+    parser.add_argument("--casos", default=",".join(CASOS), help=f"Casos a correr ({', '.join(CASOS)})")
+    parser.add_argument("--tamanos", default=",".join(map(str, TAMANOS)), help="Encuentros del paciente sintético")
+    parser.add_argument("--repeticiones", type=int, default=5, help="Repeticiones máximas por medición")
+    parser.add_argument("--presupuesto", type=float, default=10.0,
+                        help="Segundos máximos por medición antes de dejar de repetir")
+    parser.add_argument("--linea-base", default=LINEA_BASE, help="Archivo JSON con la línea base")
+    parser.add_argument("--guardar", action="store_true", help="Guardar los resultados como línea base")
+    parser.add_argument("--umbral", type=float, default=0.25, help="Regresión de tiempo tolerada (0.25 = +25%%)")
+    parser.add_argument("--umbral-memoria", type=float, default=0.10, help="Regresión de memoria tolerada")
+    args = parser.parse_args()
+
+    args.casos = [c.strip() for c in args.casos.split(",") if c.strip()]
+    invalidos = [c for c in args.casos if c not in CASOS]
+    if invalidos:
+        parser.error(f"Casos no soportados: {', '.join(invalidos)}")
+    try:
+        args.tamanos = [int(t) for t in args.tamanos.split(",") if t.strip()]
+    except ValueError:
+        parser.error("--tamanos debe ser una lista de enteros separados por coma")
+    return args
+
+# ==================== MEDICIÓN ====================
+def medir(funcion, repeticiones: int, presupuesto: float) -> dict:
+    funcion()  # calentamiento: imports perezosos, cachés, compilación de regex
+
+    tiempos, inicio = [], time.perf_counter()
+    gc.collect()
+    while len(tiempos) < repeticiones and (not tiempos or time.perf_counter() - inicio < presupuesto):
+        t0 = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - t0)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        funcion()
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "segundos": round(min(tiempos), 6),
+        "mediana_segundos": round(sorted(tiempos)[len(tiempos) // 2], 6),
+        "repeticiones": len(tiempos),
+        "memoria_pico_kb": round(pico / 1024, 1)
+    }
+
+def correr(args) -> dict:
+    resultados = {}
+    for nombre in args.casos:
+        preparar, tamanos_caso = CASOS[nombre]
+        # Los casos que no dependen del tamaño (el carné) se miden sólo en sus tamaños propios
+        for tamano in tamanos_caso or args.tamanos:
+            clave = f"{nombre}[{tamano}]"
+            try:
+                funcion = preparar(tamano)
+            except (ImportError, OSError) as e:
+                print(f"[BENCH] {clave}: omitido, falta una dependencia ({type(e).__name__}: {e})")
+                break
+            resultados[clave] = medir(funcion, args.repeticiones, args.presupuesto)
+            r = resultados[clave]
+            print(f"[BENCH] {clave:<32} {r['segundos'] * 1000:>12.3f} ms  {r['memoria_pico_kb']:>12.1f} KB  "
+                  f"({r['repeticiones']} rep.)")
+    return resultados
+
+# ==================== LÍNEA BASE ====================
+def leer_linea_base(ruta: str) -> dict:
+    try:
+        with open(ruta) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def guardar_linea_base(ruta: str, resultados: dict):
+    # Se fusiona con la existente: correr sólo algunos casos no borra la base de los demás
+    linea_base = leer_linea_base(ruta)
+    linea_base.setdefault("resultados", {}).update(resultados)
+    linea_base["entorno"] = {
+        "python": platform.python_version(),
+        "maquina": platform.machine(),
+        "procesador": platform.processor() or None,
+        "fecha": datetime.now().isoformat(timespec="seconds")
+    }
+    temporal = f"{ruta}.tmp"
+    with open(temporal, "w") as f:
+        json.dump(linea_base, f, indent=2, sort_keys=True)
+    os.replace(temporal, ruta)
+
+def comparar(resultados: dict, linea_base: dict, umbral: float, umbral_memoria: float) -> list:
+    regresiones = []
+    base = linea_base.get("resultados", {})
+    for clave, actual in resultados.items():
+        anterior = base.get(clave)
+        if not anterior:
+            print(f"[BENCH] {clave}: sin línea base")
+            continue
+        for campo, tolerancia in (("segundos", umbral), ("memoria_pico_kb", umbral_memoria)):
+            if not anterior.get(campo):
+                continue
+            cambio = actual[campo] / anterior[campo] - 1
+            marca = "REGRESIÓN" if cambio > tolerancia else "ok"
+            print(f"[BENCH] {clave:<32} {campo:<16} {anterior[campo]:>12} -> {actual[campo]:<12} {cambio:+.1%}  {marca}")
+            if cambio > tolerancia:
+                regresiones.append(f"{clave} {campo} {cambio:+.1%} (tolerado {tolerancia:+.0%})")
+    return regresiones
+
+def main() -> int:
+    args = parse_args()
+    resultados = correr(args)
+
+    if args.guardar:
+        guardar_linea_base(args.linea_base, resultados)
+        print(f"[BENCH] Línea base guardada en {args.linea_base}")
+        return 0
+
+    linea_base = leer_linea_base(args.linea_base)
+    if not linea_base:
+        print(f"[BENCH] No hay línea base en {args.linea_base}; crearla con --guardar")
+        return 0
+
+    entorno = linea_base.get("entorno", {})
+    if entorno.get("python") != platform.python_version() or entorno.get("maquina") != platform.machine():
+        print(f"[BENCH] Aviso: la línea base se midió en otro entorno ({entorno}); los tiempos no son comparables")
+
+    regresiones = comparar(resultados, linea_base, args.umbral, args.umbral_memoria)
+    if regresiones:
+        print("[BENCH] Regresiones:\n  " + "\n  ".join(regresiones))
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
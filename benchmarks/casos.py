@@ -0,0 +1,45 @@
+from typing import Callable, List
+from benchmarks.fixtures import paciente_sintetico, datos_encuentro, datos_usuario
+
+# Cada caso recibe el tamaño (número de encuentros del paciente sintético) y devuelve la función a medir.
+# La preparación de datos queda fuera de la medición. Los imports son perezosos: si falta una dependencia
+# de sistema (p. ej. las librerías de WeasyPrint) el caso se omite y el resto sigue corriendo.
+
+def pdf_historia(tamano: int) -> Callable:
+    from app.services.pdf_service import generar_historia_clinica_pdf
+    paciente, encuentros = paciente_sintetico(tamano)
+    return lambda: generar_historia_clinica_pdf(paciente, encuentros)
+
+def pdf_carne(tamano: int) -> Callable:
+    from app.services.pdf_service import generar_carne_paciente_pdf
+    paciente, _ = paciente_sintetico(0)
+    return lambda: generar_carne_paciente_pdf(paciente)
+
+def fhir_builders(tamano: int) -> Callable:
+    from app.services.fhir_service import fhir_service
+    paciente, encuentros = paciente_sintetico(tamano)
+    usuario = datos_usuario(paciente)
+    datos = [(datos_encuentro(e), e.medico_id) for e in encuentros]
+
+    def construir():
+        fhir_service.build_patient(usuario, str(paciente.id))
+        for (encuentro, observaciones), medico_id in datos:
+            fhir_service.build_encounter_bundle(encuentro, observaciones, str(paciente.id), medico_id)
+    return construir
+
+def serializar_encuentros(tamano: int) -> Callable:
+    from pydantic import TypeAdapter
+    from app.schemas.schemas import EncuentroConRelaciones
+    _, encuentros = paciente_sintetico(tamano)
+    adaptador = TypeAdapter(List[EncuentroConRelaciones])
+
+    # Lo mismo que hace FastAPI con response_model: validar desde atributos y serializar a JSON
+    return lambda: adaptador.dump_json(adaptador.validate_python(encuentros, from_attributes=True))
+
+# nombre -> (preparar, tamaños a los que aplica; None = todos los pedidos)
+CASOS = {
+    "pdf_historia": (pdf_historia, None),
+    "pdf_carne": (pdf_carne, (1,)),
+    "fhir_builders": (fhir_builders, None),
+    "serializar_encuentros": (serializar_encuentros, None),
+}
@@ -0,0 +1,110 @@
+import random
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+
+# Datos sintéticos con la misma forma que los objetos ORM: los builders, los PDF y los esquemas
+# Pydantic sólo leen atributos, así que no hace falta una base de datos.
+
+TIPOS = [("Consulta Externa", "AMB"), ("Urgencias", "EMER"), ("Hospitalización", "IMP"), ("Domiciliaria", "HH")]
+SEDES = ["Sede Norte", "Sede Centro", "Sede Sur"]
+OBSERVACIONES = [
+    ("Presión arterial", "120/80", "mmHg", "85354-9", "Normal"),
+    ("Temperatura corporal", "37.2", "°C", "8310-5", None),
+    ("Glucosa en ayunas", "110", "mg/dL", "2345-7", "Elevada"),
+    ("Peso corporal", "154", "lb", "29463-7", None),
+    ("Frecuencia cardíaca", "72", "lpm", "8867-4", "Normal"),
+    ("Resultado prueba rápida", "negativo", None, None, None),
+]
+DIAGNOSTICOS = [
+    ("Hipertensión esencial (primaria)", "I10", "38341003"),
+    ("Diabetes mellitus tipo 2", "E11.9", "44054006"),
+    ("Rinofaringitis aguda", "J00", "82272006"),
+    (None, None, None),
+]
+
+def _usuario(rng: random.Random, id: int, rol: str) -> SimpleNamespace:
+    return SimpleNamespace(
+        id=id,
+        numero_documento=str(rng.randint(10_000_000, 1_999_999_999)),
+        nombres=rng.choice(["Ana María", "Carlos", "Luisa", "Jorge Andrés", "Valentina"]),
+        apellidos=rng.choice(["Gómez Pérez", "Rodríguez", "Martínez Ruiz", "López"]),
+        genero=rng.choice(["Masculino", "Femenino"]),
+        fecha_nacimiento=date(1950, 1, 1) + timedelta(days=rng.randint(0, 25_000)),
+        telefono=f"300{rng.randint(1_000_000, 9_999_999)}",
+        email=f"usuario{id}@clinica.local",
+        tipo_documento_id=3,
+        tipo_documento=SimpleNamespace(id=3, nombre="Cédula de Ciudadanía", prefijo="CC", activo=True),
+        sede_registro_id=1,
+        rol_id=2 if rol == "Medico" else 3,
+        rol=SimpleNamespace(id=2 if rol == "Medico" else 3, nombre=rol),
+        activo=True,
+        fhir_patient_id=str(id) if rol == "Paciente" else None,
+        fhir_practitioner_id=str(id) if rol == "Medico" else None,
+        created_at=datetime(2024, 1, 1),
+        updated_at=datetime(2024, 1, 1),
+    )
+
+def paciente_sintetico(encuentros: int, observaciones_por_encuentro: int = 3, seed: int = 42):
+    # Devuelve (paciente, encuentros) deterministas para un tamaño dado
+    rng = random.Random(seed)
+    paciente = _usuario(rng, 1, "Paciente")
+    medicos = [_usuario(rng, 100 + i, "Medico") for i in range(5)]
+    tipos = [SimpleNamespace(id=i, nombre=n, codigo_fhir=c) for i, (n, c) in enumerate(TIPOS, 1)]
+    sedes = [SimpleNamespace(id=i, nombre=n, direccion="Calle 1 # 2-3", ciudad="Bogotá", telefono=None, activo=True)
+             for i, n in enumerate(SEDES, 1)]
+
+    inicio = datetime(2015, 1, 1)
+    lista, obs_id = [], 1
+    for i in range(1, encuentros + 1):
+        fecha = inicio + timedelta(hours=rng.randint(0, 80_000))
+        tipo, sede, medico = rng.choice(tipos), rng.choice(sedes), rng.choice(medicos)
+        diagnostico, icd10, snomed = rng.choice(DIAGNOSTICOS)
+        observaciones = []
+        for _ in range(observaciones_por_encuentro):
+            descripcion, valor, unidad, loinc, interpretacion = rng.choice(OBSERVACIONES)
+            observaciones.append(SimpleNamespace(
+                id=obs_id, fecha=fecha, encuentro_id=i, descripcion=descripcion, valor=valor, unidad=unidad,
+                codigo_loinc=loinc, interpretacion=interpretacion, sede_id=sede.id,
+                valor_numerico=None, valor_normalizado=None, unidad_normalizada=None,
+                presion_sistolica=None, presion_diastolica=None,
+                fhir_observation_id=str(10_000 + obs_id), created_at=fecha
+            ))
+            obs_id += 1
+        lista.append(SimpleNamespace(
+            id=i, fecha=fecha, tipo_id=tipo.id, tipo=tipo, sede_id=sede.id, sede=sede,
+            paciente_id=paciente.id, paciente=paciente, medico_id=medico.id, medico=medico,
+            diagnostico=diagnostico, diagnostico_codigo_icd10=icd10, diagnostico_codigo_snomed=snomed,
+            estado="finalizado", fhir_encounter_id=str(5_000 + i), observaciones=observaciones, created_at=fecha
+        ))
+    lista.sort(key=lambda e: e.fecha, reverse=True)
+    return paciente, lista
+
+def datos_encuentro(encuentro) -> tuple:
+    # Los dicts que reciben los builders, como los arma el worker del outbox
+    datos = {
+        "fecha": encuentro.fecha.isoformat(),
+        "codigo_fhir": encuentro.tipo.codigo_fhir,
+        "tipo_nombre": encuentro.tipo.nombre,
+        "diagnostico": encuentro.diagnostico,
+        "diagnostico_codigo_icd10": encuentro.diagnostico_codigo_icd10
+    }
+    observaciones = [{
+        "fecha": obs.fecha.isoformat(),
+        "descripcion": obs.descripcion,
+        "valor": obs.valor,
+        "unidad": obs.unidad,
+        "codigo_loinc": obs.codigo_loinc,
+        "interpretacion": obs.interpretacion
+    } for obs in encuentro.observaciones]
+    return datos, observaciones
+
+def datos_usuario(usuario) -> dict:
+    return {
+        "numero_documento": usuario.numero_documento,
+        "nombres": usuario.nombres,
+        "apellidos": usuario.apellidos,
+        "genero": usuario.genero,
+        "fecha_nacimiento": usuario.fecha_nacimiento,
+        "telefono": usuario.telefono,
+        "email": usuario.email
+    }
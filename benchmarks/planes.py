@@ -0,0 +1,287 @@
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, func, select, text, tuple_
+from sqlalchemy.engine import Engine
+from app.config import settings
+from app.models.models import EncuentroMedico, ObservacionClinica, OutboxFHIR, Rol, SerieDiaria, Usuario
+from app.services import migraciones
+from app.services.busqueda import consulta_pacientes
+from app.services.consultas import ENCUENTRO_CON_RELACIONES, USUARIO_CON_RELACIONES, consultas_medico, historial_paciente
+
+# Regresiones de planes de las consultas calientes de las rutas, contra una base PostgreSQL de prueba:
+#   python -m benchmarks.planes --database-url postgresql://.../planes --preparar
+#   python -m benchmarks.planes --database-url postgresql://.../planes [--consultas login,historial_paciente]
+# --preparar carga init.sql y las migraciones pendientes en una base vacía y siembra un volumen
+# realista con generate_series (en el servidor, con semilla fija). Cada consulta corre con
+# EXPLAIN (ANALYZE, BUFFERS) dentro de una transacción que se revierte; falla si el plan recorre con
+# Seq Scan una tabla de más de --paginas páginas o si lee más bloques que su presupuesto.
+# Los presupuestos corresponden al volumen por defecto; con otro volumen se ajustan con --holgura.
+
+INIT_SQL = os.path.join(os.path.dirname(__file__), "..", "postgres", "init.sql")
+
+NOMBRES = ("María", "José", "Luis", "Ana", "Carlos", "Sofía", "Andrés", "Valentina", "Juan", "Camila",
+           "Jorge", "Daniela", "Pedro", "Laura", "Diego", "Paula", "Miguel", "Natalia", "Julián", "Ángela")
+APELLIDOS = ("Rodríguez", "Gómez", "González", "Martínez", "García", "López", "Hernández", "Sánchez", "Ramírez",
+             "Pérez", "Díaz", "Muñoz", "Rojas", "Moreno", "Jiménez", "Álvarez", "Romero", "Vargas", "Castro", "Ortiz")
+ICD10 = ("E11.9", "I10", "J06.9", "K29.7", "M54.5", "N39.0", "R51", "Z00.0", "E78.5", "J45.9")
+OBSERVACIONES = (("Frecuencia cardiaca", "8867-4", "lpm", 60, 40), ("Temperatura", "8310-5", "°C", 36, 2),
+                 ("Peso", "29463-7", "kg", 50, 40), ("Glucosa", "2339-0", "mg/dL", 70, 80))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Regresiones de planes de consulta con EXPLAIN (ANALYZE, BUFFERS)")
+    parser.add_argument("--database-url", required=True, help="Base PostgreSQL de prueba (no la de producción)")
+    parser.add_argument("--preparar", action="store_true", help="Crear el esquema y sembrar datos en una base vacía")
+    parser.add_argument("--pacientes", type=int, default=20000)
+    parser.add_argument("--medicos", type=int, default=200)
+    parser.add_argument("--encuentros", type=int, default=200000)
+    parser.add_argument("--observaciones", type=int, default=3, help="Observaciones por encuentro")
+    parser.add_argument("--meses", type=int, default=24, help="Meses hacia atrás de los encuentros sembrados")
+    parser.add_argument("--consultas", help=f"Consultas a revisar ({', '.join(CONSULTAS)})")
+    parser.add_argument("--paginas", type=int, default=64,
+                        help="Páginas desde las que un Seq Scan cuenta como regresión (las tablas chicas se recorren)")
+    parser.add_argument("--holgura", type=float, default=1.0, help="Multiplicador de los presupuestos de bloques")
+    args = parser.parse_args()
+
+    args.consultas = [c.strip() for c in args.consultas.split(",") if c.strip()] if args.consultas else list(CONSULTAS)
+    invalidas = [c for c in args.consultas if c not in CONSULTAS]
+    if invalidas:
+        parser.error(f"Consultas no soportadas: {', '.join(invalidas)}")
+    return args
+
+# ==================== PREPARACIÓN ====================
+SIEMBRA = """
+    SELECT setseed(0.42);
+
+    INSERT INTO usuarios (nombres, apellidos, tipo_documento_id, numero_documento, fecha_nacimiento, genero,
+                          sede_registro_id, rol_id, password_hash, activo)
+    SELECT n.nombres[1 + i % 20], n.apellidos[1 + (i / 20) % 20] || ' ' || n.apellidos[1 + (i / 400) % 20],
+           3, (1000000000 + i)::TEXT, DATE '1940-01-01' + (i * 7919) % 30000,
+           CASE WHEN i % 2 = 0 THEN 'Femenino' ELSE 'Masculino' END, 1 + i % 3,
+           (SELECT id FROM roles WHERE nombre = 'Paciente'), 'x', i % 50 <> 0
+    FROM generate_series(1, :pacientes) i, (SELECT CAST(:nombres AS TEXT[]) AS nombres, CAST(:apellidos AS TEXT[]) AS apellidos) n;
+
+    INSERT INTO usuarios (nombres, apellidos, tipo_documento_id, numero_documento, fecha_nacimiento, genero,
+                          sede_registro_id, rol_id, password_hash)
+    SELECT 'Médico', 'Prueba ' || i, 3, (2000000000 + i)::TEXT, DATE '1970-01-01' + i,
+           'Femenino', 1 + i % 3, (SELECT id FROM roles WHERE nombre = 'Medico'), 'x'
+    FROM generate_series(1, :medicos) i;
+
+    -- Actividad desigual entre pacientes: los primeros acumulan varias veces el promedio de encuentros
+    INSERT INTO encuentros_medicos (fecha, tipo_id, sede_id, paciente_id, medico_id, diagnostico, diagnostico_codigo_icd10)
+    SELECT now() - random() * (:meses * INTERVAL '30 days'), 1 + i % 4, 1 + i % 3,
+           p.ids[1 + floor(power(random(), 1.2) * cardinality(p.ids))::INT],
+           m.ids[1 + floor(random() * cardinality(m.ids))::INT],
+           'Diagnóstico sembrado', (CAST(:icd10 AS TEXT[]))[1 + i % 10]
+    FROM generate_series(1, :encuentros) i,
+         (SELECT array_agg(id) AS ids FROM usuarios WHERE rol_id = (SELECT id FROM roles WHERE nombre = 'Paciente')) p,
+         (SELECT array_agg(id) AS ids FROM usuarios WHERE rol_id = (SELECT id FROM roles WHERE nombre = 'Medico')) m;
+
+    INSERT INTO observaciones_clinicas (fecha, encuentro_id, descripcion, valor, unidad, codigo_loinc, sede_id)
+    SELECT e.fecha + k * INTERVAL '5 minutes', e.id, o.descripcion, round((o.base + random() * o.rango)::NUMERIC, 1)::TEXT,
+           o.unidad, o.loinc, e.sede_id
+    FROM encuentros_medicos e
+    CROSS JOIN generate_series(1, :observaciones) k
+    JOIN (SELECT * FROM unnest(CAST(:obs_descripcion AS TEXT[]), CAST(:obs_loinc AS TEXT[]), CAST(:obs_unidad AS TEXT[]),
+                               CAST(:obs_base AS FLOAT[]), CAST(:obs_rango AS FLOAT[]))
+          WITH ORDINALITY AS t(descripcion, loinc, unidad, base, rango, n)) o ON o.n = 1 + (e.id + k) % 4;
+
+    -- Outbox con historia: casi todo completado y una cola pendiente pequeña al final
+    INSERT INTO outbox_fhir (operacion, entidad_id, estado, proximo_intento, procesado_at)
+    SELECT 'sync_encounter', i, CASE WHEN i > :encuentros / 2 - 500 THEN 'pendiente' ELSE 'completado' END,
+           now() - INTERVAL '1 minute', CASE WHEN i > :encuentros / 2 - 500 THEN NULL ELSE now() END
+    FROM generate_series(1, :encuentros / 2) i
+"""
+
+def preparar(engine: Engine, args):
+    with engine.connect() as conexion:
+        if conexion.execute(text("SELECT to_regclass('usuarios') IS NOT NULL")).scalar():
+            raise SystemExit("[PLANES] La base ya tiene esquema; --preparar necesita una base vacía")
+
+    with open(INIT_SQL, encoding="utf-8") as f:
+        migraciones.ejecutar_script(engine, f.read())
+    migraciones.aplicar(engine=engine)
+
+    # Particiones de los meses sembrados, además de las que crea init.sql hacia adelante
+    with engine.begin() as conexion:
+        conexion.execute(text("""
+            SELECT particion_mensual(t, m::DATE)
+            FROM unnest(ARRAY['encuentros_medicos', 'observaciones_clinicas']) t,
+                 generate_series(date_trunc('month', now() - :meses * INTERVAL '30 days'),
+                                 date_trunc('month', now()), INTERVAL '1 month') m
+        """), {"meses": args.meses})
+
+    print(f"[PLANES] Sembrando {args.pacientes} pacientes, {args.medicos} médicos, {args.encuentros} encuentros...")
+    parametros = {
+        "pacientes": args.pacientes, "medicos": args.medicos, "encuentros": args.encuentros,
+        "observaciones": args.observaciones, "meses": args.meses,
+        "nombres": list(NOMBRES), "apellidos": list(APELLIDOS), "icd10": list(ICD10),
+        "obs_descripcion": [o[0] for o in OBSERVACIONES], "obs_loinc": [o[1] for o in OBSERVACIONES],
+        "obs_unidad": [o[2] for o in OBSERVACIONES], "obs_base": [float(o[3]) for o in OBSERVACIONES],
+        "obs_rango": [float(o[4]) for o in OBSERVACIONES]
+    }
+    with engine.begin() as conexion:
+        for sentencia in migraciones.dividir_sentencias(SIEMBRA):
+            conexion.execute(text(sentencia), {k: v for k, v in parametros.items() if f":{k}" in sentencia})
+
+    # VACUUM no corre dentro de una transacción; deja el mapa de visibilidad y las estadísticas al día
+    migraciones.ejecutar_script(engine, "VACUUM ANALYZE")
+
+# ==================== CONSULTAS ====================
+# nombre -> (constructor de la sentencia a partir de la muestra, presupuesto de bloques compartidos)
+# Reproducen las rutas: las que viven en app/services se construyen con la misma función; las que
+# están escritas en el router se copian con sus mismos filtros y orden.
+def _pagina(query):
+    return query.limit(settings.API_PAGE_SIZE + 1)
+
+def _listar_encuentros(*filtros):
+    return _pagina(select(EncuentroMedico).options(*ENCUENTRO_CON_RELACIONES).where(*filtros).order_by(
+        EncuentroMedico.fecha.desc(), EncuentroMedico.id.desc()
+    ))
+
+def _listar_usuarios(*filtros):
+    return _pagina(select(Usuario).options(*USUARIO_CON_RELACIONES).where(*filtros).order_by(Usuario.id))
+
+CONSULTAS = {
+    # POST /auth/login
+    "login": (lambda m: select(Usuario).where(Usuario.numero_documento == m["documento"]), 20),
+    # GET /usuarios/?rol=Paciente, ?sede_id=
+    "usuarios_rol": (lambda m: _listar_usuarios(
+        Usuario.rol_id == select(Rol.id).where(Rol.nombre == "Paciente").scalar_subquery()), 200),
+    "usuarios_sede": (lambda m: _listar_usuarios(Usuario.sede_registro_id == m["sede_id"]), 200),
+    # GET /historial/..., PDF y vista del paciente: encuentros y la segunda sentencia de las observaciones
+    "historial_paciente": (lambda m: historial_paciente(m["paciente_id"]), 600),
+    "historial_observaciones": (lambda m: select(ObservacionClinica).where(
+        ObservacionClinica.encuentro_id.in_(m["encuentros_paciente"])).order_by(ObservacionClinica.encuentro_id), 6000),
+    # Vista medico/consultas: todos los encuentros del médico
+    "consultas_medico": (lambda m: consultas_medico(m["medico_id"]), 8000),
+    # GET /encuentros/ con cada filtro
+    "encuentros_recientes": (lambda m: _listar_encuentros(), 800),
+    "encuentros_cursor": (lambda m: _listar_encuentros(
+        tuple_(EncuentroMedico.fecha, EncuentroMedico.id) < (m["cursor_fecha"], m["cursor_id"])), 800),
+    "encuentros_paciente": (lambda m: _listar_encuentros(EncuentroMedico.paciente_id == m["paciente_id"]), 800),
+    "encuentros_medico": (lambda m: _listar_encuentros(EncuentroMedico.medico_id == m["medico_id"]), 800),
+    "encuentros_sede": (lambda m: _listar_encuentros(EncuentroMedico.sede_id == m["sede_id"]), 800),
+    "encuentros_icd10": (lambda m: _listar_encuentros(
+        EncuentroMedico.diagnostico_codigo_icd10.startswith("E11", autoescape=True)), 1500),
+    "encuentros_rango": (lambda m: _listar_encuentros(
+        EncuentroMedico.fecha >= m["desde"], EncuentroMedico.fecha < m["desde"] + timedelta(days=7)), 600),
+    # Búsqueda de pacientes (admisionista y typeahead del médico)
+    "busqueda_nombre": (lambda m: consulta_pacientes(m["nombre"], settings.BUSQUEDA_LIMITE), 3000),
+    "busqueda_documento": (lambda m: consulta_pacientes(m["documento"][:7], settings.BUSQUEDA_LIMITE), 1500),
+    "busqueda_recientes": (lambda m: consulta_pacientes("", settings.BUSQUEDA_LIMITE, medico_id=m["medico_id"],
+                                                        solo_activos=True), 3000),
+    # GET /reportes/series de un trimestre por día
+    "series": (lambda m: select(
+        SerieDiaria.dia, func.sum(SerieDiaria.encuentros), func.sum(SerieDiaria.observaciones)
+    ).where(SerieDiaria.dia >= m["desde"].date(), SerieDiaria.dia <= m["desde"].date() + timedelta(days=90)
+            ).group_by(SerieDiaria.dia).order_by(SerieDiaria.dia), 2000),
+    # FHIRSyncWorker._reclamar_lote
+    "outbox_reclamar": (lambda m: select(OutboxFHIR).where(
+        OutboxFHIR.estado == "pendiente", OutboxFHIR.proximo_intento <= datetime.now()
+    ).order_by(OutboxFHIR.id).limit(settings.FHIR_SYNC_BATCH_SIZE).with_for_update(skip_locked=True), 200)
+}
+
+def muestra(engine: Engine) -> dict:
+    # Valores de las consultas tomados de la base: el paciente y el médico con más encuentros (el peor caso)
+    with engine.connect() as conexion:
+        paciente_id = conexion.execute(text(
+            "SELECT paciente_id FROM encuentros_medicos GROUP BY 1 ORDER BY COUNT(*) DESC LIMIT 1")).scalar()
+        medico_id = conexion.execute(text(
+            "SELECT medico_id FROM encuentros_medicos GROUP BY 1 ORDER BY COUNT(*) DESC LIMIT 1")).scalar()
+        if paciente_id is None:
+            raise SystemExit("[PLANES] La base no tiene encuentros; sembrarla con --preparar")
+        paciente = conexion.execute(select(Usuario.nombres, Usuario.apellidos, Usuario.numero_documento).where(
+            Usuario.id == paciente_id)).one()
+        encuentros = conexion.execute(text(
+            "SELECT id, fecha FROM encuentros_medicos WHERE paciente_id = :p ORDER BY fecha DESC, id DESC"
+        ), {"p": paciente_id}).all()
+        mitad = conexion.execute(text(
+            "SELECT id, fecha FROM encuentros_medicos ORDER BY fecha DESC, id DESC "
+            "OFFSET (SELECT COUNT(*) / 2 FROM encuentros_medicos) LIMIT 1")).one()
+    return {
+        "paciente_id": paciente_id,
+        "medico_id": medico_id,
+        "sede_id": 2,
+        "documento": paciente.numero_documento,
+        # Nombre con un apellido y sin tildes, como lo escribe quien busca
+        "nombre": f"{paciente.nombres} {paciente.apellidos.split()[0]}".lower().translate(str.maketrans("áéíóú", "aeiou")),
+        "encuentros_paciente": [e.id for e in encuentros],
+        "cursor_id": mitad.id,
+        "cursor_fecha": mitad.fecha,
+        "desde": datetime.now() - timedelta(days=60)
+    }
+
+# ==================== PLANES ====================
+def _nodos(plan: dict):
+    yield plan
+    for hijo in plan.get("Plans", []):
+        yield from _nodos(hijo)
+
+def explicar(engine: Engine, sentencia) -> dict:
+    compilada = sentencia.compile(dialect=engine.dialect, compile_kwargs={"render_postcompile": True})
+    with engine.connect() as conexion:
+        # Los mismos umbrales de pg_trgm que buscar_pacientes; FOR UPDATE y set_config se revierten al salir
+        conexion.execute(select(
+            func.set_config("pg_trgm.word_similarity_threshold", str(settings.BUSQUEDA_UMBRAL_NOMBRE), True),
+            func.set_config("pg_trgm.similarity_threshold", str(settings.BUSQUEDA_UMBRAL_DOCUMENTO), True)
+        ))
+        resultado = conexion.exec_driver_sql(
+            f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {compilada}", compilada.params
+        ).scalar()
+        conexion.rollback()
+    return resultado[0]
+
+def revisar(explicado: dict, paginas: dict, max_paginas: int, presupuesto: int) -> dict:
+    plan = explicado["Plan"]
+    bloques = plan.get("Shared Hit Blocks", 0) + plan.get("Shared Read Blocks", 0)
+    problemas = []
+    for nodo in _nodos(plan):
+        if nodo["Node Type"] == "Seq Scan" and paginas.get(nodo["Relation Name"], 0) > max_paginas:
+            problemas.append(f"Seq Scan sobre {nodo['Relation Name']} ({paginas[nodo['Relation Name']]} páginas)")
+    if bloques > presupuesto:
+        problemas.append(f"{bloques} bloques, presupuesto {presupuesto}")
+    return {
+        "bloques": bloques,
+        "filas": plan.get("Actual Rows", 0),
+        "ms": explicado.get("Execution Time", 0.0),
+        "problemas": problemas
+    }
+
+def paginas_por_relacion(engine: Engine) -> dict:
+    # Las particiones cuentan por sí mismas: un Seq Scan de una partición vacía no es regresión
+    with engine.connect() as conexion:
+        return dict(conexion.execute(text("""
+            SELECT c.relname, c.relpages FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE c.relkind = 'r' AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+        """)).all())
+
+def main() -> int:
+    args = parse_args()
+    engine = create_engine(args.database_url)
+    try:
+        if args.preparar:
+            preparar(engine, args)
+
+        valores = muestra(engine)
+        paginas = paginas_por_relacion(engine)
+        fallas = []
+        for nombre in args.consultas:
+            construir, presupuesto = CONSULTAS[nombre]
+            presupuesto = int(presupuesto * args.holgura)
+            r = revisar(explicar(engine, construir(valores)), paginas, args.paginas, presupuesto)
+            marca = "FALLA" if r["problemas"] else "ok"
+            print(f"[PLANES] {nombre:<26} {r['bloques']:>8} / {presupuesto:<8} bloques {r['filas']:>7} filas "
+                  f"{r['ms']:>10.2f} ms  {marca}")
+            fallas += [f"{nombre}: {p}" for p in r["problemas"]]
+    finally:
+        engine.dispose()
+
+    if fallas:
+        print("[PLANES] Regresiones:\n  " + "\n  ".join(fallas))
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
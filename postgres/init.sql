@@ -42,6 +42,7 @@ CREATE TABLE usuarios (
     rol_id INTEGER REFERENCES roles(id),
     password_hash VARCHAR(255) NOT NULL,
     fhir_patient_id VARCHAR(100),
+    fhir_practitioner_id VARCHAR(100),
     activo BOOLEAN DEFAULT TRUE,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
@@ -56,8 +57,10 @@ CREATE TABLE tipos_encuentro_medico (
 );
 
 -- Encuentros Médicos
+-- Particionada por mes de fecha (ver "Particiones" más abajo); la llave primaria incluye fecha
+-- porque PostgreSQL exige que la clave de partición forme parte de los índices únicos.
 CREATE TABLE encuentros_medicos (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     fecha TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
     tipo_id INTEGER REFERENCES tipos_encuentro_medico(id),
     sede_id INTEGER REFERENCES sedes(id),
@@ -68,31 +71,446 @@ CREATE TABLE encuentros_medicos (
     diagnostico_codigo_snomed VARCHAR(50),
     fhir_encounter_id VARCHAR(100),
     estado VARCHAR(50) DEFAULT 'finished',
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, fecha)
+) PARTITION BY RANGE (fecha);
 
 -- Observaciones Clínicas
+-- También particionada por mes. encuentro_id no lleva FOREIGN KEY: una referencia a una tabla
+-- particionada tendría que incluir la fecha del encuentro.
 CREATE TABLE observaciones_clinicas (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     fecha TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-    encuentro_id INTEGER REFERENCES encuentros_medicos(id),
+    encuentro_id INTEGER,
     descripcion TEXT NOT NULL,
     valor VARCHAR(100),
     unidad VARCHAR(50),
     codigo_loinc VARCHAR(20),
     interpretacion VARCHAR(100),
+    valor_numerico DOUBLE PRECISION,
+    valor_normalizado DOUBLE PRECISION,
+    unidad_normalizada VARCHAR(20),
+    presion_sistolica DOUBLE PRECISION,
+    presion_diastolica DOUBLE PRECISION,
     sede_id INTEGER REFERENCES sedes(id),
     fhir_observation_id VARCHAR(100),
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, fecha)
+) PARTITION BY RANGE (fecha);
+
+-- Outbox de sincronización con HAPI FHIR
+CREATE TABLE outbox_fhir (
+    id SERIAL PRIMARY KEY,
+    operacion VARCHAR(50) NOT NULL,
+    entidad_id INTEGER,
+    payload JSONB DEFAULT '{}'::jsonb,
+    estado VARCHAR(20) NOT NULL DEFAULT 'pendiente' CHECK (estado IN ('pendiente', 'completado', 'fallido')),
+    intentos INTEGER NOT NULL DEFAULT 0,
+    proximo_intento TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    ultimo_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    procesado_at TIMESTAMP
+);
+
+-- Marcas de agua de la sincronización entrante desde HAPI (meta.lastUpdated por tipo de recurso)
+CREATE TABLE marcas_agua_fhir (
+    tipo_recurso VARCHAR(50) PRIMARY KEY,
+    ultima_actualizacion VARCHAR(40),
+    recursos_procesados INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Búsqueda aproximada de pacientes (app/services/busqueda.py): trigramas sobre el nombre sin tildes
+-- ni mayúsculas. unaccent con diccionario explícito para poder declararla IMMUTABLE e indexarla.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS unaccent;
+
+CREATE OR REPLACE FUNCTION normalizar_busqueda(texto TEXT) RETURNS TEXT AS $$
+    SELECT lower(public.unaccent('public.unaccent'::regdictionary, texto))
+$$ LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE;
+
+CREATE OR REPLACE FUNCTION nombre_busqueda(nombres TEXT, apellidos TEXT) RETURNS TEXT AS $$
+    SELECT normalizar_busqueda(nombres || ' ' || apellidos)
+$$ LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE;
+
 -- Índices
-CREATE INDEX idx_usuarios_documento ON usuarios(numero_documento);
-CREATE INDEX idx_usuarios_rol ON usuarios(rol_id);
-CREATE INDEX idx_encuentros_paciente ON encuentros_medicos(paciente_id);
-CREATE INDEX idx_encuentros_medico ON encuentros_medicos(medico_id);
-CREATE INDEX idx_encuentros_fecha ON encuentros_medicos(fecha);
+-- text_pattern_ops: igualdad (login) y prefijo del documento (LIKE '1032%') sin depender de la collation
+CREATE INDEX idx_usuarios_documento ON usuarios(numero_documento text_pattern_ops);
+CREATE INDEX idx_usuarios_nombre_trgm ON usuarios USING gin(nombre_busqueda(nombres, apellidos) gin_trgm_ops);
+CREATE INDEX idx_usuarios_documento_trgm ON usuarios USING gin(numero_documento gin_trgm_ops);
+CREATE INDEX idx_usuarios_rol ON usuarios(rol_id, id);
+CREATE INDEX idx_usuarios_sede ON usuarios(sede_registro_id, id);
+-- Listados paginados por (fecha, id) descendente, con y sin filtro por paciente, médico o sede
+CREATE INDEX idx_encuentros_fecha ON encuentros_medicos(fecha DESC, id DESC);
+CREATE INDEX idx_encuentros_paciente ON encuentros_medicos(paciente_id, fecha DESC, id DESC);
+CREATE INDEX idx_encuentros_medico ON encuentros_medicos(medico_id, fecha DESC, id DESC);
+CREATE INDEX idx_encuentros_sede ON encuentros_medicos(sede_id, fecha DESC, id DESC);
+-- Filtro por prefijo CIE-10 (LIKE 'E11%') sin depender de la collation de la base
+CREATE INDEX idx_encuentros_icd10 ON encuentros_medicos(diagnostico_codigo_icd10 text_pattern_ops, fecha DESC, id DESC);
 CREATE INDEX idx_observaciones_encuentro ON observaciones_clinicas(encuentro_id);
+-- Rangos de fecha sobre observaciones: se insertan casi en orden de fecha, BRIN ocupa unos pocos KB
+CREATE INDEX idx_observaciones_fecha ON observaciones_clinicas USING brin(fecha);
+CREATE INDEX idx_usuarios_fhir_patient ON usuarios(fhir_patient_id);
+CREATE INDEX idx_usuarios_fhir_practitioner ON usuarios(fhir_practitioner_id);
+CREATE INDEX idx_encuentros_fhir ON encuentros_medicos(fhir_encounter_id);
+CREATE INDEX idx_observaciones_fhir ON observaciones_clinicas(fhir_observation_id);
+CREATE INDEX idx_observaciones_loinc_valor ON observaciones_clinicas(codigo_loinc, unidad_normalizada, valor_normalizado) WHERE valor_normalizado IS NOT NULL;
+CREATE INDEX idx_observaciones_presion ON observaciones_clinicas(presion_sistolica, presion_diastolica) WHERE presion_sistolica IS NOT NULL;
+CREATE INDEX idx_outbox_pendientes ON outbox_fhir(proximo_intento, id) WHERE estado = 'pendiente';
+
+-- Particiones mensuales de encuentros_medicos y observaciones_clinicas (<tabla>_AAAA_MM).
+-- Las consultas con rango de fecha y los listados por fecha descendente con LIMIT sólo leen los
+-- meses que necesitan, y vacuum y reindexado trabajan partición por partición. Lo que llega para
+-- un mes sin partición cae en <tabla>_default hasta que crear_particiones() la crea y mueve esas filas.
+CREATE TABLE encuentros_medicos_default PARTITION OF encuentros_medicos DEFAULT;
+CREATE TABLE observaciones_clinicas_default PARTITION OF observaciones_clinicas DEFAULT;
+
+-- Archivo: los meses viejos se desprenden de la tabla caliente y se cuelgan de archivo.<tabla>,
+-- opcionalmente en otro tablespace (p. ej. sobre un sistema de archivos comprimido). Siguen siendo
+-- consultables (historial con incluir_archivo) y cuentan en estadísticas y series.
+CREATE SCHEMA archivo;
+CREATE TABLE archivo.encuentros_medicos (LIKE encuentros_medicos INCLUDING ALL) PARTITION BY RANGE (fecha);
+CREATE TABLE archivo.observaciones_clinicas (LIKE observaciones_clinicas INCLUDING ALL) PARTITION BY RANGE (fecha);
+
+CREATE FUNCTION particion_mensual(tabla TEXT, mes DATE) RETURNS TEXT AS $$
+DECLARE
+    inicio DATE := date_trunc('month', mes)::DATE;
+    fin DATE := (date_trunc('month', mes) + INTERVAL '1 month')::DATE;
+    nombre TEXT := format('%s_%s', tabla, to_char(mes, 'YYYY_MM'));
+    pendientes BOOLEAN;
+BEGIN
+    IF to_regclass(nombre) IS NOT NULL OR to_regclass('archivo.' || nombre) IS NOT NULL THEN
+        RETURN NULL;
+    END IF;
+    -- Las inserciones que caerían en la partición por defecto esperan mientras se mueven sus filas
+    EXECUTE format('LOCK TABLE %I IN SHARE ROW EXCLUSIVE MODE', tabla || '_default');
+    EXECUTE format('SELECT EXISTS (SELECT 1 FROM %I WHERE fecha >= $1 AND fecha < $2)', tabla || '_default')
+        INTO pendientes USING inicio, fin;
+    IF NOT pendientes THEN
+        EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)', nombre, tabla, inicio, fin);
+    ELSE
+        -- Mover filas entre particiones no dispara los triggers de la tabla madre: estadísticas y series no cambian
+        EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS)', nombre, tabla);
+        EXECUTE format('WITH movidas AS (DELETE FROM %I WHERE fecha >= $1 AND fecha < $2 RETURNING *) '
+                       'INSERT INTO %I SELECT * FROM movidas', tabla || '_default', nombre) USING inicio, fin;
+        EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)', tabla, nombre, inicio, fin);
+    END IF;
+    RETURN nombre;
+END
+$$ LANGUAGE plpgsql;
+
+-- Crea las particiones del mes actual y los siguientes, más las de los meses que tengan filas en la
+-- partición por defecto. Devuelve cuántas creó, o NULL si otra sesión ya lo está haciendo.
+CREATE FUNCTION crear_particiones(meses_adelante INTEGER DEFAULT 3) RETURNS INTEGER AS $$
+DECLARE
+    creadas INTEGER := 0;
+    tabla TEXT;
+    mes DATE;
+BEGIN
+    IF NOT pg_try_advisory_xact_lock(740013) THEN
+        RETURN NULL;
+    END IF;
+    FOREACH tabla IN ARRAY ARRAY['encuentros_medicos', 'observaciones_clinicas'] LOOP
+        FOR mes IN EXECUTE format(
+            'SELECT generate_series(date_trunc(''month'', CURRENT_DATE), '
+            'date_trunc(''month'', CURRENT_DATE) + make_interval(months => $1), INTERVAL ''1 month'')::DATE '
+            'UNION SELECT DISTINCT date_trunc(''month'', fecha)::DATE FROM %I', tabla || '_default'
+        ) USING meses_adelante LOOP
+            IF particion_mensual(tabla, mes) IS NOT NULL THEN
+                creadas := creadas + 1;
+            END IF;
+        END LOOP;
+    END LOOP;
+    RETURN creadas;
+END
+$$ LANGUAGE plpgsql;
+
+-- Pasa un mes al archivo. La partición conserva sus índices, que se reutilizan al colgarla de
+-- archivo.<tabla>. Con espacio se mueve también de tablespace (reescribe la tabla y sus índices).
+CREATE FUNCTION archivar_particion(tabla TEXT, mes DATE, espacio TEXT DEFAULT NULL) RETURNS TEXT AS $$
+DECLARE
+    inicio DATE := date_trunc('month', mes)::DATE;
+    fin DATE := (date_trunc('month', mes) + INTERVAL '1 month')::DATE;
+    nombre TEXT := format('%s_%s', tabla, to_char(mes, 'YYYY_MM'));
+    indice REGCLASS;
+BEGIN
+    IF to_regclass(nombre) IS NULL THEN
+        RETURN NULL;
+    END IF;
+    EXECUTE format('ALTER TABLE %I DETACH PARTITION %I', tabla, nombre);
+    EXECUTE format('ALTER TABLE %I SET SCHEMA archivo', nombre);
+    IF espacio IS NOT NULL THEN
+        EXECUTE format('ALTER TABLE archivo.%I SET TABLESPACE %I', nombre, espacio);
+        FOR indice IN SELECT indexrelid::REGCLASS FROM pg_index WHERE indrelid = format('archivo.%I', nombre)::REGCLASS LOOP
+            EXECUTE format('ALTER INDEX %s SET TABLESPACE %I', indice, espacio);
+        END LOOP;
+    END IF;
+    EXECUTE format('ALTER TABLE archivo.%I ATTACH PARTITION archivo.%I FOR VALUES FROM (%L) TO (%L)', tabla, nombre, inicio, fin);
+    RETURN 'archivo.' || nombre;
+END
+$$ LANGUAGE plpgsql;
+
+SELECT crear_particiones(3);
+
+-- Estadísticas mantenidas por triggers (GET /reportes/estadisticas)
+-- Cada sentencia que escribe en usuarios, encuentros_medicos u observaciones_clinicas suma sus deltas
+-- por (dimension, clave) desde las tablas de transición: el tablero lee unas pocas filas sin importar
+-- el tamaño del historial. El fragmento reparte los contadores calientes (p. ej. el total de encuentros)
+-- entre varias filas para que las sesiones concurrentes no se bloqueen entre sí; se suman al leer.
+CREATE TABLE estadisticas (
+    dimension VARCHAR(30) NOT NULL,
+    clave INTEGER NOT NULL DEFAULT 0,
+    fragmento SMALLINT NOT NULL DEFAULT 0,
+    total BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (dimension, clave, fragmento)
+);
+
+-- Contadores a los que aporta cada fila
+CREATE FUNCTION estadisticas_claves_usuario(u usuarios) RETURNS TABLE(dimension TEXT, clave INTEGER) AS $$
+    SELECT 'usuarios_rol', u.rol_id WHERE u.rol_id IS NOT NULL
+    UNION ALL SELECT 'usuarios_activo', u.activo::INTEGER WHERE u.activo IS NOT NULL
+    UNION ALL SELECT 'pacientes_fhir', 0 WHERE u.fhir_patient_id IS NOT NULL
+    UNION ALL SELECT 'medicos_fhir', 0 WHERE u.fhir_practitioner_id IS NOT NULL
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE FUNCTION estadisticas_claves_encuentro(e encuentros_medicos) RETURNS TABLE(dimension TEXT, clave INTEGER) AS $$
+    SELECT 'encuentros', 0
+    UNION ALL SELECT 'encuentros_tipo', e.tipo_id WHERE e.tipo_id IS NOT NULL
+    UNION ALL SELECT 'encuentros_sede', e.sede_id WHERE e.sede_id IS NOT NULL
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE FUNCTION estadisticas_claves_observacion(o observaciones_clinicas) RETURNS TABLE(dimension TEXT, clave INTEGER) AS $$
+    SELECT 'observaciones', 0
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Trigger por sentencia: +1 por cada fila nueva y -1 por cada anterior. TG_ARGV[0] es la función de claves.
+CREATE FUNCTION estadisticas_aplicar() RETURNS trigger AS $$
+DECLARE
+    tipo TEXT := TG_RELID::regclass::TEXT;
+    filas TEXT;
+BEGIN
+    -- Las tablas de transición exponen filas anónimas: ROW(...)::tipo las vuelve del tipo de la tabla
+    filas := CASE TG_OP
+        WHEN 'INSERT' THEN format('SELECT ROW(n.*)::%s AS fila, 1 AS signo FROM nuevas n', tipo)
+        WHEN 'DELETE' THEN format('SELECT ROW(a.*)::%s AS fila, -1 AS signo FROM anteriores a', tipo)
+        ELSE format('SELECT ROW(n.*)::%1$s AS fila, 1 AS signo FROM nuevas n '
+                    'UNION ALL SELECT ROW(a.*)::%1$s, -1 FROM anteriores a', tipo)
+    END;
+    EXECUTE format($q$
+        INSERT INTO estadisticas (dimension, clave, fragmento, total)
+        SELECT c.dimension, c.clave, pg_backend_pid() %% 8, SUM(f.signo)
+        FROM (%s) f, LATERAL %I(f.fila) c
+        GROUP BY c.dimension, c.clave
+        HAVING SUM(f.signo) <> 0
+        ON CONFLICT (dimension, clave, fragmento) DO UPDATE SET total = estadisticas.total + EXCLUDED.total
+    $q$, filas, TG_ARGV[0]);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER estadisticas_usuarios_insert AFTER INSERT ON usuarios
+    REFERENCING NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION estadisticas_aplicar('estadisticas_claves_usuario');
+CREATE TRIGGER estadisticas_usuarios_update AFTER UPDATE ON usuarios
+    REFERENCING OLD TABLE AS anteriores NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION estadisticas_aplicar('estadisticas_claves_usuario');
+CREATE TRIGGER estadisticas_usuarios_delete AFTER DELETE ON usuarios
+    REFERENCING OLD TABLE AS anteriores FOR EACH STATEMENT EXECUTE FUNCTION estadisticas_aplicar('estadisticas_claves_usuario');
+
+CREATE TRIGGER estadisticas_encuentros_insert AFTER INSERT ON encuentros_medicos
+    REFERENCING NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION estadisticas_aplicar('estadisticas_claves_encuentro');
+CREATE TRIGGER estadisticas_encuentros_update AFTER UPDATE ON encuentros_medicos
+    REFERENCING OLD TABLE AS anteriores NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION estadisticas_aplicar('estadisticas_claves_encuentro');
+CREATE TRIGGER estadisticas_encuentros_delete AFTER DELETE ON encuentros_medicos
+    REFERENCING OLD TABLE AS anteriores FOR EACH STATEMENT EXECUTE FUNCTION estadisticas_aplicar('estadisticas_claves_encuentro');
+
+CREATE TRIGGER estadisticas_observaciones_insert AFTER INSERT ON observaciones_clinicas
+    REFERENCING NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION estadisticas_aplicar('estadisticas_claves_observacion');
+CREATE TRIGGER estadisticas_observaciones_delete AFTER DELETE ON observaciones_clinicas
+    REFERENCING OLD TABLE AS anteriores FOR EACH STATEMENT EXECUTE FUNCTION estadisticas_aplicar('estadisticas_claves_observacion');
+
+-- Reconciliación: corrige los contadores desviados respecto de las tablas base (TRUNCATE, cargas con
+-- los triggers desactivados, restauraciones) y devuelve cuántos lo estaban, o NULL si otra sesión ya la
+-- está corriendo. No bloquea a los escritores: el recuento y la suma de los contadores salen de una
+-- misma sentencia, y por tanto de una misma foto MVCC, así que su diferencia es exactamente la
+-- desviación. Se aplica como un delta más, igual que los triggers, encima de lo que otras
+-- transacciones confirmen mientras tanto.
+CREATE FUNCTION estadisticas_diferencias() RETURNS TABLE(dimension TEXT, clave INTEGER, delta BIGINT) AS $$
+    WITH recuento AS (
+        SELECT c.dimension, c.clave, COUNT(*)::BIGINT AS total
+        FROM usuarios u, LATERAL estadisticas_claves_usuario(u) c GROUP BY c.dimension, c.clave
+        UNION ALL
+        SELECT c.dimension, c.clave, COUNT(*)::BIGINT
+        FROM (SELECT * FROM encuentros_medicos UNION ALL SELECT * FROM archivo.encuentros_medicos) e,
+             LATERAL estadisticas_claves_encuentro(ROW(e.*)::encuentros_medicos) c
+        GROUP BY c.dimension, c.clave
+        UNION ALL
+        SELECT 'observaciones', 0, (SELECT COUNT(*) FROM observaciones_clinicas) + (SELECT COUNT(*) FROM archivo.observaciones_clinicas)
+    )
+    SELECT dimension, clave, (COALESCE(r.total, 0) - COALESCE(a.total, 0))::BIGINT
+    FROM (SELECT dimension, clave, SUM(total) AS total FROM estadisticas GROUP BY dimension, clave) a
+    FULL JOIN recuento r USING (dimension, clave)
+    WHERE COALESCE(a.total, 0) <> COALESCE(r.total, 0)
+$$ LANGUAGE sql STABLE;
+
+CREATE FUNCTION estadisticas_reconciliar() RETURNS INTEGER AS $$
+DECLARE
+    desviados INTEGER;
+BEGIN
+    -- Dos reconciliaciones a la vez aplicarían dos veces el mismo delta
+    IF NOT pg_try_advisory_xact_lock(740012) THEN
+        RETURN NULL;
+    END IF;
+
+    WITH aplicados AS (
+        INSERT INTO estadisticas (dimension, clave, fragmento, total)
+        SELECT dimension, clave, 0, delta FROM estadisticas_diferencias()
+        ON CONFLICT (dimension, clave, fragmento) DO UPDATE SET total = estadisticas.total + EXCLUDED.total
+        RETURNING 1
+    )
+    SELECT COUNT(*) INTO desviados FROM aplicados;
+
+    -- Fragmentos en cero: sólo bloquea esas filas
+    DELETE FROM estadisticas WHERE total = 0;
+    RETURN desviados;
+END
+$$ LANGUAGE plpgsql;
+
+-- Series de tiempo (GET /reportes/series): encuentros y observaciones por día, sede, tipo y médico.
+-- Se mantienen igual que las estadísticas, con triggers por sentencia; semanas y meses se agregan al
+-- consultar desde los días. 0 en sede_id/tipo_id/medico_id es "sin dato". Las observaciones cuentan
+-- en el tipo y médico de su encuentro.
+CREATE TABLE series_diarias (
+    dia DATE NOT NULL,
+    sede_id INTEGER NOT NULL DEFAULT 0,
+    tipo_id INTEGER NOT NULL DEFAULT 0,
+    medico_id INTEGER NOT NULL DEFAULT 0,
+    encuentros BIGINT NOT NULL DEFAULT 0,
+    observaciones BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (dia, sede_id, tipo_id, medico_id)
+);
+
+-- Filas de las tablas de transición con su signo: +1 las nuevas, -1 las anteriores
+CREATE FUNCTION series_filas(operacion TEXT) RETURNS TEXT AS $$
+    SELECT CASE operacion
+        WHEN 'INSERT' THEN 'SELECT n.*, 1 AS signo FROM nuevas n'
+        WHEN 'DELETE' THEN 'SELECT a.*, -1 AS signo FROM anteriores a'
+        ELSE 'SELECT n.*, 1 AS signo FROM nuevas n UNION ALL SELECT a.*, -1 FROM anteriores a'
+    END
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE FUNCTION series_encuentros() RETURNS trigger AS $$
+BEGIN
+    EXECUTE format($q$
+        INSERT INTO series_diarias AS s (dia, sede_id, tipo_id, medico_id, encuentros)
+        SELECT f.fecha::DATE, COALESCE(f.sede_id, 0), COALESCE(f.tipo_id, 0), COALESCE(f.medico_id, 0), SUM(f.signo)
+        FROM (%s) f
+        GROUP BY 1, 2, 3, 4
+        HAVING SUM(f.signo) <> 0
+        ON CONFLICT (dia, sede_id, tipo_id, medico_id) DO UPDATE SET encuentros = s.encuentros + EXCLUDED.encuentros
+    $q$, series_filas(TG_OP));
+
+    IF TG_OP = 'UPDATE' THEN
+        -- Si el encuentro cambia de tipo o de médico, sus observaciones se mueven con él
+        INSERT INTO series_diarias AS s (dia, sede_id, tipo_id, medico_id, observaciones)
+        SELECT o.fecha::DATE, COALESCE(o.sede_id, 0), c.tipo_id, c.medico_id, SUM(c.signo)
+        FROM (
+            SELECT n.id, COALESCE(n.tipo_id, 0) AS tipo_id, COALESCE(n.medico_id, 0) AS medico_id, 1 AS signo
+            FROM nuevas n JOIN anteriores a ON a.id = n.id
+            WHERE (n.tipo_id, n.medico_id) IS DISTINCT FROM (a.tipo_id, a.medico_id)
+            UNION ALL
+            SELECT a.id, COALESCE(a.tipo_id, 0), COALESCE(a.medico_id, 0), -1
+            FROM nuevas n JOIN anteriores a ON a.id = n.id
+            WHERE (n.tipo_id, n.medico_id) IS DISTINCT FROM (a.tipo_id, a.medico_id)
+        ) c JOIN observaciones_clinicas o ON o.encuentro_id = c.id
+        GROUP BY 1, 2, 3, 4
+        HAVING SUM(c.signo) <> 0
+        ON CONFLICT (dia, sede_id, tipo_id, medico_id) DO UPDATE SET observaciones = s.observaciones + EXCLUDED.observaciones;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION series_observaciones() RETURNS trigger AS $$
+BEGIN
+    EXECUTE format($q$
+        INSERT INTO series_diarias AS s (dia, sede_id, tipo_id, medico_id, observaciones)
+        SELECT f.fecha::DATE, COALESCE(f.sede_id, 0), COALESCE(e.tipo_id, 0), COALESCE(e.medico_id, 0), SUM(f.signo)
+        FROM (%s) f LEFT JOIN encuentros_medicos e ON e.id = f.encuentro_id
+        GROUP BY 1, 2, 3, 4
+        HAVING SUM(f.signo) <> 0
+        ON CONFLICT (dia, sede_id, tipo_id, medico_id) DO UPDATE SET observaciones = s.observaciones + EXCLUDED.observaciones
+    $q$, series_filas(TG_OP));
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER series_encuentros_insert AFTER INSERT ON encuentros_medicos
+    REFERENCING NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION series_encuentros();
+CREATE TRIGGER series_encuentros_update AFTER UPDATE ON encuentros_medicos
+    REFERENCING OLD TABLE AS anteriores NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION series_encuentros();
+CREATE TRIGGER series_encuentros_delete AFTER DELETE ON encuentros_medicos
+    REFERENCING OLD TABLE AS anteriores FOR EACH STATEMENT EXECUTE FUNCTION series_encuentros();
+
+CREATE TRIGGER series_observaciones_insert AFTER INSERT ON observaciones_clinicas
+    REFERENCING NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION series_observaciones();
+CREATE TRIGGER series_observaciones_update AFTER UPDATE ON observaciones_clinicas
+    REFERENCING OLD TABLE AS anteriores NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION series_observaciones();
+CREATE TRIGGER series_observaciones_delete AFTER DELETE ON observaciones_clinicas
+    REFERENCING OLD TABLE AS anteriores FOR EACH STATEMENT EXECUTE FUNCTION series_observaciones();
+
+-- Reconciliación contra las tablas base; la corre la misma pasada periódica que las estadísticas, en su
+-- propia transacción. Como estadisticas_reconciliar: diferencia calculada en una sola foto MVCC y
+-- aplicada como delta por fila, sin bloquear a los escritores.
+CREATE FUNCTION series_diferencias() RETURNS TABLE(dia DATE, sede_id INTEGER, tipo_id INTEGER, medico_id INTEGER,
+                                                   encuentros BIGINT, observaciones BIGINT) AS $$
+    WITH recuento AS (
+        SELECT dia, sede_id, tipo_id, medico_id, SUM(encuentros)::BIGINT AS encuentros, SUM(observaciones)::BIGINT AS observaciones
+        FROM (
+            SELECT fecha::DATE AS dia, COALESCE(sede_id, 0) AS sede_id, COALESCE(tipo_id, 0) AS tipo_id,
+                   COALESCE(medico_id, 0) AS medico_id, COUNT(*) AS encuentros, 0 AS observaciones
+            FROM (SELECT * FROM encuentros_medicos UNION ALL SELECT * FROM archivo.encuentros_medicos) e GROUP BY 1, 2, 3, 4
+            UNION ALL
+            SELECT o.fecha::DATE, COALESCE(o.sede_id, 0), COALESCE(e.tipo_id, 0), COALESCE(e.medico_id, 0), 0, COUNT(*)
+            FROM (SELECT * FROM observaciones_clinicas UNION ALL SELECT * FROM archivo.observaciones_clinicas) o
+            LEFT JOIN (SELECT * FROM encuentros_medicos UNION ALL SELECT * FROM archivo.encuentros_medicos) e ON e.id = o.encuentro_id
+            GROUP BY 1, 2, 3, 4
+        ) t GROUP BY 1, 2, 3, 4
+    )
+    SELECT dia, sede_id, tipo_id, medico_id,
+           (COALESCE(r.encuentros, 0) - COALESCE(a.encuentros, 0))::BIGINT,
+           (COALESCE(r.observaciones, 0) - COALESCE(a.observaciones, 0))::BIGINT
+    FROM series_diarias a
+    FULL JOIN recuento r USING (dia, sede_id, tipo_id, medico_id)
+    WHERE (COALESCE(a.encuentros, 0), COALESCE(a.observaciones, 0)) <> (COALESCE(r.encuentros, 0), COALESCE(r.observaciones, 0))
+$$ LANGUAGE sql STABLE;
+
+CREATE FUNCTION series_reconciliar() RETURNS INTEGER AS $$
+DECLARE
+    desviados INTEGER;
+BEGIN
+    IF NOT pg_try_advisory_xact_lock(740012) THEN
+        RETURN NULL;
+    END IF;
+
+    WITH aplicados AS (
+        INSERT INTO series_diarias AS s (dia, sede_id, tipo_id, medico_id, encuentros, observaciones)
+        SELECT * FROM series_diferencias()
+        ON CONFLICT (dia, sede_id, tipo_id, medico_id) DO UPDATE
+            SET encuentros = s.encuentros + EXCLUDED.encuentros, observaciones = s.observaciones + EXCLUDED.observaciones
+        RETURNING 1
+    )
+    SELECT COUNT(*) INTO desviados FROM aplicados;
+
+    DELETE FROM series_diarias WHERE encuentros = 0 AND observaciones = 0;
+    RETURN desviados;
+END
+$$ LANGUAGE plpgsql;
+
+-- Read-your-writes por usuario con réplica de lectura (app/database.py): última escritura de cada
+-- usuario autenticado, consultada sólo en el primario. UNLOGGED: no genera WAL ni se replica.
+CREATE UNLOGGED TABLE escrituras_recientes (
+    numero_documento VARCHAR(50) PRIMARY KEY,
+    momento TIMESTAMPTZ NOT NULL DEFAULT now()
+);
 
 -- Datos iniciales
 INSERT INTO tipos_documentos (nombre, prefijo) VALUES
@@ -120,3 +538,23 @@ INSERT INTO sedes (nombre, ciudad, direccion) VALUES
 ('Sede Principal', 'Bogotá', 'Calle 100 #15-20'),
 ('Sede Norte', 'Bogotá', 'Carrera 7 #120-30'),
 ('Sede Sur', 'Bogotá', 'Avenida 68 #50-10');
+
+-- Migraciones versionadas (python -m app.migraciones): este esquema ya incluye las de postgres/migraciones
+-- hasta la versión registrada aquí. Al agregar una migración, reflejar el cambio arriba y su versión abajo.
+CREATE TABLE schema_migraciones (
+    version VARCHAR(10) PRIMARY KEY,
+    nombre VARCHAR(200) NOT NULL,
+    checksum VARCHAR(64),
+    aplicada_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO schema_migraciones (version, nombre) VALUES
+('003', '003_outbox_fhir.sql'),
+('011', '011_sincronizacion_entrante.sql'),
+('012', '012_observaciones_tipadas.sql'),
+('016', '016_indices_paginacion.sql'),
+('017', '017_estadisticas.sql'),
+('018', '018_series_diarias.sql'),
+('019', '019_particionar_encuentros.sql'),
+('020', '020_busqueda_pacientes.sql'),
+('021', '021_escrituras_recientes.sql');
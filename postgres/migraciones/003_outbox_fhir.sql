@@ -0,0 +1,18 @@
+-- Outbox de sincronización con HAPI FHIR sobre una base existente, como la crea init.sql:
+--   python -m app.migraciones aplicar --hasta 003
+-- Se puede volver a correr: sólo crea lo que falte.
+
+CREATE TABLE IF NOT EXISTS outbox_fhir (
+    id SERIAL PRIMARY KEY,
+    operacion VARCHAR(50) NOT NULL,
+    entidad_id INTEGER,
+    payload JSONB DEFAULT '{}'::jsonb,
+    estado VARCHAR(20) NOT NULL DEFAULT 'pendiente' CHECK (estado IN ('pendiente', 'completado', 'fallido')),
+    intentos INTEGER NOT NULL DEFAULT 0,
+    proximo_intento TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    ultimo_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    procesado_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_outbox_pendientes ON outbox_fhir(proximo_intento, id) WHERE estado = 'pendiente';
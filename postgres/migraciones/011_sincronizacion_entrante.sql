@@ -0,0 +1,18 @@
+-- Sincronización entrante desde HAPI (app/services/fhir_sync.py) sobre una base existente:
+--   python -m app.migraciones aplicar --hasta 011
+-- Marcas de agua por tipo de recurso, id del Practitioner de los médicos e índices por id FHIR para
+-- resolver las referencias de los recursos que llegan. Se puede volver a correr.
+
+ALTER TABLE usuarios ADD COLUMN IF NOT EXISTS fhir_practitioner_id VARCHAR(100);
+
+CREATE TABLE IF NOT EXISTS marcas_agua_fhir (
+    tipo_recurso VARCHAR(50) PRIMARY KEY,
+    ultima_actualizacion VARCHAR(40),
+    recursos_procesados INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_usuarios_fhir_patient ON usuarios(fhir_patient_id);
+CREATE INDEX IF NOT EXISTS idx_usuarios_fhir_practitioner ON usuarios(fhir_practitioner_id);
+CREATE INDEX IF NOT EXISTS idx_encuentros_fhir ON encuentros_medicos(fhir_encounter_id);
+CREATE INDEX IF NOT EXISTS idx_observaciones_fhir ON observaciones_clinicas(fhir_observation_id);
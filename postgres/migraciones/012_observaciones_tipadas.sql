@@ -0,0 +1,14 @@
+-- Valor numérico, unidad normalizada y presión arterial de las observaciones sobre una base existente:
+--   python -m app.migraciones aplicar --hasta 012
+-- Las columnas nuevas quedan en NULL para las filas ya guardadas; se llenan después, por lotes y sin
+-- detener la aplicación, con python -m app.normalizar_observaciones. Se puede volver a correr.
+
+ALTER TABLE observaciones_clinicas
+    ADD COLUMN IF NOT EXISTS valor_numerico DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS valor_normalizado DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS unidad_normalizada VARCHAR(20),
+    ADD COLUMN IF NOT EXISTS presion_sistolica DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS presion_diastolica DOUBLE PRECISION;
+
+CREATE INDEX IF NOT EXISTS idx_observaciones_loinc_valor ON observaciones_clinicas(codigo_loinc, unidad_normalizada, valor_normalizado) WHERE valor_normalizado IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_observaciones_presion ON observaciones_clinicas(presion_sistolica, presion_diastolica) WHERE presion_sistolica IS NOT NULL;
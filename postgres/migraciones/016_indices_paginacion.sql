@@ -0,0 +1,28 @@
+-- Índices de los listados paginados por (fecha, id) descendente sobre una base existente:
+--   python -m app.migraciones aplicar --hasta 016
+-- Los índices se construyen con CONCURRENTLY (fuera de transacción): la aplicación puede seguir arriba.
+-- Los que cambian de columnas conservan su nombre: se construye el nuevo aparte, se borra el anterior y
+-- se renombra, así que volver a correrla tras un fallo a mitad termina lo que faltaba.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_usuarios_rol_nuevo ON usuarios(rol_id, id);
+DROP INDEX CONCURRENTLY IF EXISTS idx_usuarios_rol;
+ALTER INDEX idx_usuarios_rol_nuevo RENAME TO idx_usuarios_rol;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_encuentros_fecha_nuevo ON encuentros_medicos(fecha DESC, id DESC);
+DROP INDEX CONCURRENTLY IF EXISTS idx_encuentros_fecha;
+ALTER INDEX idx_encuentros_fecha_nuevo RENAME TO idx_encuentros_fecha;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_encuentros_paciente_nuevo ON encuentros_medicos(paciente_id, fecha DESC, id DESC);
+DROP INDEX CONCURRENTLY IF EXISTS idx_encuentros_paciente;
+ALTER INDEX idx_encuentros_paciente_nuevo RENAME TO idx_encuentros_paciente;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_encuentros_medico_nuevo ON encuentros_medicos(medico_id, fecha DESC, id DESC);
+DROP INDEX CONCURRENTLY IF EXISTS idx_encuentros_medico;
+ALTER INDEX idx_encuentros_medico_nuevo RENAME TO idx_encuentros_medico;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_usuarios_sede ON usuarios(sede_registro_id, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_encuentros_sede ON encuentros_medicos(sede_id, fecha DESC, id DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_encuentros_icd10 ON encuentros_medicos(diagnostico_codigo_icd10 text_pattern_ops, fecha DESC, id DESC);
+
+ANALYZE usuarios;
+ANALYZE encuentros_medicos;
@@ -0,0 +1,135 @@
+-- Estadísticas mantenidas por triggers (GET /reportes/estadisticas) sobre una base existente:
+--   python -m app.migraciones aplicar --hasta 017
+-- Se puede volver a correr: recrea funciones y triggers, y la reconciliación final llena los contadores
+-- con lo que ya hay en las tablas (o corrige lo que se haya desviado). Mientras se crean los triggers
+-- las escrituras sobre usuarios, encuentros y observaciones esperan hasta el final de la transacción.
+
+-- Estadísticas mantenidas por triggers (GET /reportes/estadisticas)
+-- Cada sentencia que escribe en usuarios, encuentros_medicos u observaciones_clinicas suma sus deltas
+-- por (dimension, clave) desde las tablas de transición: el tablero lee unas pocas filas sin importar
+-- el tamaño del historial. El fragmento reparte los contadores calientes (p. ej. el total de encuentros)
+-- entre varias filas para que las sesiones concurrentes no se bloqueen entre sí; se suman al leer.
+CREATE TABLE IF NOT EXISTS estadisticas (
+    dimension VARCHAR(30) NOT NULL,
+    clave INTEGER NOT NULL DEFAULT 0,
+    fragmento SMALLINT NOT NULL DEFAULT 0,
+    total BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (dimension, clave, fragmento)
+);
+
+-- Contadores a los que aporta cada fila
+CREATE OR REPLACE FUNCTION estadisticas_claves_usuario(u usuarios) RETURNS TABLE(dimension TEXT, clave INTEGER) AS $$
+    SELECT 'usuarios_rol', u.rol_id WHERE u.rol_id IS NOT NULL
+    UNION ALL SELECT 'usuarios_activo', u.activo::INTEGER WHERE u.activo IS NOT NULL
+    UNION ALL SELECT 'pacientes_fhir', 0 WHERE u.fhir_patient_id IS NOT NULL
+    UNION ALL SELECT 'medicos_fhir', 0 WHERE u.fhir_practitioner_id IS NOT NULL
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION estadisticas_claves_encuentro(e encuentros_medicos) RETURNS TABLE(dimension TEXT, clave INTEGER) AS $$
+    SELECT 'encuentros', 0
+    UNION ALL SELECT 'encuentros_tipo', e.tipo_id WHERE e.tipo_id IS NOT NULL
+    UNION ALL SELECT 'encuentros_sede', e.sede_id WHERE e.sede_id IS NOT NULL
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION estadisticas_claves_observacion(o observaciones_clinicas) RETURNS TABLE(dimension TEXT, clave INTEGER) AS $$
+    SELECT 'observaciones', 0
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Trigger por sentencia: +1 por cada fila nueva y -1 por cada anterior. TG_ARGV[0] es la función de claves.
+CREATE OR REPLACE FUNCTION estadisticas_aplicar() RETURNS trigger AS $$
+DECLARE
+    tipo TEXT := TG_RELID::regclass::TEXT;
+    filas TEXT;
+BEGIN
+    -- Las tablas de transición exponen filas anónimas: ROW(...)::tipo las vuelve del tipo de la tabla
+    filas := CASE TG_OP
+        WHEN 'INSERT' THEN format('SELECT ROW(n.*)::%s AS fila, 1 AS signo FROM nuevas n', tipo)
+        WHEN 'DELETE' THEN format('SELECT ROW(a.*)::%s AS fila, -1 AS signo FROM anteriores a', tipo)
+        ELSE format('SELECT ROW(n.*)::%1$s AS fila, 1 AS signo FROM nuevas n '
+                    'UNION ALL SELECT ROW(a.*)::%1$s, -1 FROM anteriores a', tipo)
+    END;
+    EXECUTE format($q$
+        INSERT INTO estadisticas (dimension, clave, fragmento, total)
+        SELECT c.dimension, c.clave, pg_backend_pid() %% 8, SUM(f.signo)
+        FROM (%s) f, LATERAL %I(f.fila) c
+        GROUP BY c.dimension, c.clave
+        HAVING SUM(f.signo) <> 0
+        ON CONFLICT (dimension, clave, fragmento) DO UPDATE SET total = estadisticas.total + EXCLUDED.total
+    $q$, filas, TG_ARGV[0]);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS estadisticas_usuarios_insert ON usuarios;
+CREATE TRIGGER estadisticas_usuarios_insert AFTER INSERT ON usuarios
+    REFERENCING NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION estadisticas_aplicar('estadisticas_claves_usuario');
+DROP TRIGGER IF EXISTS estadisticas_usuarios_update ON usuarios;
+CREATE TRIGGER estadisticas_usuarios_update AFTER UPDATE ON usuarios
+    REFERENCING OLD TABLE AS anteriores NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION estadisticas_aplicar('estadisticas_claves_usuario');
+DROP TRIGGER IF EXISTS estadisticas_usuarios_delete ON usuarios;
+CREATE TRIGGER estadisticas_usuarios_delete AFTER DELETE ON usuarios
+    REFERENCING OLD TABLE AS anteriores FOR EACH STATEMENT EXECUTE FUNCTION estadisticas_aplicar('estadisticas_claves_usuario');
+
+DROP TRIGGER IF EXISTS estadisticas_encuentros_insert ON encuentros_medicos;
+CREATE TRIGGER estadisticas_encuentros_insert AFTER INSERT ON encuentros_medicos
+    REFERENCING NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION estadisticas_aplicar('estadisticas_claves_encuentro');
+DROP TRIGGER IF EXISTS estadisticas_encuentros_update ON encuentros_medicos;
+CREATE TRIGGER estadisticas_encuentros_update AFTER UPDATE ON encuentros_medicos
+    REFERENCING OLD TABLE AS anteriores NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION estadisticas_aplicar('estadisticas_claves_encuentro');
+DROP TRIGGER IF EXISTS estadisticas_encuentros_delete ON encuentros_medicos;
+CREATE TRIGGER estadisticas_encuentros_delete AFTER DELETE ON encuentros_medicos
+    REFERENCING OLD TABLE AS anteriores FOR EACH STATEMENT EXECUTE FUNCTION estadisticas_aplicar('estadisticas_claves_encuentro');
+
+DROP TRIGGER IF EXISTS estadisticas_observaciones_insert ON observaciones_clinicas;
+CREATE TRIGGER estadisticas_observaciones_insert AFTER INSERT ON observaciones_clinicas
+    REFERENCING NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION estadisticas_aplicar('estadisticas_claves_observacion');
+DROP TRIGGER IF EXISTS estadisticas_observaciones_delete ON observaciones_clinicas;
+CREATE TRIGGER estadisticas_observaciones_delete AFTER DELETE ON observaciones_clinicas
+    REFERENCING OLD TABLE AS anteriores FOR EACH STATEMENT EXECUTE FUNCTION estadisticas_aplicar('estadisticas_claves_observacion');
+
+-- Reconciliación: corrige los contadores desviados respecto de las tablas base (TRUNCATE, cargas con
+-- los triggers desactivados, restauraciones) y devuelve cuántos lo estaban, o NULL si otra sesión ya la
+-- está corriendo. No bloquea a los escritores: el recuento y la suma de los contadores salen de una
+-- misma sentencia, y por tanto de una misma foto MVCC, así que su diferencia es exactamente la
+-- desviación. Se aplica como un delta más, igual que los triggers, encima de lo que otras
+-- transacciones confirmen mientras tanto. 019 la redefine para contar también las particiones archivadas.
+CREATE OR REPLACE FUNCTION estadisticas_diferencias() RETURNS TABLE(dimension TEXT, clave INTEGER, delta BIGINT) AS $$
+    WITH recuento AS (
+        SELECT c.dimension, c.clave, COUNT(*)::BIGINT AS total
+        FROM usuarios u, LATERAL estadisticas_claves_usuario(u) c GROUP BY c.dimension, c.clave
+        UNION ALL
+        SELECT c.dimension, c.clave, COUNT(*)::BIGINT
+        FROM encuentros_medicos e, LATERAL estadisticas_claves_encuentro(e) c GROUP BY c.dimension, c.clave
+        UNION ALL
+        SELECT 'observaciones', 0, COUNT(*)::BIGINT FROM observaciones_clinicas
+    )
+    SELECT dimension, clave, (COALESCE(r.total, 0) - COALESCE(a.total, 0))::BIGINT
+    FROM (SELECT dimension, clave, SUM(total) AS total FROM estadisticas GROUP BY dimension, clave) a
+    FULL JOIN recuento r USING (dimension, clave)
+    WHERE COALESCE(a.total, 0) <> COALESCE(r.total, 0)
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION estadisticas_reconciliar() RETURNS INTEGER AS $$
+DECLARE
+    desviados INTEGER;
+BEGIN
+    -- Dos reconciliaciones a la vez aplicarían dos veces el mismo delta
+    IF NOT pg_try_advisory_xact_lock(740012) THEN
+        RETURN NULL;
+    END IF;
+
+    WITH aplicados AS (
+        INSERT INTO estadisticas (dimension, clave, fragmento, total)
+        SELECT dimension, clave, 0, delta FROM estadisticas_diferencias()
+        ON CONFLICT (dimension, clave, fragmento) DO UPDATE SET total = estadisticas.total + EXCLUDED.total
+        RETURNING 1
+    )
+    SELECT COUNT(*) INTO desviados FROM aplicados;
+
+    -- Fragmentos en cero: sólo bloquea esas filas
+    DELETE FROM estadisticas WHERE total = 0;
+    RETURN desviados;
+END
+$$ LANGUAGE plpgsql;
+
+SELECT estadisticas_reconciliar();
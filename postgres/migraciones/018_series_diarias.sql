@@ -0,0 +1,145 @@
+-- Series de tiempo diarias (GET /reportes/series) sobre una base existente:
+--   python -m app.migraciones aplicar --hasta 018
+-- Como 017: se puede volver a correr, y la reconciliación final llena las series con el historial que
+-- ya existe. Incluye el índice BRIN por fecha de observaciones_clinicas.
+
+CREATE INDEX IF NOT EXISTS idx_observaciones_fecha ON observaciones_clinicas USING brin(fecha);
+
+-- Series de tiempo (GET /reportes/series): encuentros y observaciones por día, sede, tipo y médico.
+-- Se mantienen igual que las estadísticas, con triggers por sentencia; semanas y meses se agregan al
+-- consultar desde los días. 0 en sede_id/tipo_id/medico_id es "sin dato". Las observaciones cuentan
+-- en el tipo y médico de su encuentro.
+CREATE TABLE IF NOT EXISTS series_diarias (
+    dia DATE NOT NULL,
+    sede_id INTEGER NOT NULL DEFAULT 0,
+    tipo_id INTEGER NOT NULL DEFAULT 0,
+    medico_id INTEGER NOT NULL DEFAULT 0,
+    encuentros BIGINT NOT NULL DEFAULT 0,
+    observaciones BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (dia, sede_id, tipo_id, medico_id)
+);
+
+-- Filas de las tablas de transición con su signo: +1 las nuevas, -1 las anteriores
+CREATE OR REPLACE FUNCTION series_filas(operacion TEXT) RETURNS TEXT AS $$
+    SELECT CASE operacion
+        WHEN 'INSERT' THEN 'SELECT n.*, 1 AS signo FROM nuevas n'
+        WHEN 'DELETE' THEN 'SELECT a.*, -1 AS signo FROM anteriores a'
+        ELSE 'SELECT n.*, 1 AS signo FROM nuevas n UNION ALL SELECT a.*, -1 FROM anteriores a'
+    END
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION series_encuentros() RETURNS trigger AS $$
+BEGIN
+    EXECUTE format($q$
+        INSERT INTO series_diarias AS s (dia, sede_id, tipo_id, medico_id, encuentros)
+        SELECT f.fecha::DATE, COALESCE(f.sede_id, 0), COALESCE(f.tipo_id, 0), COALESCE(f.medico_id, 0), SUM(f.signo)
+        FROM (%s) f
+        GROUP BY 1, 2, 3, 4
+        HAVING SUM(f.signo) <> 0
+        ON CONFLICT (dia, sede_id, tipo_id, medico_id) DO UPDATE SET encuentros = s.encuentros + EXCLUDED.encuentros
+    $q$, series_filas(TG_OP));
+
+    IF TG_OP = 'UPDATE' THEN
+        -- Si el encuentro cambia de tipo o de médico, sus observaciones se mueven con él
+        INSERT INTO series_diarias AS s (dia, sede_id, tipo_id, medico_id, observaciones)
+        SELECT o.fecha::DATE, COALESCE(o.sede_id, 0), c.tipo_id, c.medico_id, SUM(c.signo)
+        FROM (
+            SELECT n.id, COALESCE(n.tipo_id, 0) AS tipo_id, COALESCE(n.medico_id, 0) AS medico_id, 1 AS signo
+            FROM nuevas n JOIN anteriores a ON a.id = n.id
+            WHERE (n.tipo_id, n.medico_id) IS DISTINCT FROM (a.tipo_id, a.medico_id)
+            UNION ALL
+            SELECT a.id, COALESCE(a.tipo_id, 0), COALESCE(a.medico_id, 0), -1
+            FROM nuevas n JOIN anteriores a ON a.id = n.id
+            WHERE (n.tipo_id, n.medico_id) IS DISTINCT FROM (a.tipo_id, a.medico_id)
+        ) c JOIN observaciones_clinicas o ON o.encuentro_id = c.id
+        GROUP BY 1, 2, 3, 4
+        HAVING SUM(c.signo) <> 0
+        ON CONFLICT (dia, sede_id, tipo_id, medico_id) DO UPDATE SET observaciones = s.observaciones + EXCLUDED.observaciones;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION series_observaciones() RETURNS trigger AS $$
+BEGIN
+    EXECUTE format($q$
+        INSERT INTO series_diarias AS s (dia, sede_id, tipo_id, medico_id, observaciones)
+        SELECT f.fecha::DATE, COALESCE(f.sede_id, 0), COALESCE(e.tipo_id, 0), COALESCE(e.medico_id, 0), SUM(f.signo)
+        FROM (%s) f LEFT JOIN encuentros_medicos e ON e.id = f.encuentro_id
+        GROUP BY 1, 2, 3, 4
+        HAVING SUM(f.signo) <> 0
+        ON CONFLICT (dia, sede_id, tipo_id, medico_id) DO UPDATE SET observaciones = s.observaciones + EXCLUDED.observaciones
+    $q$, series_filas(TG_OP));
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS series_encuentros_insert ON encuentros_medicos;
+CREATE TRIGGER series_encuentros_insert AFTER INSERT ON encuentros_medicos
+    REFERENCING NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION series_encuentros();
+DROP TRIGGER IF EXISTS series_encuentros_update ON encuentros_medicos;
+CREATE TRIGGER series_encuentros_update AFTER UPDATE ON encuentros_medicos
+    REFERENCING OLD TABLE AS anteriores NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION series_encuentros();
+DROP TRIGGER IF EXISTS series_encuentros_delete ON encuentros_medicos;
+CREATE TRIGGER series_encuentros_delete AFTER DELETE ON encuentros_medicos
+    REFERENCING OLD TABLE AS anteriores FOR EACH STATEMENT EXECUTE FUNCTION series_encuentros();
+
+DROP TRIGGER IF EXISTS series_observaciones_insert ON observaciones_clinicas;
+CREATE TRIGGER series_observaciones_insert AFTER INSERT ON observaciones_clinicas
+    REFERENCING NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION series_observaciones();
+DROP TRIGGER IF EXISTS series_observaciones_update ON observaciones_clinicas;
+CREATE TRIGGER series_observaciones_update AFTER UPDATE ON observaciones_clinicas
+    REFERENCING OLD TABLE AS anteriores NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION series_observaciones();
+DROP TRIGGER IF EXISTS series_observaciones_delete ON observaciones_clinicas;
+CREATE TRIGGER series_observaciones_delete AFTER DELETE ON observaciones_clinicas
+    REFERENCING OLD TABLE AS anteriores FOR EACH STATEMENT EXECUTE FUNCTION series_observaciones();
+
+-- Reconciliación contra las tablas base; la corre la misma pasada periódica que las estadísticas, en su
+-- propia transacción. Como estadisticas_reconciliar: diferencia calculada en una sola foto MVCC y
+-- aplicada como delta por fila, sin bloquear a los escritores. 019 la redefine para contar también las
+-- particiones archivadas.
+CREATE OR REPLACE FUNCTION series_diferencias() RETURNS TABLE(dia DATE, sede_id INTEGER, tipo_id INTEGER, medico_id INTEGER,
+                                                   encuentros BIGINT, observaciones BIGINT) AS $$
+    WITH recuento AS (
+        SELECT dia, sede_id, tipo_id, medico_id, SUM(encuentros)::BIGINT AS encuentros, SUM(observaciones)::BIGINT AS observaciones
+        FROM (
+            SELECT fecha::DATE AS dia, COALESCE(sede_id, 0) AS sede_id, COALESCE(tipo_id, 0) AS tipo_id,
+                   COALESCE(medico_id, 0) AS medico_id, COUNT(*) AS encuentros, 0 AS observaciones
+            FROM encuentros_medicos GROUP BY 1, 2, 3, 4
+            UNION ALL
+            SELECT o.fecha::DATE, COALESCE(o.sede_id, 0), COALESCE(e.tipo_id, 0), COALESCE(e.medico_id, 0), 0, COUNT(*)
+            FROM observaciones_clinicas o LEFT JOIN encuentros_medicos e ON e.id = o.encuentro_id
+            GROUP BY 1, 2, 3, 4
+        ) t GROUP BY 1, 2, 3, 4
+    )
+    SELECT dia, sede_id, tipo_id, medico_id,
+           (COALESCE(r.encuentros, 0) - COALESCE(a.encuentros, 0))::BIGINT,
+           (COALESCE(r.observaciones, 0) - COALESCE(a.observaciones, 0))::BIGINT
+    FROM series_diarias a
+    FULL JOIN recuento r USING (dia, sede_id, tipo_id, medico_id)
+    WHERE (COALESCE(a.encuentros, 0), COALESCE(a.observaciones, 0)) <> (COALESCE(r.encuentros, 0), COALESCE(r.observaciones, 0))
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION series_reconciliar() RETURNS INTEGER AS $$
+DECLARE
+    desviados INTEGER;
+BEGIN
+    IF NOT pg_try_advisory_xact_lock(740012) THEN
+        RETURN NULL;
+    END IF;
+
+    WITH aplicados AS (
+        INSERT INTO series_diarias AS s (dia, sede_id, tipo_id, medico_id, encuentros, observaciones)
+        SELECT * FROM series_diferencias()
+        ON CONFLICT (dia, sede_id, tipo_id, medico_id) DO UPDATE
+            SET encuentros = s.encuentros + EXCLUDED.encuentros, observaciones = s.observaciones + EXCLUDED.observaciones
+        RETURNING 1
+    )
+    SELECT COUNT(*) INTO desviados FROM aplicados;
+
+    DELETE FROM series_diarias WHERE encuentros = 0 AND observaciones = 0;
+    RETURN desviados;
+END
+$$ LANGUAGE plpgsql;
+
+SELECT series_reconciliar();
@@ -0,0 +1,232 @@
+-- Convierte encuentros_medicos y observaciones_clinicas de una base existente en tablas particionadas
+-- por mes, como las crea init.sql:
+--   python -m app.migraciones aplicar --hasta 019
+-- con el runner, que la registra en schema_migraciones bajo su advisory lock (con psql directo
+-- quedaría sin registrar y el siguiente aplicar intentaría correrla de nuevo).
+-- Copia todas las filas en una sola transacción y bloquea ambas tablas mientras tanto: correrla en una
+-- ventana de mantenimiento, con la aplicación y el worker detenidos. Supone aplicadas 017 y 018 (sus
+-- triggers se recrean sobre las tablas nuevas).
+
+BEGIN;
+
+-- Las tablas actuales quedan a un lado; sus secuencias pasan a las nuevas para conservar los ids
+ALTER TABLE observaciones_clinicas DROP CONSTRAINT IF EXISTS observaciones_clinicas_encuentro_id_fkey;
+ALTER TABLE encuentros_medicos RENAME TO encuentros_medicos_sin_particion;
+ALTER TABLE observaciones_clinicas RENAME TO observaciones_clinicas_sin_particion;
+ALTER INDEX encuentros_medicos_pkey RENAME TO encuentros_medicos_sin_particion_pkey;
+ALTER INDEX observaciones_clinicas_pkey RENAME TO observaciones_clinicas_sin_particion_pkey;
+
+CREATE TABLE encuentros_medicos (
+    LIKE encuentros_medicos_sin_particion INCLUDING DEFAULTS,
+    PRIMARY KEY (id, fecha),
+    FOREIGN KEY (tipo_id) REFERENCES tipos_encuentro_medico(id),
+    FOREIGN KEY (sede_id) REFERENCES sedes(id),
+    FOREIGN KEY (paciente_id) REFERENCES usuarios(id),
+    FOREIGN KEY (medico_id) REFERENCES usuarios(id)
+) PARTITION BY RANGE (fecha);
+
+CREATE TABLE observaciones_clinicas (
+    LIKE observaciones_clinicas_sin_particion INCLUDING DEFAULTS,
+    PRIMARY KEY (id, fecha),
+    FOREIGN KEY (sede_id) REFERENCES sedes(id)
+) PARTITION BY RANGE (fecha);
+
+ALTER SEQUENCE encuentros_medicos_id_seq OWNED BY encuentros_medicos.id;
+ALTER SEQUENCE observaciones_clinicas_id_seq OWNED BY observaciones_clinicas.id;
+
+CREATE TABLE encuentros_medicos_default PARTITION OF encuentros_medicos DEFAULT;
+CREATE TABLE observaciones_clinicas_default PARTITION OF observaciones_clinicas DEFAULT;
+
+CREATE SCHEMA IF NOT EXISTS archivo;
+
+CREATE OR REPLACE FUNCTION particion_mensual(tabla TEXT, mes DATE) RETURNS TEXT AS $$
+DECLARE
+    inicio DATE := date_trunc('month', mes)::DATE;
+    fin DATE := (date_trunc('month', mes) + INTERVAL '1 month')::DATE;
+    nombre TEXT := format('%s_%s', tabla, to_char(mes, 'YYYY_MM'));
+    pendientes BOOLEAN;
+BEGIN
+    IF to_regclass(nombre) IS NOT NULL OR to_regclass('archivo.' || nombre) IS NOT NULL THEN
+        RETURN NULL;
+    END IF;
+    -- Las inserciones que caerían en la partición por defecto esperan mientras se mueven sus filas
+    EXECUTE format('LOCK TABLE %I IN SHARE ROW EXCLUSIVE MODE', tabla || '_default');
+    EXECUTE format('SELECT EXISTS (SELECT 1 FROM %I WHERE fecha >= $1 AND fecha < $2)', tabla || '_default')
+        INTO pendientes USING inicio, fin;
+    IF NOT pendientes THEN
+        EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)', nombre, tabla, inicio, fin);
+    ELSE
+        -- Mover filas entre particiones no dispara los triggers de la tabla madre: estadísticas y series no cambian
+        EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS)', nombre, tabla);
+        EXECUTE format('WITH movidas AS (DELETE FROM %I WHERE fecha >= $1 AND fecha < $2 RETURNING *) '
+                       'INSERT INTO %I SELECT * FROM movidas', tabla || '_default', nombre) USING inicio, fin;
+        EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)', tabla, nombre, inicio, fin);
+    END IF;
+    RETURN nombre;
+END
+$$ LANGUAGE plpgsql;
+
+-- Crea las particiones del mes actual y los siguientes, más las de los meses que tengan filas en la
+-- partición por defecto. Devuelve cuántas creó, o NULL si otra sesión ya lo está haciendo.
+CREATE OR REPLACE FUNCTION crear_particiones(meses_adelante INTEGER DEFAULT 3) RETURNS INTEGER AS $$
+DECLARE
+    creadas INTEGER := 0;
+    tabla TEXT;
+    mes DATE;
+BEGIN
+    IF NOT pg_try_advisory_xact_lock(740013) THEN
+        RETURN NULL;
+    END IF;
+    FOREACH tabla IN ARRAY ARRAY['encuentros_medicos', 'observaciones_clinicas'] LOOP
+        FOR mes IN EXECUTE format(
+            'SELECT generate_series(date_trunc(''month'', CURRENT_DATE), '
+            'date_trunc(''month'', CURRENT_DATE) + make_interval(months => $1), INTERVAL ''1 month'')::DATE '
+            'UNION SELECT DISTINCT date_trunc(''month'', fecha)::DATE FROM %I', tabla || '_default'
+        ) USING meses_adelante LOOP
+            IF particion_mensual(tabla, mes) IS NOT NULL THEN
+                creadas := creadas + 1;
+            END IF;
+        END LOOP;
+    END LOOP;
+    RETURN creadas;
+END
+$$ LANGUAGE plpgsql;
+
+-- Pasa un mes al archivo. La partición conserva sus índices, que se reutilizan al colgarla de
+-- archivo.<tabla>. Con espacio se mueve también de tablespace (reescribe la tabla y sus índices).
+CREATE OR REPLACE FUNCTION archivar_particion(tabla TEXT, mes DATE, espacio TEXT DEFAULT NULL) RETURNS TEXT AS $$
+DECLARE
+    inicio DATE := date_trunc('month', mes)::DATE;
+    fin DATE := (date_trunc('month', mes) + INTERVAL '1 month')::DATE;
+    nombre TEXT := format('%s_%s', tabla, to_char(mes, 'YYYY_MM'));
+    indice REGCLASS;
+BEGIN
+    IF to_regclass(nombre) IS NULL THEN
+        RETURN NULL;
+    END IF;
+    EXECUTE format('ALTER TABLE %I DETACH PARTITION %I', tabla, nombre);
+    EXECUTE format('ALTER TABLE %I SET SCHEMA archivo', nombre);
+    IF espacio IS NOT NULL THEN
+        EXECUTE format('ALTER TABLE archivo.%I SET TABLESPACE %I', nombre, espacio);
+        FOR indice IN SELECT indexrelid::REGCLASS FROM pg_index WHERE indrelid = format('archivo.%I', nombre)::REGCLASS LOOP
+            EXECUTE format('ALTER INDEX %s SET TABLESPACE %I', indice, espacio);
+        END LOOP;
+    END IF;
+    EXECUTE format('ALTER TABLE archivo.%I ATTACH PARTITION archivo.%I FOR VALUES FROM (%L) TO (%L)', tabla, nombre, inicio, fin);
+    RETURN 'archivo.' || nombre;
+END
+$$ LANGUAGE plpgsql;
+
+-- Una partición por cada mes con datos, antes de copiar: las filas van directo a su mes
+SELECT particion_mensual('encuentros_medicos', mes::DATE)
+FROM generate_series((SELECT date_trunc('month', MIN(fecha)) FROM encuentros_medicos_sin_particion),
+                     date_trunc('month', CURRENT_DATE), INTERVAL '1 month') mes;
+SELECT particion_mensual('observaciones_clinicas', mes::DATE)
+FROM generate_series((SELECT date_trunc('month', MIN(fecha)) FROM observaciones_clinicas_sin_particion),
+                     date_trunc('month', CURRENT_DATE), INTERVAL '1 month') mes;
+SELECT crear_particiones(3);
+
+-- La copia se hace antes de crear los triggers: estadísticas y series ya cuentan estas filas
+INSERT INTO encuentros_medicos SELECT * FROM encuentros_medicos_sin_particion;
+INSERT INTO observaciones_clinicas SELECT * FROM observaciones_clinicas_sin_particion;
+
+-- Las funciones de claves reciben la fila de la tabla: dependen de su tipo y se recrean sobre el nuevo
+DROP FUNCTION estadisticas_claves_encuentro(encuentros_medicos_sin_particion);
+DROP FUNCTION estadisticas_claves_observacion(observaciones_clinicas_sin_particion);
+CREATE FUNCTION estadisticas_claves_encuentro(e encuentros_medicos) RETURNS TABLE(dimension TEXT, clave INTEGER) AS $$
+    SELECT 'encuentros', 0
+    UNION ALL SELECT 'encuentros_tipo', e.tipo_id WHERE e.tipo_id IS NOT NULL
+    UNION ALL SELECT 'encuentros_sede', e.sede_id WHERE e.sede_id IS NOT NULL
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE FUNCTION estadisticas_claves_observacion(o observaciones_clinicas) RETURNS TABLE(dimension TEXT, clave INTEGER) AS $$
+    SELECT 'observaciones', 0
+$$ LANGUAGE sql IMMUTABLE;
+
+DROP TABLE observaciones_clinicas_sin_particion;
+DROP TABLE encuentros_medicos_sin_particion;
+
+CREATE INDEX idx_encuentros_fecha ON encuentros_medicos(fecha DESC, id DESC);
+CREATE INDEX idx_encuentros_paciente ON encuentros_medicos(paciente_id, fecha DESC, id DESC);
+CREATE INDEX idx_encuentros_medico ON encuentros_medicos(medico_id, fecha DESC, id DESC);
+CREATE INDEX idx_encuentros_sede ON encuentros_medicos(sede_id, fecha DESC, id DESC);
+CREATE INDEX idx_encuentros_icd10 ON encuentros_medicos(diagnostico_codigo_icd10 text_pattern_ops, fecha DESC, id DESC);
+CREATE INDEX idx_observaciones_encuentro ON observaciones_clinicas(encuentro_id);
+CREATE INDEX idx_observaciones_fecha ON observaciones_clinicas USING brin(fecha);
+CREATE INDEX idx_encuentros_fhir ON encuentros_medicos(fhir_encounter_id);
+CREATE INDEX idx_observaciones_fhir ON observaciones_clinicas(fhir_observation_id);
+CREATE INDEX idx_observaciones_loinc_valor ON observaciones_clinicas(codigo_loinc, unidad_normalizada, valor_normalizado) WHERE valor_normalizado IS NOT NULL;
+CREATE INDEX idx_observaciones_presion ON observaciones_clinicas(presion_sistolica, presion_diastolica) WHERE presion_sistolica IS NOT NULL;
+
+CREATE TABLE archivo.encuentros_medicos (LIKE encuentros_medicos INCLUDING ALL) PARTITION BY RANGE (fecha);
+CREATE TABLE archivo.observaciones_clinicas (LIKE observaciones_clinicas INCLUDING ALL) PARTITION BY RANGE (fecha);
+
+-- La reconciliación cuenta también las particiones archivadas
+CREATE OR REPLACE FUNCTION estadisticas_diferencias() RETURNS TABLE(dimension TEXT, clave INTEGER, delta BIGINT) AS $$
+    WITH recuento AS (
+        SELECT c.dimension, c.clave, COUNT(*)::BIGINT AS total
+        FROM usuarios u, LATERAL estadisticas_claves_usuario(u) c GROUP BY c.dimension, c.clave
+        UNION ALL
+        SELECT c.dimension, c.clave, COUNT(*)::BIGINT
+        FROM (SELECT * FROM encuentros_medicos UNION ALL SELECT * FROM archivo.encuentros_medicos) e,
+             LATERAL estadisticas_claves_encuentro(ROW(e.*)::encuentros_medicos) c
+        GROUP BY c.dimension, c.clave
+        UNION ALL
+        SELECT 'observaciones', 0, (SELECT COUNT(*) FROM observaciones_clinicas) + (SELECT COUNT(*) FROM archivo.observaciones_clinicas)
+    )
+    SELECT dimension, clave, (COALESCE(r.total, 0) - COALESCE(a.total, 0))::BIGINT
+    FROM (SELECT dimension, clave, SUM(total) AS total FROM estadisticas GROUP BY dimension, clave) a
+    FULL JOIN recuento r USING (dimension, clave)
+    WHERE COALESCE(a.total, 0) <> COALESCE(r.total, 0)
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION series_diferencias() RETURNS TABLE(dia DATE, sede_id INTEGER, tipo_id INTEGER, medico_id INTEGER,
+                                                   encuentros BIGINT, observaciones BIGINT) AS $$
+    WITH recuento AS (
+        SELECT dia, sede_id, tipo_id, medico_id, SUM(encuentros)::BIGINT AS encuentros, SUM(observaciones)::BIGINT AS observaciones
+        FROM (
+            SELECT fecha::DATE AS dia, COALESCE(sede_id, 0) AS sede_id, COALESCE(tipo_id, 0) AS tipo_id,
+                   COALESCE(medico_id, 0) AS medico_id, COUNT(*) AS encuentros, 0 AS observaciones
+            FROM (SELECT * FROM encuentros_medicos UNION ALL SELECT * FROM archivo.encuentros_medicos) e GROUP BY 1, 2, 3, 4
+            UNION ALL
+            SELECT o.fecha::DATE, COALESCE(o.sede_id, 0), COALESCE(e.tipo_id, 0), COALESCE(e.medico_id, 0), 0, COUNT(*)
+            FROM (SELECT * FROM observaciones_clinicas UNION ALL SELECT * FROM archivo.observaciones_clinicas) o
+            LEFT JOIN (SELECT * FROM encuentros_medicos UNION ALL SELECT * FROM archivo.encuentros_medicos) e ON e.id = o.encuentro_id
+            GROUP BY 1, 2, 3, 4
+        ) t GROUP BY 1, 2, 3, 4
+    )
+    SELECT dia, sede_id, tipo_id, medico_id,
+           (COALESCE(r.encuentros, 0) - COALESCE(a.encuentros, 0))::BIGINT,
+           (COALESCE(r.observaciones, 0) - COALESCE(a.observaciones, 0))::BIGINT
+    FROM series_diarias a
+    FULL JOIN recuento r USING (dia, sede_id, tipo_id, medico_id)
+    WHERE (COALESCE(a.encuentros, 0), COALESCE(a.observaciones, 0)) <> (COALESCE(r.encuentros, 0), COALESCE(r.observaciones, 0))
+$$ LANGUAGE sql STABLE;
+
+CREATE TRIGGER estadisticas_encuentros_insert AFTER INSERT ON encuentros_medicos
+    REFERENCING NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION estadisticas_aplicar('estadisticas_claves_encuentro');
+CREATE TRIGGER estadisticas_encuentros_update AFTER UPDATE ON encuentros_medicos
+    REFERENCING OLD TABLE AS anteriores NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION estadisticas_aplicar('estadisticas_claves_encuentro');
+CREATE TRIGGER estadisticas_encuentros_delete AFTER DELETE ON encuentros_medicos
+    REFERENCING OLD TABLE AS anteriores FOR EACH STATEMENT EXECUTE FUNCTION estadisticas_aplicar('estadisticas_claves_encuentro');
+CREATE TRIGGER estadisticas_observaciones_insert AFTER INSERT ON observaciones_clinicas
+    REFERENCING NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION estadisticas_aplicar('estadisticas_claves_observacion');
+CREATE TRIGGER estadisticas_observaciones_delete AFTER DELETE ON observaciones_clinicas
+    REFERENCING OLD TABLE AS anteriores FOR EACH STATEMENT EXECUTE FUNCTION estadisticas_aplicar('estadisticas_claves_observacion');
+CREATE TRIGGER series_encuentros_insert AFTER INSERT ON encuentros_medicos
+    REFERENCING NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION series_encuentros();
+CREATE TRIGGER series_encuentros_update AFTER UPDATE ON encuentros_medicos
+    REFERENCING OLD TABLE AS anteriores NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION series_encuentros();
+CREATE TRIGGER series_encuentros_delete AFTER DELETE ON encuentros_medicos
+    REFERENCING OLD TABLE AS anteriores FOR EACH STATEMENT EXECUTE FUNCTION series_encuentros();
+CREATE TRIGGER series_observaciones_insert AFTER INSERT ON observaciones_clinicas
+    REFERENCING NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION series_observaciones();
+CREATE TRIGGER series_observaciones_update AFTER UPDATE ON observaciones_clinicas
+    REFERENCING OLD TABLE AS anteriores NEW TABLE AS nuevas FOR EACH STATEMENT EXECUTE FUNCTION series_observaciones();
+CREATE TRIGGER series_observaciones_delete AFTER DELETE ON observaciones_clinicas
+    REFERENCING OLD TABLE AS anteriores FOR EACH STATEMENT EXECUTE FUNCTION series_observaciones();
+
+COMMIT;
+
+ANALYZE encuentros_medicos;
+ANALYZE observaciones_clinicas;
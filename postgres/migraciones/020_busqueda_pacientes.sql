@@ -0,0 +1,25 @@
+-- Búsqueda aproximada de pacientes sobre una base existente, como la crea init.sql:
+--   python -m app.migraciones aplicar --hasta 020
+-- con el runner, que la registra en schema_migraciones bajo su advisory lock (con psql directo
+-- quedaría sin registrar y el siguiente aplicar intentaría correrla de nuevo).
+-- Los índices se construyen con CONCURRENTLY (fuera de transacción): la aplicación puede seguir arriba.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS unaccent;
+
+CREATE OR REPLACE FUNCTION normalizar_busqueda(texto TEXT) RETURNS TEXT AS $$
+    SELECT lower(public.unaccent('public.unaccent'::regdictionary, texto))
+$$ LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE;
+
+CREATE OR REPLACE FUNCTION nombre_busqueda(nombres TEXT, apellidos TEXT) RETURNS TEXT AS $$
+    SELECT normalizar_busqueda(nombres || ' ' || apellidos)
+$$ LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_usuarios_documento_prefijo ON usuarios(numero_documento text_pattern_ops);
+DROP INDEX CONCURRENTLY IF EXISTS idx_usuarios_documento;
+ALTER INDEX idx_usuarios_documento_prefijo RENAME TO idx_usuarios_documento;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_usuarios_nombre_trgm ON usuarios USING gin(nombre_busqueda(nombres, apellidos) gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_usuarios_documento_trgm ON usuarios USING gin(numero_documento gin_trgm_ops);
+
+ANALYZE usuarios;
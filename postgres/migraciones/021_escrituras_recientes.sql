@@ -0,0 +1,9 @@
+-- Read-your-writes por usuario con réplica de lectura (get_db_lectura en app/database.py):
+--   python -m app.migraciones aplicar --hasta 021
+-- Última escritura de cada usuario autenticado, consultada en el primario. UNLOGGED: no genera WAL ni
+-- se replica, y tras una caída del primario queda vacía, lo que sólo cuesta unas lecturas en la réplica.
+
+CREATE UNLOGGED TABLE IF NOT EXISTS escrituras_recientes (
+    numero_documento VARCHAR(50) PRIMARY KEY,
+    momento TIMESTAMPTZ NOT NULL DEFAULT now()
+);
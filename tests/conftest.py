@@ -0,0 +1,7 @@
+import os
+
+# Las pruebas no abren conexiones: sólo ejercitan lógica pura o SQLite en memoria.
+# Settings exige estas variables, así que se les da un valor ficticio si no vienen del entorno.
+os.environ.setdefault("DATABASE_URL", "postgresql://pruebas@localhost/pruebas")
+os.environ.setdefault("FHIR_SERVER_URL", "http://localhost:8080/fhir")
+os.environ.setdefault("SECRET_KEY", "pruebas")
@@ -0,0 +1,28 @@
+import pytest
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("pydantic_settings")
+from app.services.busqueda import resaltar
+
+def test_resalta_sin_importar_tildes_ni_mayusculas():
+    assert resaltar("José Pérez", "jose perez") == "<mark>José</mark> <mark>Pérez</mark>"
+    assert resaltar("Jose Perez", "JOSÉ") == "<mark>Jose</mark> Perez"
+
+def test_resalta_dentro_de_la_palabra():
+    assert resaltar("Mariana", "ana") == "Mari<mark>ana</mark>"
+
+def test_apariciones_solapadas_se_unen():
+    assert resaltar("aaaa", "aaa") == "<mark>aaaa</mark>"
+
+def test_ignora_palabras_de_una_letra():
+    assert resaltar("Ana María", "a") == "Ana María"
+
+def test_escapa_html():
+    assert resaltar("<b>Ana</b>", "ana") == "&lt;b&gt;<mark>Ana</mark>&lt;/b&gt;"
+
+def test_documento():
+    assert resaltar("1032456789", "1032") == "<mark>1032</mark>456789"
+
+@pytest.mark.parametrize("texto", [None, ""])
+def test_texto_vacio(texto):
+    assert resaltar(texto, "ana") == texto
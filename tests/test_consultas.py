@@ -0,0 +1,76 @@
+from datetime import date, datetime, timedelta
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("pydantic_settings")
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from app.database import Base
+from app.models.models import EncuentroMedico, ObservacionClinica, Rol, Sede, TipoDocumento, TipoEncuentroMedico, Usuario
+from app.services.consultas import asegurar_sentencias, consultas_medico, historial_paciente, paciente_con_documento
+
+# Las rutas de historial, PDF y consultas del médico deben ejecutar un número fijo de sentencias,
+# sin importar cuántos encuentros u observaciones haya. SQLite en memoria basta: las consultas no
+# usan nada propio de PostgreSQL.
+TABLAS = [m.__table__ for m in (TipoDocumento, Rol, Sede, Usuario, TipoEncuentroMedico, EncuentroMedico, ObservacionClinica)]
+
+@pytest.fixture(params=[1, 25])
+def base(request):
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine, tables=TABLAS)
+    with Session(engine) as db:
+        db.add_all([
+            TipoDocumento(id=1, nombre="Cédula de Ciudadanía", prefijo="CC"),
+            Rol(id=1, nombre="Medico"), Rol(id=2, nombre="Paciente"),
+            Sede(id=1, nombre="Sede Principal", ciudad="Bogotá"),
+            TipoEncuentroMedico(id=1, nombre="Consulta General")
+        ])
+        for usuario_id, rol_id in ((1, 1), (2, 2)):
+            db.add(Usuario(id=usuario_id, nombres="Nombre", apellidos="Apellido", tipo_documento_id=1,
+                           numero_documento=str(usuario_id), fecha_nacimiento=date(1990, 1, 1),
+                           sede_registro_id=1, rol_id=rol_id, password_hash="x"))
+        inicio = datetime(2024, 1, 1)
+        for i in range(request.param):
+            encuentro = EncuentroMedico(fecha=inicio + timedelta(days=i), tipo_id=1, sede_id=1, paciente_id=2, medico_id=1)
+            encuentro.observaciones = [
+                ObservacionClinica(fecha=encuentro.fecha, descripcion="Peso", valor="70", unidad="kg"),
+                ObservacionClinica(fecha=encuentro.fecha, descripcion="Talla", valor="170", unidad="cm")
+            ]
+            db.add(encuentro)
+        db.commit()
+    yield engine, request.param
+    engine.dispose()
+
+def test_historial_paciente(base):
+    engine, total = base
+    with Session(engine) as db, asegurar_sentencias(2):
+        encuentros = db.scalars(historial_paciente(2)).all()
+        # Lo mismo que leen la vista, el JSON y el PDF
+        vistos = [(e.tipo.nombre, e.sede.nombre, e.medico.nombres, [o.valor for o in e.observaciones]) for e in encuentros]
+    assert len(vistos) == total
+    assert all(len(obs) == 2 for *_, obs in vistos)
+
+def test_historia_pdf(base):
+    engine, total = base
+    with Session(engine) as db, asegurar_sentencias(3):
+        paciente = db.scalar(paciente_con_documento(2))
+        prefijo = paciente.tipo_documento.prefijo
+        encuentros = db.scalars(historial_paciente(2)).all()
+        observaciones = sum(len(e.observaciones) for e in encuentros)
+    assert prefijo == "CC"
+    assert observaciones == 2 * total
+
+def test_consultas_medico(base):
+    engine, total = base
+    with Session(engine) as db, asegurar_sentencias(1):
+        filas = [(e.paciente.nombres, e.tipo.nombre, e.sede.nombre) for e in db.scalars(consultas_medico(1)).all()]
+    assert len(filas) == total
+
+def test_asegurar_sentencias_falla_con_cargas_perezosas(base):
+    engine, _ = base
+    with Session(engine) as db:
+        with pytest.raises(AssertionError):
+            with asegurar_sentencias(1):
+                for e in db.scalars(consultas_medico(1)).all():
+                    e.observaciones  # no viene en la consulta: una sentencia por encuentro
@@ -0,0 +1,109 @@
+import pytest
+from app.services import fhir_breaker
+from app.services.fhir_breaker import CircuitBreaker, HAPINoDisponible
+
+class Reloj:
+    def __init__(self):
+        self.ahora = 1000.0
+
+    def __call__(self) -> float:
+        return self.ahora
+
+@pytest.fixture
+def reloj(monkeypatch):
+    reloj = Reloj()
+    monkeypatch.setattr(fhir_breaker.time, "monotonic", reloj)
+    return reloj
+
+def nuevo(**kwargs) -> CircuitBreaker:
+    opciones = {"failure_threshold": 3, "slow_call_seconds": 5.0, "open_seconds": 30.0, "half_open_max_calls": 1}
+    opciones.update(kwargs)
+    return CircuitBreaker(**opciones)
+
+def abrir(breaker: CircuitBreaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.permitir()
+        breaker.registrar_fallo("error")
+
+def test_se_abre_tras_fallos_consecutivos(reloj):
+    breaker = nuevo()
+    for _ in range(2):
+        breaker.permitir()
+        breaker.registrar_fallo("error")
+    assert breaker.estado == "cerrado"
+    breaker.permitir()
+    breaker.registrar_fallo("error")
+    assert breaker.estado == "abierto"
+    with pytest.raises(HAPINoDisponible):
+        breaker.permitir()
+    assert breaker.rechazadas == 1
+
+def test_un_exito_reinicia_los_fallos(reloj):
+    breaker = nuevo()
+    for _ in range(2):
+        breaker.permitir()
+        breaker.registrar_fallo("error")
+    breaker.permitir()
+    breaker.registrar_exito(0.1)
+    breaker.permitir()
+    breaker.registrar_fallo("error")
+    assert breaker.estado == "cerrado"
+    assert breaker.fallos_consecutivos == 1
+
+def test_llamada_lenta_cuenta_como_fallo(reloj):
+    breaker = nuevo(failure_threshold=1)
+    breaker.permitir()
+    breaker.registrar_exito(6.0)
+    assert breaker.estado == "abierto"
+    assert breaker.llamadas_lentas == 1
+
+def test_sonda_exitosa_cierra(reloj):
+    breaker = nuevo()
+    abrir(breaker)
+    reloj.ahora += 30
+    breaker.permitir()
+    assert breaker.estado == "semiabierto"
+    with pytest.raises(HAPINoDisponible):
+        breaker.permitir()
+    breaker.registrar_exito(0.1)
+    assert breaker.estado == "cerrado"
+
+def test_sonda_fallida_vuelve_a_abrir(reloj):
+    breaker = nuevo()
+    abrir(breaker)
+    reloj.ahora += 30
+    breaker.permitir()
+    breaker.registrar_fallo("error")
+    assert breaker.estado == "abierto"
+    assert breaker.aperturas == 2
+
+def test_sonda_cancelada_devuelve_su_cupo(reloj):
+    breaker = nuevo()
+    abrir(breaker)
+    reloj.ahora += 30
+    breaker.permitir()
+    breaker.liberar()
+    assert breaker.disponible
+    breaker.permitir()
+    breaker.registrar_exito(0.1)
+    assert breaker.estado == "cerrado"
+
+def test_sondas_sin_respuesta_vuelven_a_abrir(reloj):
+    breaker = nuevo()
+    abrir(breaker)
+    reloj.ahora += 30
+    breaker.permitir()  # sonda que nunca termina
+    reloj.ahora += 10
+    with pytest.raises(HAPINoDisponible):
+        breaker.permitir()
+    assert breaker.estado == "semiabierto"
+
+    reloj.ahora += 20
+    with pytest.raises(HAPINoDisponible):
+        breaker.permitir()
+    assert breaker.estado == "abierto"
+
+    reloj.ahora += 30
+    breaker.permitir()
+    breaker.registrar_exito(0.1)
+    assert breaker.estado == "cerrado"
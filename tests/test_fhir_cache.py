@@ -0,0 +1,70 @@
+import pytest
+from app.services import fhir_cache
+from app.services.fhir_cache import FHIRCache
+
+class Reloj:
+    def __init__(self):
+        self.ahora = 1000.0
+
+    def __call__(self) -> float:
+        return self.ahora
+
+@pytest.fixture
+def reloj(monkeypatch):
+    reloj = Reloj()
+    monkeypatch.setattr(fhir_cache.time, "monotonic", reloj)
+    return reloj
+
+def test_get_devuelve_lo_guardado(reloj):
+    cache = FHIRCache(max_entries=10, ttl=60)
+    cache.put("Patient", "1", {"id": "1"}, etag='W/"3"')
+    entrada = cache.get("Patient", "1")
+    assert entrada.value == {"id": "1"}
+    assert entrada.etag == 'W/"3"'
+    assert entrada.fresh
+    assert cache.get("Patient", "2") is None
+
+def test_lru_descarta_la_menos_usada(reloj):
+    cache = FHIRCache(max_entries=2, ttl=60)
+    cache.put("Patient", "1", "a")
+    cache.put("Patient", "2", "b")
+    cache.get("Patient", "1")
+    cache.put("Patient", "3", "c")
+    assert cache.get("Patient", "2") is None
+    assert cache.get("Patient", "1").value == "a"
+    assert cache.get("Patient", "3").value == "c"
+    assert cache.evictions == 1
+
+def test_vencida_conserva_el_etag_para_revalidar(reloj):
+    cache = FHIRCache(max_entries=10, ttl=60)
+    cache.put("Observation", "5", "v1", etag='W/"1"')
+    reloj.ahora += 60
+    entrada = cache.get("Observation", "5")
+    assert not entrada.fresh
+    assert entrada.etag == 'W/"1"'
+    # Un 304 de HAPI renueva la entrada sin volver a descargarla
+    cache.touch("Observation", "5")
+    assert cache.get("Observation", "5").fresh
+
+def test_ttl_por_entrada(reloj):
+    cache = FHIRCache(max_entries=10, ttl=60)
+    cache.put("Bundle", "busqueda", "x", ttl=5)
+    reloj.ahora += 5
+    assert not cache.get("Bundle", "busqueda").fresh
+
+def test_invalidate(reloj):
+    cache = FHIRCache(max_entries=10, ttl=60)
+    cache.put("Patient", "1", "a")
+    cache.invalidate("Patient", "1")
+    cache.invalidate("Patient", "1")
+    assert cache.get("Patient", "1") is None
+    assert cache.invalidations == 1
+
+def test_stats(reloj):
+    cache = FHIRCache(max_entries=10, ttl=60)
+    assert cache.stats()["hit_ratio"] is None
+    cache.put("Patient", "1", "a")
+    cache.hits, cache.misses, cache.revalidations = 2, 1, 1
+    estadisticas = cache.stats()
+    assert estadisticas["entries"] == 1
+    assert estadisticas["hit_ratio"] == 0.75
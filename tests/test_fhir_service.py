@@ -0,0 +1,105 @@
+import asyncio
+import json
+import pytest
+
+httpx = pytest.importorskip("httpx")
+pytest.importorskip("pydantic_settings")
+from app.config import settings
+from app.services.fhir_service import FHIRService
+
+class Busquedas:
+    # search_pages de reemplazo: Observation nunca se acaba, Encounter falla en la página indicada
+    def __init__(self, falla_encounter_en=None, paginas_encounter=3):
+        self.falla_encounter_en = falla_encounter_en
+        self.paginas_encounter = paginas_encounter
+        self.abiertas = 0
+
+    async def __call__(self, resource_type: str, params: dict):
+        self.abiertas += 1
+        try:
+            numero = 0
+            while resource_type == "Observation" or numero < self.paginas_encounter:
+                numero += 1
+                if resource_type == "Encounter" and numero == self.falla_encounter_en:
+                    raise httpx.ConnectError("HAPI no responde")
+                yield [{"resourceType": resource_type, "id": str(numero)}]
+                await asyncio.sleep(0)
+        finally:
+            self.abiertas -= 1
+
+def pendientes() -> list:
+    return [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+
+@pytest.fixture
+def servicio(monkeypatch):
+    monkeypatch.setattr(settings, "FHIR_STREAM_BUFFER_PAGES", 2)
+    return FHIRService()
+
+def test_historial_falla_en_encounters_sin_dejar_tareas(servicio):
+    busquedas = Busquedas(falla_encounter_en=2)
+    servicio.search_pages = busquedas
+
+    async def leer():
+        partes = [parte async for parte in servicio.stream_patient_history("15")]
+        # La cola de Observations quedó llena: el productor debe haber terminado igual
+        return "".join(partes), pendientes()
+
+    documento, tareas = asyncio.run(leer())
+    historial = json.loads(documento)
+    assert [e["id"] for e in historial["encounters"]] == ["1"]
+    assert historial["observations"] == []
+    assert "HAPI no responde" in historial["error"]
+    assert tareas == []
+    assert busquedas.abiertas == 0
+    assert servicio.cache.get("PatientHistory", "15") is None
+
+def test_cliente_desconectado_detiene_el_productor(servicio):
+    busquedas = Busquedas()
+    servicio.search_pages = busquedas
+
+    async def abandonar():
+        flujo = servicio.stream_patient_history("15")
+        await flujo.__anext__()
+        await flujo.__anext__()
+        await asyncio.sleep(0.01)  # el productor llena la cola y queda esperando lugar
+        await flujo.aclose()
+        return pendientes()
+
+    assert asyncio.run(abandonar()) == []
+    assert busquedas.abiertas == 0
+
+class Respuesta:
+    def __init__(self, status_code: int, recurso: dict = None):
+        self.status_code = status_code
+        self.headers = {}
+        self._recurso = recurso
+
+    def json(self) -> dict:
+        return self._recurso
+
+def con_respuestas(servicio: FHIRService, *respuestas):
+    pendientes_de_enviar = list(respuestas)
+
+    async def request(method, path, operation="read", **kwargs):
+        return pendientes_de_enviar.pop(0)
+
+    servicio._request = request
+
+@pytest.mark.parametrize("status", [500, 502, 503])
+def test_read_con_hapi_degradado_sirve_la_copia_vencida(servicio, status):
+    paciente = {"resourceType": "Patient", "id": "15", "meta": {"versionId": "2"}}
+    con_respuestas(servicio, Respuesta(200, paciente), Respuesta(status))
+    assert asyncio.run(servicio.read("Patient", "15")) == paciente
+
+    servicio.cache.get("Patient", "15").ttl = 0
+    assert asyncio.run(servicio.read("Patient", "15")) == paciente
+    assert servicio.cache.stale == 1
+    assert servicio.cache.get("Patient", "15") is not None
+
+@pytest.mark.parametrize("status", [404, 410])
+def test_read_descarta_lo_que_ya_no_existe(servicio, status):
+    con_respuestas(servicio, Respuesta(200, {"resourceType": "Patient", "id": "15"}), Respuesta(status))
+    asyncio.run(servicio.read("Patient", "15"))
+    servicio.cache.get("Patient", "15").ttl = 0
+    assert asyncio.run(servicio.read("Patient", "15")) is None
+    assert servicio.cache.get("Patient", "15") is None
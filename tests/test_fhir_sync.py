@@ -0,0 +1,76 @@
+import asyncio
+from datetime import date, datetime, timedelta
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("httpx")
+pytest.importorskip("pydantic_settings")
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.database import Base
+from app.models.models import (EncuentroMedico, ObservacionClinica, OutboxFHIR, Rol, Sede, TipoDocumento,
+                               TipoEncuentroMedico, Usuario)
+from app.services import fhir_sync
+from app.services.fhir_sync import FHIRSyncWorker
+
+TABLAS = [m.__table__ for m in (TipoDocumento, Rol, Sede, Usuario, TipoEncuentroMedico, EncuentroMedico,
+                                ObservacionClinica, OutboxFHIR)]
+
+@pytest.fixture
+def sesiones(tmp_path, monkeypatch):
+    # Archivo y no memoria: el worker abre sus sesiones desde asyncio.to_thread
+    engine = create_engine(f"sqlite:///{tmp_path / 'outbox.db'}")
+    Base.metadata.create_all(engine, tables=TABLAS)
+    Sesion = sessionmaker(bind=engine)
+    with Sesion() as db:
+        db.add_all([
+            TipoDocumento(id=1, nombre="Cédula de Ciudadanía", prefijo="CC"),
+            Rol(id=1, nombre="Medico"), Rol(id=2, nombre="Paciente"),
+            Sede(id=1, nombre="Sede Principal", ciudad="Bogotá"),
+            TipoEncuentroMedico(id=1, nombre="Consulta General", codigo_fhir="AMB")
+        ])
+        for usuario_id, rol_id in ((1, 1), (2, 2)):
+            db.add(Usuario(id=usuario_id, nombres="Nombre", apellidos="Apellido", tipo_documento_id=1,
+                           numero_documento=str(usuario_id), fecha_nacimiento=date(1990, 1, 1),
+                           sede_registro_id=1, rol_id=rol_id, password_hash="x"))
+        db.add(EncuentroMedico(id=1, fecha=datetime(2024, 1, 1), tipo_id=1, sede_id=1, paciente_id=2, medico_id=1))
+        db.add(OutboxFHIR(id=1, operacion="sync_encounter", entidad_id=1, payload={}, estado="pendiente",
+                          intentos=0, proximo_intento=datetime.now()))
+        db.commit()
+    monkeypatch.setattr(fhir_sync, "SessionLocal", Sesion)
+    yield Sesion
+    engine.dispose()
+
+def ronda(worker: FHIRSyncWorker, Sesion) -> OutboxFHIR:
+    # Adelanta el reloj de la entrada para que el worker la reclame de nuevo
+    with Sesion() as db:
+        db.query(OutboxFHIR).update({"proximo_intento": datetime.now() - timedelta(seconds=1)})
+        db.commit()
+    asyncio.run(worker.drain_once())
+    with Sesion() as db:
+        return db.get(OutboxFHIR, 1)
+
+def test_encuentro_espera_al_patient_sin_gastar_intentos(sesiones, monkeypatch):
+    worker = FHIRSyncWorker()
+    worker.max_attempts = 3
+
+    for _ in range(worker.max_attempts + 2):
+        entrada = ronda(worker, sesiones)
+        assert entrada.estado == "pendiente"
+        assert entrada.intentos == 0
+        assert entrada.proximo_intento > datetime.now()
+    assert "Patient" in entrada.ultimo_error
+
+    # Cuando el lote de pacientes le asigna su Patient, el encuentro se envía
+    async def crear_bundle(encuentro, observaciones, paciente_fhir_id, medico_id):
+        assert paciente_fhir_id == "p-2"
+        return {"encounter": "e-1", "observations": []}
+
+    monkeypatch.setattr(fhir_sync.fhir_service, "create_encounter_bundle", crear_bundle)
+    with sesiones() as db:
+        db.query(Usuario).filter(Usuario.id == 2).update({"fhir_patient_id": "p-2"})
+        db.commit()
+    assert ronda(worker, sesiones).estado == "completado"
+    with sesiones() as db:
+        assert db.get(EncuentroMedico, 1).fhir_encounter_id == "e-1"
@@ -0,0 +1,68 @@
+from types import SimpleNamespace
+import pytest
+from app.services.mediciones import Medicion, parsear, parsear_lote, ucum
+
+def test_presion_arterial():
+    medicion = parsear("120/80")
+    assert (medicion.sistolica, medicion.diastolica) == (120.0, 80.0)
+    assert medicion.unidad == "mmHg"
+    assert medicion.unidad_normalizada == "mm[Hg]"
+    assert medicion.valor is None
+    assert medicion.es_presion
+
+def test_presion_con_unidad_distinta_no_es_medicion():
+    assert parsear("120/80", "kg") == Medicion()
+
+def test_unidad_pegada_al_numero():
+    medicion = parsear("70kg")
+    assert (medicion.valor, medicion.unidad, medicion.unidad_ucum) == (70.0, "kg", "kg")
+    assert (medicion.valor_normalizado, medicion.unidad_normalizada) == (70.0, "kg")
+
+def test_fahrenheit_se_normaliza_a_celsius():
+    medicion = parsear("98.6", "F")
+    assert medicion.unidad_ucum == "[degF]"
+    assert medicion.unidad_normalizada == "Cel"
+    assert medicion.valor_normalizado == pytest.approx(37.0)
+
+def test_glucosa_en_mg_dl_pasa_a_mmol_l():
+    medicion = parsear("90", "mg/dl", descripcion="Glucosa en ayunas")
+    assert medicion.unidad_normalizada == "mmol/L"
+    assert medicion.valor_normalizado == pytest.approx(90 * 10 / 180.16, abs=1e-6)
+
+def test_mg_dl_sin_analito_conocido_no_se_convierte():
+    medicion = parsear("1,5", "mg/dl", descripcion="Creatinina")
+    assert (medicion.valor, medicion.valor_normalizado, medicion.unidad_normalizada) == (1.5, 1.5, "mg/dL")
+
+def test_comparador():
+    medicion = parsear("<5", "mg/L")
+    assert (medicion.comparador, medicion.valor) == ("<", 5.0)
+
+def test_sin_unidad_normaliza_el_valor_tal_cual():
+    medicion = parsear("12")
+    assert (medicion.valor_normalizado, medicion.unidad_normalizada) == (12.0, None)
+
+def test_unidad_desconocida_no_se_normaliza():
+    medicion = parsear("12", "xyz")
+    assert medicion.valor == 12.0
+    assert medicion.valor_normalizado is None
+
+@pytest.mark.parametrize("valor, unidad", [(None, None), ("", None), ("positivo", None), ("70 kg", "lb"), ("12 abc", None)])
+def test_texto_no_numerico(valor, unidad):
+    assert parsear(valor, unidad) == Medicion()
+
+def test_ucum():
+    assert ucum(" MG / DL ") == "mg/dL"
+    assert ucum("lpm") == "/min"
+    assert ucum("desconocida") is None
+    assert ucum(None) is None
+
+def test_parsear_lote_omite_las_filas_de_texto():
+    filas = [
+        SimpleNamespace(id=1, valor="70", unidad="kg", codigo_loinc=None, descripcion="Peso"),
+        SimpleNamespace(id=2, valor="negativo", unidad=None, codigo_loinc=None, descripcion="Prueba"),
+        SimpleNamespace(id=3, valor="130/85", unidad="mmHg", codigo_loinc=None, descripcion="Presión")
+    ]
+    cambios = parsear_lote(filas)
+    assert [c["id"] for c in cambios] == [1, 3]
+    assert cambios[0]["valor_numerico"] == 70.0
+    assert (cambios[1]["presion_sistolica"], cambios[1]["presion_diastolica"]) == (130.0, 85.0)
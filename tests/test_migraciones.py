@@ -0,0 +1,58 @@
+import os
+import re
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("pydantic_settings")
+from app.services.migraciones import DIRECTORIO, _transaccional, disponibles, dividir_sentencias
+
+def test_separa_por_punto_y_coma():
+    assert dividir_sentencias("SELECT 1;\n\nSELECT 2;  ;\nSELECT 3") == ["SELECT 1", "SELECT 2", "SELECT 3"]
+
+def test_respeta_comillas():
+    sql = "INSERT INTO t VALUES ('a;b', 'it''s;'); SELECT \"raro;nombre\" FROM t;"
+    assert dividir_sentencias(sql) == ["INSERT INTO t VALUES ('a;b', 'it''s;')", 'SELECT "raro;nombre" FROM t']
+
+def test_respeta_cuerpos_con_dolar():
+    sql = """
+CREATE FUNCTION f() RETURNS INTEGER AS $$
+BEGIN
+    EXECUTE format($q$ SELECT 1; $q$);
+    RETURN 1;
+END
+$$ LANGUAGE plpgsql;
+SELECT f();
+"""
+    sentencias = dividir_sentencias(sql)
+    assert len(sentencias) == 2
+    assert sentencias[0].endswith("$$ LANGUAGE plpgsql")
+    assert sentencias[1] == "SELECT f()"
+
+def test_descarta_comentarios():
+    sql = "-- uno; dos\nSELECT 1; /* tres; */ SELECT 2; -- cuatro;"
+    assert dividir_sentencias(sql) == ["SELECT 1", "SELECT 2"]
+
+def test_transaccional():
+    assert _transaccional(["CREATE TABLE t (id INT)", "CREATE INDEX i ON t(id)"])
+    assert not _transaccional(["BEGIN", "CREATE TABLE t (id INT)", "COMMIT"])
+    assert not _transaccional(["CREATE INDEX CONCURRENTLY IF NOT EXISTS i ON t(id)"])
+
+def test_disponibles_en_orden(tmp_path):
+    for nombre in ("002_b.sql", "001_a.sql", "notas.txt", "3_sin_ceros.sql"):
+        (tmp_path / nombre).write_text("SELECT 1;", encoding="utf-8")
+    migraciones = disponibles(str(tmp_path))
+    assert [m["version"] for m in migraciones] == ["001", "002"]
+    assert migraciones[0]["checksum"] == migraciones[1]["checksum"]
+
+def test_init_sql_registra_todas_las_migraciones():
+    # Una base creada desde init.sql no debe volver a correr ninguna migración
+    with open(os.path.join(DIRECTORIO, "..", "init.sql"), encoding="utf-8") as f:
+        registradas = re.findall(r"\('(\d{3})', '([\w-]+\.sql)'\)", f.read())
+    assert registradas == [(m["version"], m["nombre"]) for m in disponibles()]
+
+@pytest.mark.parametrize("migracion", disponibles(), ids=lambda m: m["nombre"])
+def test_migraciones_se_dividen(migracion):
+    sentencias = dividir_sentencias(migracion["sql"])
+    assert sentencias
+    assert all(s.strip() and not s.startswith("--") for s in sentencias)
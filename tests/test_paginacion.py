@@ -0,0 +1,31 @@
+from datetime import datetime
+import pytest
+
+fastapi = pytest.importorskip("fastapi")
+from app.services.paginacion import codificar_cursor, decodificar_cursor, pagina
+
+def test_cursor_ida_y_vuelta():
+    fecha = datetime(2024, 3, 1, 14, 30, 5, 123456)
+    cursor = codificar_cursor(fecha, 42)
+    assert "=" not in cursor
+    assert decodificar_cursor(cursor, datetime, int) == (fecha, 42)
+
+def test_cursor_de_un_componente():
+    assert decodificar_cursor(codificar_cursor(7), int) == (7,)
+
+@pytest.mark.parametrize("cursor", ["%%%", "no-es-base64!", codificar_cursor("abc", 1), codificar_cursor(5)])
+def test_cursor_invalido(cursor):
+    # Basura, tipo equivocado y número de componentes distinto del esperado
+    with pytest.raises(fastapi.HTTPException) as error:
+        decodificar_cursor(cursor, datetime, int)
+    assert error.value.status_code == 400
+
+def test_pagina_con_sobrante_devuelve_siguiente():
+    filas = [{"id": i} for i in (5, 4, 3)]
+    resultado = pagina(filas, 2, lambda f: (f["id"],))
+    assert resultado["resultados"] == filas[:2]
+    assert decodificar_cursor(resultado["siguiente"], int) == (4,)
+
+def test_ultima_pagina_sin_siguiente():
+    filas = [{"id": i} for i in (2, 1)]
+    assert pagina(filas, 2, lambda f: (f["id"],)) == {"resultados": filas, "siguiente": None}